@@ -1,11 +1,17 @@
 # app.py (modifié)
 
 import os
-from flask import Flask, render_template, redirect, url_for
+from flask import Flask, Response, jsonify, render_template, redirect, url_for, request
 
 # Importer les blueprints
 from seriale import seriale_bp
 from filmy import filmy_bp
+from download_client import REMOTE, DownloadDaemonUnavailable, query_history, history_trends, get_full_queue_data, get_breakers
+from download_daemon import start_background_services
+import circuit_breaker
+import metrics
+import request_timing
+from job_history import HISTORY_FILTERS
 
 # Vous pouvez également importer downloader_core si vous avez besoin d'accéder à ses fonctions ici,
 # mais les blueprints l'importent et l'utilisent déjà.
@@ -17,11 +23,68 @@ app = Flask(__name__)
 app.register_blueprint(seriale_bp)
 app.register_blueprint(filmy_bp)
 
+# Durée des requêtes par phase (en-tête Server-Timing), journal des requêtes lentes et profilage sur demande
+request_timing.init_app(app)
+
+# Téléchargements, surveillance des épisodes, enrichissement et analyse de la bibliothèque :
+# dans ce processus si l'interface tourne seule, sinon dans download_daemon.py (DOWNLOAD_DAEMON_URL),
+# pour que plusieurs processus web (gunicorn -w N) ne lancent pas chacun leur propre worker.
+# Les processus de vérification (multiprocessing) réimportent ce fichier sous le nom __mp_main__ : rien à y lancer.
+if not REMOTE and __name__ != "__mp_main__":
+    start_background_services()
+
+@app.errorhandler(DownloadDaemonUnavailable)
+def download_daemon_unavailable(e):
+    print(f"Erreur : {e}")
+    return "Le démon de téléchargement est indisponible. Réessayez dans quelques instants.", 503
+
 # La route principale redirige vers la liste des séries
 @app.route("/")
 def index():
     return redirect(url_for('seriale.seriale_list')) # Rediriger par défaut vers les séries
 
+# Métriques au format Prometheus (file d'attente, transferts, caches, latence Xtream/TMDB)
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+# Dernières requêtes plus lentes que SLOW_REQUEST_MS (détail par phase)
+@app.route("/debug/slow_requests")
+def slow_requests_endpoint():
+    return jsonify(request_timing.get_slow_requests())
+
+# État des disjoncteurs Xtream/TMDB (taux d'erreurs et latence sur la fenêtre glissante)
+@app.route("/health/upstream")
+def upstream_health():
+    if not REMOTE:
+        return jsonify(get_breakers())
+    # Interface sur plusieurs processus : disjoncteurs de ce processus web, puis ceux du démon
+    breakers = [dict(b, process="web") for b in circuit_breaker.get_breakers()]
+    return jsonify(breakers + [dict(b, process="daemon") for b in get_breakers()])
+
+# Historique des tentatives de téléchargement : filtres series_id, item_type, since, until (AAAA-MM-JJ), reason, outcome
+def _history_filters():
+    return {key: request.args.get(key, '').strip() or None for key in HISTORY_FILTERS}
+
+@app.route("/history")
+def history_page():
+    filters = _history_filters()
+    weeks = request.args.get("weeks", 12, type=int)
+    trends = history_trends(weeks, filters["item_type"], filters["series_id"])
+    failed_jobs = [job for job in get_full_queue_data() if job.get("failed")]
+    return render_template("history.html", entries=query_history(**filters, limit=request.args.get("limit", 200, type=int)),
+                           trends=trends, failed_jobs=failed_jobs, filters=filters, weeks=weeks,
+                           max_speed=max((t["avg_bytes_per_second"] or 0 for t in trends), default=0))
+
+@app.route("/history/data")
+def history_data():
+    return jsonify(query_history(**_history_filters(), limit=request.args.get("limit", 200, type=int)))
+
+@app.route("/history/trends")
+def history_trends_data():
+    return jsonify(history_trends(request.args.get("weeks", 12, type=int), request.args.get("item_type") or None,
+                                  request.args.get("series_id") or None))
+
 # Vous pouvez ajouter des liens séparés pour les films et les séries dans le menu de navigation HTML.
 # Par exemple, si vous voulez avoir /films comme page d'accueil distincte pour les films.
 # @app.route("/films_accueil")
@@ -40,4 +103,6 @@ if __name__ == '__main__':
     # DOWNLOAD_PATH_SERIES=/chemin/vers/series
     # DOWNLOAD_PATH_MOVIES=/chemin/vers/films
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Pas de rechargeur en mode debug : il relancerait l'application dans un second processus,
+    # avec un second worker de téléchargement sur le même queue.json
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv("FLASK_DEBUG", "0") == "1", use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,186 @@
+# artwork.py
+
+import os
+import json
+import hashlib
+import queue
+import shutil
+import threading
+import uuid
+from datetime import datetime
+
+import requests
+
+import tmdb_cache
+
+# --- Configuration ---
+DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
+# Magasin d'images adressé par contenu (sha256). Placé par défaut sur le même volume que les médias
+# pour que les images identiques soient liées en dur plutôt que copiées.
+ARTWORK_STORE_DIR = os.getenv("ARTWORK_STORE_DIR", os.path.join(os.path.dirname(DOWNLOAD_PATH_MOVIES.rstrip('/')), ".artwork"))
+ARTWORK_INDEX_FILE = "artwork_index.json"
+ARTWORK_WORKERS = int(os.getenv("ARTWORK_WORKERS", 2))
+ARTWORK_IMAGE_SIZE = os.getenv("ARTWORK_IMAGE_SIZE", "original")
+ARTWORK_TIMEOUT_SECONDS = 30
+TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p"
+
+# --- État ---
+_artwork_queue = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+_index_lock = threading.Lock()
+# Tâches en file ou en cours (évite de planifier deux fois la même série pendant un travail NFO)
+_scheduled = set()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _load_index():
+    if not os.path.exists(ARTWORK_INDEX_FILE):
+        return {}
+    try:
+        with open(ARTWORK_INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Correspondance URL d'image -> sha256 du contenu déjà présent dans le magasin
+_url_index = _load_index()
+
+def _save_index():
+    """Enregistre l'index des images. Doit être appelée avec _index_lock détenu."""
+    try:
+        tmp_file = f"{ARTWORK_INDEX_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(_url_index, f)
+        os.replace(tmp_file, ARTWORK_INDEX_FILE)
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {ARTWORK_INDEX_FILE}: {e}")
+
+def _store_path(digest):
+    return os.path.join(ARTWORK_STORE_DIR, digest[:2], f"{digest}.jpg")
+
+def _fetch_to_store(url):
+    """Renvoie le chemin de l'image dans le magasin, en la téléchargeant seulement si elle est inconnue."""
+    with _index_lock:
+        digest = _url_index.get(url)
+    if digest and os.path.exists(_store_path(digest)):
+        return _store_path(digest)
+
+    os.makedirs(ARTWORK_STORE_DIR, exist_ok=True)
+    tmp_path = os.path.join(ARTWORK_STORE_DIR, f"{uuid.uuid4().hex}.part")
+    sha256 = hashlib.sha256()
+    try:
+        with requests.get(url, stream=True, timeout=ARTWORK_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    sha256.update(chunk)
+        digest = sha256.hexdigest()
+        store_path = _store_path(digest)
+        if os.path.exists(store_path):
+            # Même contenu déjà présent sous une autre URL
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            os.replace(tmp_path, store_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _index_lock:
+        _url_index[url] = digest
+        _save_index()
+    return store_path
+
+def _place(image_path, dest_path):
+    """Lie en dur (ou copie, si le magasin est sur un autre volume) l'image vers son nom standard."""
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_dest = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(image_path, tmp_dest)
+    except OSError:
+        shutil.copyfile(image_path, tmp_dest)
+    os.replace(tmp_dest, dest_path)
+
+def _save_image(tmdb_path, dest_path):
+    """Télécharge une image TMDB vers dest_path, sauf si le fichier existe déjà. Renvoie True si écrit."""
+    if not tmdb_path or os.path.exists(dest_path):
+        return False
+    image_path = _fetch_to_store(f"{TMDB_IMAGE_BASE_URL}/{ARTWORK_IMAGE_SIZE}{tmdb_path}")
+    _place(image_path, dest_path)
+    return True
+
+# --- Traitement des tâches ---
+def _movie_artwork(folder, tmdb_id):
+    targets = {'poster_path': os.path.join(folder, "poster.jpg"), 'backdrop_path': os.path.join(folder, "fanart.jpg")}
+    if all(os.path.exists(p) for p in targets.values()):
+        return 0
+    metadata = tmdb_cache.get_movie_metadata(tmdb_id) or {}
+    return sum(_save_image(metadata.get(key), dest) for key, dest in targets.items())
+
+def _series_artwork(series_dir, tmdb_id, seasons):
+    written = 0
+    targets = {'poster_path': os.path.join(series_dir, "poster.jpg"), 'backdrop_path': os.path.join(series_dir, "fanart.jpg")}
+    if not all(os.path.exists(p) for p in targets.values()):
+        metadata = tmdb_cache.get_series_metadata(tmdb_id) or {}
+        written += sum(_save_image(metadata.get(key), dest) for key, dest in targets.items())
+    for season in seasons:
+        dest = os.path.join(series_dir, f"season{int(season):02d}-poster.jpg")
+        if not os.path.exists(dest):
+            season_data = tmdb_cache.get_season_metadata(tmdb_id, season) or {}
+            written += _save_image(season_data.get('poster_path'), dest)
+    return written
+
+def _episode_artwork(folder, base_name, tmdb_id, season, episode):
+    dest = os.path.join(folder, f"{base_name}-thumb.jpg")
+    if os.path.exists(dest):
+        return 0
+    metadata = tmdb_cache.get_episode_metadata(tmdb_id, season, episode) or {}
+    return int(_save_image(metadata.get('still_path'), dest))
+
+_HANDLERS = {
+    'movie': _movie_artwork,
+    'series': _series_artwork,
+    'episode': _episode_artwork,
+}
+
+def _artwork_worker():
+    while True:
+        kind, args = _artwork_queue.get()
+        try:
+            written = _HANDLERS[kind](*args)
+            if written:
+                print(f"[{_now_str()}] {written} image(s) enregistrée(s) pour {args[0]}.")
+        except Exception as e:
+            print(f"[{_now_str()}] Erreur lors du téléchargement des images pour {args[0]}: {e}")
+        finally:
+            with _workers_lock:
+                _scheduled.discard((kind, args))
+            _artwork_queue.task_done()
+
+def _schedule(kind, *args):
+    with _workers_lock:
+        if (kind, args) in _scheduled:
+            return
+        _scheduled.add((kind, args))
+        while len(_workers) < max(1, ARTWORK_WORKERS):
+            worker = threading.Thread(target=_artwork_worker, daemon=True)
+            worker.start()
+            _workers.append(worker)
+    _artwork_queue.put((kind, args))
+
+def queue_movie_artwork(folder, tmdb_id):
+    """poster.jpg et fanart.jpg dans le dossier du film."""
+    if tmdb_id:
+        _schedule('movie', folder, tmdb_id)
+
+def queue_series_artwork(series_dir, tmdb_id, seasons=()):
+    """poster.jpg, fanart.jpg et seasonNN-poster.jpg dans le dossier de la série."""
+    if tmdb_id:
+        _schedule('series', series_dir, tmdb_id, tuple(sorted(int(s) for s in seasons)))
+
+def queue_episode_artwork(folder, base_name, tmdb_id, season, episode):
+    """<nom de l'épisode>-thumb.jpg à côté du fichier vidéo."""
+    if tmdb_id:
+        _schedule('episode', folder, base_name, tmdb_id, int(season), int(episode))
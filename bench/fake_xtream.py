@@ -0,0 +1,207 @@
+# bench/fake_xtream.py
+#
+# Faux serveur Xtream Codes (player_api.php et flux vidéo) servant des catalogues synthétiques,
+# pour mesurer l'application sans dépendre du fournisseur.
+#
+#   python bench/fake_xtream.py --movies 50000 --series 2000 --latency-ms 150 --port 8090
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class FakeCatalog:
+    """Catalogue généré de façon déterministe (même graine → mêmes titres et mêmes ID)."""
+
+    def __init__(self, movies=1000, series=200, seasons=5, episodes=12, seed=42):
+        self.seasons = seasons
+        self.episodes = episodes
+        rng = random.Random(seed)
+        words = ["Ombre", "Nuit", "Ville", "Dernier", "Secret", "Rouge", "Empire", "Voyage", "Silence",
+                 "Retour", "Guerre", "Amour", "Mer", "Feu", "Loup", "Code", "Ligne", "Cercle", "Hiver", "Ciel"]
+        now = int(time.time())
+        self.movies = [{
+            "num": i + 1,
+            "name": f"{' '.join(rng.sample(words, 3))} {i + 1} ({rng.randint(1960, 2025)})",
+            "stream_type": "movie",
+            "stream_id": 100000 + i,
+            "stream_icon": f"http://img.invalid/movie/{100000 + i}.jpg",
+            "rating": f"{rng.uniform(1, 10):.1f}",
+            "added": str(now - rng.randint(0, 10 ** 8)),
+            "category_id": str(rng.randint(1, 40)),
+            "container_extension": rng.choice(["mp4", "mkv"]),
+        } for i in range(movies)]
+        self.series = [{
+            "num": i + 1,
+            "name": f"{' '.join(rng.sample(words, 2))} {i + 1}",
+            "series_id": 5000 + i,
+            "cover": f"http://img.invalid/series/{5000 + i}.jpg",
+            "plot": "Synopsis synthétique.",
+            "releaseDate": f"{rng.randint(1990, 2025)}-01-01",
+            "last_modified": str(now - rng.randint(0, 10 ** 7)),
+            "rating": f"{rng.uniform(1, 10):.1f}",
+            "category_id": str(rng.randint(1, 40)),
+        } for i in range(series)]
+        self._series_by_id = {str(s["series_id"]): s for s in self.series}
+        self.vod_by_category = self._by_category(self.movies)
+        self.series_by_category = self._by_category(self.series)
+
+    @staticmethod
+    def _by_category(items):
+        groups = {}
+        for item in items:
+            groups.setdefault(item["category_id"], []).append(item)
+        return groups
+
+    @staticmethod
+    def categories(groups):
+        return [{"category_id": category_id, "category_name": f"Catégorie {category_id}", "parent_id": 0}
+                for category_id in sorted(groups, key=int)]
+
+    def series_info(self, series_id):
+        entry = self._series_by_id.get(str(series_id))
+        if entry is None:
+            return {"info": {}, "episodes": {}}
+        base = int(entry["series_id"]) * 10000
+        episodes = {}
+        for season in range(1, self.seasons + 1):
+            episodes[str(season)] = [{
+                "id": str(base + season * 100 + number),
+                "episode_num": number,
+                "title": f"{entry['name']} - S{season:02d}E{number:02d} - Épisode {number}",
+                "container_extension": "mp4",
+                "season": season,
+                "info": {"duration_secs": 2700},
+            } for number in range(1, self.episodes + 1)]
+        info = {key: entry[key] for key in ("name", "cover", "plot", "releaseDate", "rating", "last_modified")}
+        return {"seasons": [{"season_number": s} for s in range(1, self.seasons + 1)], "info": info, "episodes": episodes}
+
+def make_handler(catalog, latency_ms=0, stream_bytes=1024 * 1024, stream_kbps=0, full_dump_latency_ms=0):
+    """Gestionnaire HTTP : latency_ms est ajouté à chaque appel de l'API, stream_kbps limite le débit des flux (0 = illimité).
+
+    full_dump_latency_ms s'ajoute aux catalogues demandés sans category_id (fournisseur lent sur les listes complètes).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _api(self, params):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            action = params.get("action", [""])[0]
+            category_id = params.get("category_id", [""])[0]
+            if action in ("get_vod_streams", "get_series"):
+                if not category_id:
+                    if full_dump_latency_ms:
+                        time.sleep(full_dump_latency_ms / 1000)
+                    return self._send_json(catalog.movies if action == "get_vod_streams" else catalog.series)
+                groups = catalog.vod_by_category if action == "get_vod_streams" else catalog.series_by_category
+                return self._send_json(groups.get(category_id, []))
+            if action == "get_vod_categories":
+                return self._send_json(catalog.categories(catalog.vod_by_category))
+            if action == "get_series_categories":
+                return self._send_json(catalog.categories(catalog.series_by_category))
+            if action == "get_series_info":
+                return self._send_json(catalog.series_info(params.get("series_id", [""])[0]))
+            if action == "get_vod_info":
+                return self._send_json({"info": {}, "movie_data": {"stream_id": params.get("vod_id", [""])[0]}})
+            return self._send_json({"user_info": {"auth": 1}})
+
+        def _stream(self, head_only):
+            # Flux vidéo factice : octets nuls, reprise possible (Range) comme chez la plupart des fournisseurs
+            start = 0
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes="):
+                try:
+                    start = min(int(range_header[6:].split("-")[0] or 0), stream_bytes)
+                except ValueError:
+                    start = 0
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(stream_bytes - start))
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{stream_bytes - 1}/{stream_bytes}")
+            self.end_headers()
+            if head_only:
+                return
+            remaining = stream_bytes - start
+            chunk = b"\0" * STREAM_CHUNK_SIZE
+            started = time.perf_counter()
+            sent = 0
+            try:
+                while remaining > 0:
+                    size = min(STREAM_CHUNK_SIZE, remaining)
+                    self.wfile.write(chunk[:size])
+                    remaining -= size
+                    sent += size
+                    if stream_kbps:
+                        delay = sent / (stream_kbps * 1024) - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def _route(self, head_only=False):
+            url = urlparse(self.path)
+            if url.path.endswith("/player_api.php"):
+                return self._api(parse_qs(url.query))
+            if url.path.startswith(("/movie/", "/series/")):
+                return self._stream(head_only)
+            self.send_error(404)
+
+        def do_GET(self):
+            self._route()
+
+        def do_HEAD(self):
+            self._route(head_only=True)
+
+    return Handler
+
+def start_fake_xtream(catalog, latency_ms=0, port=0, stream_bytes=1024 * 1024, stream_kbps=0, full_dump_latency_ms=0):
+    """Démarre le serveur dans un thread. Renvoie (serveur, port) ; serveur.shutdown() pour l'arrêter."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(catalog, latency_ms, stream_bytes, stream_kbps, full_dump_latency_ms))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur Xtream Codes avec catalogue synthétique")
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=12)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--stream-mb", type=float, default=1, help="taille de chaque flux vidéo factice")
+    parser.add_argument("--stream-kbps", type=float, default=0, help="débit maximal par flux (0 = illimité)")
+    parser.add_argument("--full-dump-latency-ms", type=float, default=0, help="latence supplémentaire des catalogues demandés sans category_id")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    catalog = FakeCatalog(args.movies, args.series, args.seasons, args.episodes)
+    server, port = start_fake_xtream(catalog, args.latency_ms, args.port, int(args.stream_mb * 1024 * 1024), args.stream_kbps,
+                                     args.full_dump_latency_ms)
+    print(f"Faux serveur Xtream sur http://127.0.0.1:{port} ({args.movies} films, {args.series} séries). Ctrl+C pour arrêter.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
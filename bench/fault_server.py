@@ -0,0 +1,250 @@
+# bench/fault_server.py
+#
+# Serveur HTTP de fichiers générés, avec reprise (Range), limitation de débit par connexion et pannes
+# aléatoires : coupures brutales, corps tronqués, blocages, rafales d'erreurs 5xx et pages HTML à la place
+# de la vidéo. Sert de fournisseur factice pour bench/load_test.py.
+#
+#   python bench/fault_server.py --port 8091 --kbps 4096 --disconnect-rate 0.05 --error-burst-rate 0.02
+#
+# Fichiers : GET /files/<nom>?size=<octets>. Le contenu ne dépend que du nom (voir file_sha256).
+
+import argparse
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+# Motif pseudo-aléatoire propre à chaque fichier, répété : pas de déduplication entre fichiers différents
+PATTERN_SIZE = 65521
+HTML_ERROR_PAGE = b"<!DOCTYPE html><html><body><h1>503 Service Unavailable</h1></body></html>"
+
+def _pattern(name):
+    return random.Random(name).randbytes(PATTERN_SIZE)
+
+def file_bytes(pattern, start, length):
+    offset = start % PATTERN_SIZE
+    data = bytearray()
+    while len(data) < length:
+        piece = pattern[offset:offset + length - len(data)]
+        data += piece
+        offset = 0
+    return bytes(data)
+
+def file_sha256(name, size):
+    """SHA-256 attendu pour le fichier name de size octets (contrôle d'intégrité côté client)."""
+    pattern = _pattern(name)
+    sha256 = hashlib.sha256()
+    for start in range(0, size, CHUNK_SIZE):
+        sha256.update(file_bytes(pattern, start, min(CHUNK_SIZE, size - start)))
+    return sha256.hexdigest()
+
+class FaultProfile:
+    """Probabilités de panne, tirées à chaque GET d'un fichier."""
+
+    def __init__(self, kbps=0, disconnect_rate=0.0, truncate_rate=0.0, stall_rate=0.0, stall_seconds=30,
+                 error_burst_rate=0.0, error_burst_length=5, html_rate=0.0, seed=None):
+        self.kbps = kbps
+        self.disconnect_rate = disconnect_rate
+        self.truncate_rate = truncate_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.error_burst_rate = error_burst_rate
+        self.error_burst_length = error_burst_length
+        self.html_rate = html_rate
+        self.rng = random.Random(seed)
+
+class FaultServerState:
+    def __init__(self, profile):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.burst_remaining = 0
+        self.patterns = {}
+        self.stats = {"requests": 0, "head_requests": 0, "range_requests": 0, "bytes_sent": 0, "full_bodies": 0,
+                      "errors_5xx": 0, "html_pages": 0, "disconnects": 0, "truncations": 0, "stalls": 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def pattern(self, name):
+        with self.lock:
+            if name not in self.patterns:
+                self.patterns[name] = _pattern(name)
+            return self.patterns[name]
+
+    def draw_fault(self):
+        """Panne à appliquer à la prochaine réponse : None, "5xx", "html", "disconnect", "truncate" ou "stall"."""
+        profile = self.profile
+        with self.lock:
+            if self.burst_remaining > 0:
+                self.burst_remaining -= 1
+                return "5xx"
+            if profile.rng.random() < profile.error_burst_rate:
+                self.burst_remaining = profile.error_burst_length - 1
+                return "5xx"
+            roll = profile.rng.random()
+            for fault, rate in (("html", profile.html_rate), ("disconnect", profile.disconnect_rate),
+                                ("truncate", profile.truncate_rate), ("stall", profile.stall_rate)):
+                if roll < rate:
+                    return fault
+                roll -= rate
+            return None
+
+def make_handler(state):
+    profile = state.profile
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_body(self, body, status=200, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _abort(self):
+            # Coupure brutale (RST) : SO_LINGER à 0 puis fermeture
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+
+        def _serve_file(self, url, head_only):
+            name = url.path[len("/files/"):]
+            try:
+                size = int(parse_qs(url.query).get("size", ["0"])[0])
+            except ValueError:
+                size = 0
+            if not name or size <= 0:
+                return self.send_error(404)
+            if head_only:
+                state.count("head_requests")
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                return
+            state.count("requests")
+            fault = state.draw_fault()
+            if fault == "5xx":
+                state.count("errors_5xx")
+                return self._send_body(b"Service Unavailable", status=503, content_type="text/plain")
+            if fault == "html":
+                state.count("html_pages")
+                return self._send_body(HTML_ERROR_PAGE, content_type="text/html")
+
+            start = 0
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes="):
+                try:
+                    start = int(range_header[6:].split("-")[0] or 0)
+                except ValueError:
+                    start = 0
+                state.count("range_requests")
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(size - start))
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.end_headers()
+
+            # Point de panne tiré au hasard dans le corps restant
+            fault_at = start + int((size - start) * profile.rng.random()) if fault else size
+            pattern = state.pattern(name)
+            position = start
+            started = time.perf_counter()
+            try:
+                while position < size:
+                    if position >= fault_at:
+                        if fault == "disconnect":
+                            state.count("disconnects")
+                            return self._abort()
+                        if fault == "truncate":
+                            state.count("truncations")
+                            self.close_connection = True
+                            return
+                        if fault == "stall":
+                            state.count("stalls")
+                            time.sleep(profile.stall_seconds)
+                            fault = None
+                    length = min(CHUNK_SIZE, size - position, max(1, fault_at - position) if fault else CHUNK_SIZE)
+                    self.wfile.write(file_bytes(pattern, position, length))
+                    position += length
+                    state.count("bytes_sent", length)
+                    if profile.kbps:
+                        delay = (position - start) / (profile.kbps * 1024) - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                state.count("full_bodies")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def _route(self, head_only=False):
+            url = urlparse(self.path)
+            if url.path == "/_stats":
+                with state.lock:
+                    return self._send_body(json.dumps(state.stats).encode("utf-8"))
+            if url.path.startswith("/files/"):
+                return self._serve_file(url, head_only)
+            self.send_error(404)
+
+        def do_GET(self):
+            self._route()
+
+        def do_HEAD(self):
+            self._route(head_only=True)
+
+    return Handler
+
+def serve(profile, port=0, ready=None):
+    """Démarre le serveur (bloquant). ready : file multiprocessing recevant le port effectif."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(FaultServerState(profile)))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+def add_profile_arguments(parser):
+    parser.add_argument("--kbps", type=float, default=0, help="débit maximal par connexion (0 = illimité)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="probabilité de coupure brutale par requête")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="probabilité de corps tronqué par requête")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="probabilité de blocage par requête")
+    parser.add_argument("--stall-seconds", type=float, default=30)
+    parser.add_argument("--error-burst-rate", type=float, default=0.0, help="probabilité de démarrer une rafale de 503")
+    parser.add_argument("--error-burst-length", type=int, default=5)
+    parser.add_argument("--html-rate", type=float, default=0.0, help="probabilité d'une page HTML à la place de la vidéo")
+    parser.add_argument("--seed", type=int, default=None)
+
+def profile_from_args(args):
+    return FaultProfile(args.kbps, args.disconnect_rate, args.truncate_rate, args.stall_rate, args.stall_seconds,
+                        args.error_burst_rate, args.error_burst_length, args.html_rate, args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur de fichiers générés avec pannes simulées")
+    parser.add_argument("--port", type=int, default=8091)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    print(f"Serveur de pannes sur http://127.0.0.1:{args.port} (statistiques : /_stats). Ctrl+C pour arrêter.")
+    try:
+        serve(profile_from_args(args), args.port)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
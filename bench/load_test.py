@@ -0,0 +1,275 @@
+# bench/load_test.py
+#
+# Test de charge du moteur de téléchargement (downloader_core) contre bench/fault_server.py :
+# des centaines de tâches passent par la vraie chaîne (admission, wget -c, chien de garde, vérification,
+# déplacement), puis le débit, le taux de réussite, les reprises et l'intégrité des fichiers sont rapportés.
+#
+#   python bench/load_test.py --jobs 200 --size-mb 8 --kbps 8192 --disconnect-rate 0.05 \
+#       --truncate-rate 0.05 --error-burst-rate 0.02 --stall-rate 0.01 --stall-seconds 20
+#
+# Avec --remote-workers, des nœuds remote_worker.py locaux prennent les tâches par baux (job_leases.py) ;
+# --kill-worker-after tue l'un d'eux en cours de route pour vérifier l'expiration des baux :
+#
+#   python bench/load_test.py --jobs 50 --remote-workers 3 --no-local-worker --kill-worker-after 20 --lease-ttl 9
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from fault_server import add_profile_arguments, profile_from_args, serve, file_sha256
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+POLL_INTERVAL_SECONDS = 2
+
+def _out(message):
+    # La sortie standard est redirigée vers load_test.log (journaux de l'application)
+    print(message, file=sys.__stdout__, flush=True)
+
+def _configure_environment(workdir, args):
+    os.environ.update({
+        "DOWNLOAD_PATH_MOVIES": os.path.join(workdir, "movies"),
+        "DOWNLOAD_PATH_SERIES": os.path.join(workdir, "series"),
+        "DOWNLOAD_STAGING_DIR": os.path.join(workdir, "staging") if args.staging else "",
+        "POSTPROCESS_FFPROBE": "0",
+        "DISK_MIN_FREE_GB": "0",
+        "RETRY_COUNT": str(args.retry_count),
+        "RETRY_DELAY_SECONDS": str(args.retry_delay),
+        "STALL_TIMEOUT_SECONDS": str(args.stall_timeout),
+        "LOCAL_DOWNLOAD_WORKER": "0" if args.no_local_worker else "1",
+        "LEASE_TTL_SECONDS": str(args.lease_ttl),
+    })
+    os.environ.pop("POSTPROCESS_REMUX_TO", None)
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else None
+
+def _fetch_server_stats(port):
+    import requests
+    try:
+        return requests.get(f"http://127.0.0.1:{port}/_stats", timeout=5).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return {}
+
+def _start_remote_workers(count):
+    """API du démon servie dans un thread, et count nœuds remote_worker.py dans des processus séparés."""
+    from werkzeug.serving import make_server
+    from download_daemon import create_daemon_app
+    from job_leases import start_lease_reaper
+
+    server = make_server("127.0.0.1", 0, create_daemon_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_lease_reaper()
+    env = dict(os.environ, DOWNLOAD_DAEMON_URL=f"http://127.0.0.1:{server.server_port}", WORKER_POLL_SECONDS="1")
+    workers = []
+    for n in range(count):
+        log = open(f"remote_worker_{n}.log", 'w', encoding='utf-8')
+        # Groupe de processus propre : tuer le nœud tue aussi son wget, comme une machine qui s'arrête
+        workers.append(subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "remote_worker.py")],
+                                        env=dict(env, WORKER_ID=f"load-worker-{n}"), stdout=log,
+                                        stderr=subprocess.STDOUT, start_new_session=True))
+    return workers
+
+def run(args, port):
+    sys.path.insert(0, REPO_DIR)
+    import downloader_core
+    import job_leases
+    import metrics
+    downloader_core.start_download_workers()
+    workers = _start_remote_workers(args.remote_workers) if args.remote_workers else []
+    killed_worker = None
+
+    rng = random.Random(args.seed)
+    base_size = int(args.size_mb * 1024 * 1024)
+    jobs = []
+    expected = {}
+    for i in range(args.jobs):
+        size = max(1, int(base_size * rng.uniform(1 - args.size_jitter, 1 + args.size_jitter)))
+        name = f"load-{i:05d}.mp4"
+        path = os.path.join(os.environ["DOWNLOAD_PATH_MOVIES"], f"Load {i:05d}", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        jobs.append({
+            "cmd": ["wget", "-O", path, f"http://127.0.0.1:{port}/files/{name}?size={size}"],
+            "file": name,
+            "item_id": f"load-{i:05d}",
+            "item_type": "movie",
+            "title": f"Load {i:05d}",
+        })
+        expected[f"load-{i:05d}"] = (name, size)
+
+    started = time.time()
+    enqueued_at = {}
+    for job in jobs:
+        downloader_core.add_to_download_queue(job)
+        enqueued_at[job["item_id"]] = time.time()
+
+    finished_at = {}
+    failed = set()
+    deadline = started + args.timeout_minutes * 60
+    last_report = 0
+    while time.time() < deadline:
+        completed = set(downloader_core.get_completed_items())
+        statuses = downloader_core.get_queue_status()
+        for job in jobs:
+            item_id = job["item_id"]
+            if item_id in finished_at or item_id in failed:
+                continue
+            if item_id in completed:
+                finished_at[item_id] = time.time()
+            elif statuses.get(item_id) == "❌" and job.get("attempts", 0) >= downloader_core.RETRY_COUNT:
+                failed.add(item_id)
+        if workers and args.kill_worker_after and killed_worker is None and time.time() - started >= args.kill_worker_after:
+            killed_worker = 0
+            os.killpg(workers[0].pid, signal.SIGKILL)
+            _out(f"[{time.time() - started:7.0f}s] nœud load-worker-0 tué")
+        done = len(finished_at) + len(failed)
+        if time.time() - last_report >= 10:
+            last_report = time.time()
+            _out(f"[{time.time() - started:7.0f}s] terminées {len(finished_at)}/{len(jobs)}, échecs {len(failed)}")
+        if done == len(jobs):
+            break
+        time.sleep(POLL_INTERVAL_SECONDS)
+    elapsed = time.time() - started
+    for worker in workers:
+        if worker.poll() is None:
+            os.killpg(worker.pid, signal.SIGKILL)
+
+    # Intégrité : contenu du fichier final comparé au contenu généré par le serveur
+    _out("Contrôle d'intégrité des fichiers terminés...")
+    corrupted = []
+    completed_bytes = 0
+    for job in jobs:
+        if job["item_id"] not in finished_at:
+            continue
+        name, size = expected[job["item_id"]]
+        path = job["cmd"][2]
+        try:
+            actual_size = os.path.getsize(path)
+            ok = actual_size == size and _file_sha256(path) == file_sha256(name, size)
+        except OSError:
+            actual_size, ok = 0, False
+        completed_bytes += actual_size
+        if not ok or job.get("sha256") != file_sha256(name, size):
+            corrupted.append(job["item_id"])
+
+    latencies = [finished_at[item_id] - enqueued_at[item_id] for item_id in finished_at]
+    attempts = [job.get("attempts", 0) for job in jobs if job["item_id"] in finished_at]
+    server_stats = _fetch_server_stats(port)
+
+    def by_label(metric):
+        return {",".join(key) or "total": value for key, value in metric.values().items()}
+
+    return {
+        "jobs": len(jobs),
+        "completed": len(finished_at),
+        "failed": len(failed),
+        "unfinished": len(jobs) - len(finished_at) - len(failed),
+        "completion_rate": round(len(finished_at) / len(jobs), 4) if jobs else None,
+        "corrupted": len(corrupted),
+        "corrupted_ids": corrupted[:20],
+        "elapsed_seconds": round(elapsed, 1),
+        "completed_bytes": completed_bytes,
+        "throughput_mb_per_second": round(completed_bytes / 1024 ** 2 / elapsed, 2) if elapsed else None,
+        # Octets envoyés par le serveur / octets utiles : coût des reprises et des fichiers rejetés
+        "transfer_overhead": round(server_stats.get("bytes_sent", 0) / completed_bytes, 3) if completed_bytes else None,
+        "completion_latency_seconds": {
+            "median": round(statistics.median(latencies), 1) if latencies else None,
+            "p95": round(_percentile(latencies, 0.95), 1) if latencies else None,
+            "max": round(max(latencies), 1) if latencies else None,
+        },
+        "recovery": {
+            "completed_first_try": sum(1 for a in attempts if a == 0),
+            "completed_after_retry": sum(1 for a in attempts if a > 0),
+            "max_attempts": max(attempts) if attempts else 0,
+            "retries_by_cause": by_label(metrics.JOB_RETRIES),
+            "failures_by_cause": by_label(metrics.JOB_FAILURES),
+            "stalls": by_label(metrics.STALLS),
+            # Reprises faites par wget lui-même (Range) sans passer par une nouvelle tentative
+            "range_resumes": server_stats.get("range_requests"),
+        },
+        "server": server_stats,
+        "remote": {
+            "workers": args.remote_workers,
+            "killed_worker": f"load-worker-{killed_worker}" if killed_worker is not None else None,
+            "lease_events": by_label(metrics.REMOTE_LEASES),
+            "completed_by_worker": {worker_id: entry["completed"] for worker_id, entry in job_leases.get_leases()["workers"].items()},
+        } if workers else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du moteur de téléchargement")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--size-jitter", type=float, default=0.5, help="variation relative de la taille des fichiers")
+    parser.add_argument("--retry-count", type=int, default=5)
+    parser.add_argument("--retry-delay", type=float, default=2, help="RETRY_DELAY_SECONDS de l'application pendant le test")
+    parser.add_argument("--stall-timeout", type=float, default=10, help="STALL_TIMEOUT_SECONDS de l'application pendant le test")
+    parser.add_argument("--staging", action="store_true", help="télécharger dans un dossier de transit (DOWNLOAD_STAGING_DIR)")
+    parser.add_argument("--remote-workers", type=int, default=0, help="nombre de nœuds remote_worker.py locaux")
+    parser.add_argument("--no-local-worker", action="store_true", help="laisser les tâches aux seuls nœuds distants (LOCAL_DOWNLOAD_WORKER=0)")
+    parser.add_argument("--kill-worker-after", type=float, default=0, help="tuer un nœud distant après ce nombre de secondes")
+    parser.add_argument("--lease-ttl", type=float, default=15, help="LEASE_TTL_SECONDS de l'application pendant le test")
+    parser.add_argument("--timeout-minutes", type=float, default=60)
+    parser.add_argument("--output", default="", help="rapport JSON (défaut : bench/results/load-<date>.json)")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = 1
+
+    output_path = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    # Serveur dans un processus séparé : il ne partage pas le GIL avec le moteur mesuré
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    server_process = context.Process(target=serve, args=(profile_from_args(args), 0, ready), daemon=True)
+    server_process.start()
+    port = ready.get(timeout=30)
+
+    workdir = tempfile.mkdtemp(prefix="vod-load-")
+    _configure_environment(workdir, args)
+    os.chdir(workdir)
+    _out(f"Serveur de pannes sur le port {port}, dossier de travail {workdir} (journal : load_test.log)")
+    started = datetime.now()
+    sys.stdout = open(os.path.join(workdir, "load_test.log"), 'w', encoding='utf-8')
+    report = run(args, port)
+    server_process.terminate()
+
+    output = {
+        "meta": {
+            "date": started.isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "report": report,
+    }
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=4)
+    _out(json.dumps(report, indent=4, ensure_ascii=False))
+    _out(f"Rapport enregistré dans {output_path}")
+    for child in multiprocessing.active_children():
+        child.terminate()
+    os._exit(0 if report["failed"] == 0 and report["corrupted"] == 0 and report["unfinished"] == 0 else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# bench/run_bench.py
+#
+# Mesure des pages et traitements principaux contre le faux serveur Xtream (bench/fake_xtream.py).
+# L'application tourne dans un dossier temporaire : queue.json, favoris et bibliothèque réels ne sont pas touchés.
+#
+#   python bench/run_bench.py --movies 50000 --series 2000 --latency-ms 100
+#   python bench/run_bench.py --compare bench/results/20261019-101500.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fake_xtream import FakeCatalog, start_fake_xtream
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+
+def _configure_environment(workdir, port):
+    """Variables lues à l'import des modules : à définir avant d'importer l'application."""
+    os.environ.update({
+        "XTREAM_HOST": "http://127.0.0.1",
+        "XTREAM_PORT": str(port),
+        "XTREAM_USERNAME": "bench",
+        "XTREAM_PASSWORD": "bench",
+        "DOWNLOAD_PATH_MOVIES": os.path.join(workdir, "movies"),
+        "DOWNLOAD_PATH_SERIES": os.path.join(workdir, "series"),
+        "DOWNLOAD_STAGING_DIR": os.path.join(workdir, "staging"),
+        "TMDB_CACHE_DIR": os.path.join(workdir, "tmdb_cache"),
+        "ARTWORK_STORE_DIR": os.path.join(workdir, "artwork"),
+        # Pas de traitement périodique ni d'appel externe pendant les mesures
+        "MONITOR_INTERVAL_MINUTES": "100000",
+        "MONITOR_INITIAL_DELAY_SECONDS": "100000",
+        "LIBRARY_SCAN_INTERVAL_MINUTES": "100000",
+        "POSTPROCESS_FFPROBE": "0",
+        "DISK_MIN_FREE_GB": "0",
+        "SLOW_REQUEST_MS": "1000000000",
+        "PROFILING_ENABLED": "0",
+        # Les épisodes ajoutés par download_season ne doivent pas être téléchargés pendant les mesures suivantes
+        "LOCAL_DOWNLOAD_WORKER": "0",
+    })
+    for name in ("TMDB_API_KEY", "DISCORD_WEBHOOK_URL", "POSTPROCESS_REMUX_TO"):
+        os.environ.pop(name, None)
+
+def _out(message):
+    # La sortie standard est redirigée vers bench.log pendant la mesure (journaux de l'application)
+    print(message, file=sys.__stdout__, flush=True)
+
+def _parse_server_timing(header):
+    phases = {}
+    for part in (header or "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if duration:
+            phases[name] = float(duration)
+    return phases
+
+def _summarize(durations_ms, phases):
+    ordered = sorted(durations_ms)
+    summary = {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0], 2),
+        "median_ms": round(statistics.median(ordered), 2),
+        "mean_ms": round(statistics.mean(ordered), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+    if phases:
+        names = {name for sample in phases for name in sample}
+        summary["phases_median_ms"] = {name: round(statistics.median(sample.get(name, 0.0) for sample in phases), 2)
+                                       for name in sorted(names)}
+    return summary
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def run_cases(args, catalog):
+    # Imports après la configuration de l'environnement (les modules lisent leurs variables au chargement)
+    sys.path.insert(0, REPO_DIR)
+    import app as app_module
+    import downloader_core
+    import episode_monitor
+    import xtream_api
+
+    client = app_module.app.test_client()
+    series_ids = [s["series_id"] for s in catalog.series]
+    rotation = {"detail": 0, "season": 0}
+
+    def next_series(key):
+        # Une série différente à chaque mesure : pas de cache chaud ni d'épisodes déjà en file d'attente
+        series_id = series_ids[rotation[key] % len(series_ids)]
+        rotation[key] += 1
+        return series_id
+
+    def get(path):
+        return lambda: client.get(path)
+
+    def serial_detail():
+        return client.get(f"/seriale/{next_series('detail')}")
+
+    def download_season():
+        return client.post("/seriale/download/season", data={"series_id": str(next_series("season")), "season": "1"})
+
+    def write_favorites():
+        favorites = series_ids[:args.favorites]
+        with open(episode_monitor.FAVORITES_FILE, 'w', encoding='utf-8') as f:
+            json.dump(favorites, f)
+        if os.path.exists(episode_monitor.MONITORED_STATE_FILE):
+            os.remove(episode_monitor.MONITORED_STATE_FILE)
+
+    def ensure_monitor_state():
+        if not os.path.exists(episode_monitor.MONITORED_STATE_FILE):
+            write_favorites()
+            episode_monitor.monitor_new_episodes()
+
+    # (nom, fonction mesurée, préparation non mesurée avant chaque exécution)
+    cases = [
+        ("filmy_list_cold", get("/filmy/"), xtream_api.clear_caches),
+        ("filmy_list_warm", get("/filmy/"), None),
+        ("filmy_search_warm", get("/filmy/?query=ombre"), None),
+        ("seriale_list_cold", get("/seriale/"), xtream_api.clear_caches),
+        ("seriale_list_warm", get("/seriale/"), None),
+        ("serial_detail_cold", serial_detail, xtream_api.invalidate_series_info),
+        ("download_season", download_season, xtream_api.invalidate_series_info),
+        ("monitor_first_scan", episode_monitor.monitor_new_episodes, write_favorites),
+        ("monitor_unchanged", episode_monitor.monitor_new_episodes, ensure_monitor_state),
+    ]
+    selected = set(args.cases.split(",")) if args.cases else None
+
+    results = {}
+    for name, func, setup in cases:
+        if selected and name not in selected:
+            continue
+        durations, phases = [], []
+        for i in range(args.warmup + args.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            result = func()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if i < args.warmup:
+                continue
+            durations.append(elapsed_ms)
+            if hasattr(result, "status_code"):
+                if result.status_code >= 400:
+                    raise RuntimeError(f"{name} : statut HTTP {result.status_code}")
+                phases.append(_parse_server_timing(result.headers.get("Server-Timing")))
+        results[name] = _summarize(durations, phases)
+        _out(f"{name:<22} médiane {results[name]['median_ms']:>10.2f} ms   p95 {results[name]['p95_ms']:>10.2f} ms")
+
+    # Arrêt propre : les épisodes ajoutés par download_season ne doivent pas survivre au dossier temporaire
+    downloader_core.clear_queue()
+    return results
+
+def compare(current, previous_path):
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    _out(f"\nComparaison avec {previous_path} ({previous['meta'].get('commit')}, {previous['meta'].get('date')}) :")
+    for name, summary in current["results"].items():
+        before = previous["results"].get(name)
+        if not before:
+            _out(f"  {name:<22} (nouveau)")
+            continue
+        delta = (summary["median_ms"] - before["median_ms"]) / before["median_ms"] * 100 if before["median_ms"] else 0.0
+        _out(f"  {name:<22} {before['median_ms']:>10.2f} → {summary['median_ms']:>10.2f} ms  ({delta:+.1f} %)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des pages et traitements contre un faux serveur Xtream")
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--series", type=int, default=1000)
+    parser.add_argument("--seasons", type=int, default=8)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--favorites", type=int, default=50, help="séries surveillées par monitor_new_episodes")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latence ajoutée à chaque appel de player_api.php")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--cases", default="", help="liste de cas séparés par des virgules (tous par défaut)")
+    parser.add_argument("--output", default="", help="fichier JSON des résultats (défaut : bench/results/<date>.json)")
+    parser.add_argument("--compare", default="", help="résultats précédents à comparer")
+    args = parser.parse_args()
+
+    # Chemins donnés par l'utilisateur résolus avant le changement de dossier
+    output_path = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    catalog = FakeCatalog(args.movies, args.series, args.seasons, args.episodes)
+    server, port = start_fake_xtream(catalog, args.latency_ms, stream_bytes=64 * 1024)
+    workdir = tempfile.mkdtemp(prefix="vod-bench-")
+    _configure_environment(workdir, port)
+    os.chdir(workdir)
+    _out(f"Faux serveur Xtream sur le port {port}, dossier de travail {workdir} (journal : bench.log)")
+
+    started = datetime.now()
+    # Jusqu'à la fin : les threads de l'application continuent d'écrire après les mesures
+    sys.stdout = open(os.path.join(workdir, "bench.log"), 'w', encoding='utf-8')
+    results = run_cases(args, catalog)
+    server.shutdown()
+
+    output = {
+        "meta": {
+            "date": started.isoformat(timespec='seconds'),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=4)
+    _out(f"Résultats enregistrés dans {output_path}")
+    if compare_path:
+        compare(output, compare_path)
+    # Les threads de l'application (worker, moniteur...) ne sont pas des démons : sortie immédiate,
+    # après l'arrêt des processus de vérification (ils garderaient la sortie standard ouverte)
+    for child in multiprocessing.active_children():
+        child.terminate()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# bulk_nfo.py
+
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import tmdb_cache
+import xtream_api
+from plex_naming import (
+    clean_name,
+    series_folder_name,
+    clean_episode_title,
+    season_path,
+    episode_base_name
+)
+from nfo_writer import movie_nfo, episode_nfo, write_nfo
+from artwork import queue_movie_artwork, queue_series_artwork, queue_episode_artwork
+
+# --- Configuration ---
+DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
+DOWNLOAD_PATH_SERIES = os.getenv("DOWNLOAD_PATH_SERIES", "/downloads/Seriale")
+# Nombre de NFO générés en parallèle (le débit TMDB reste limité par tmdb_cache)
+BULK_NFO_WORKERS = int(os.getenv("BULK_NFO_WORKERS", 4))
+BULK_NFO_MAX_ERRORS = 50
+
+VIDEO_EXTENSIONS = {'mp4', 'mkv', 'avi', 'ts', 'm4v', 'mov', 'wmv', 'flv', 'mpg', 'mpeg', 'webm'}
+
+# Noms générés par les blueprints : "Titre (Année)" et "Série (Année) - S01E02 - Titre.ext"
+FOLDER_PATTERN = re.compile(r"^(?P<name>.+?)(?: \((?P<year>\d{4})\))?$")
+EPISODE_FILE_PATTERN = re.compile(r"^.+? - S(?P<season>\d{2,})E(?P<episode>\d{2,})(?: - .*)?$")
+
+# --- Suivi des travaux ---
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _new_job(scope, description):
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "scope": scope,
+        "description": description,
+        "status": "pending",
+        "total": 0,
+        "done": 0,
+        "written": 0,
+        "skipped": 0,
+        "failed": 0,
+        "errors": [],
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "finished": None,
+    }
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+    return job
+
+def _record(job, result, error=None):
+    with _jobs_lock:
+        job["done"] += 1
+        job[result] += 1
+        if error and len(job["errors"]) < BULK_NFO_MAX_ERRORS:
+            job["errors"].append(error)
+
+def get_bulk_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job, errors=list(job["errors"])) if job else None
+
+def list_bulk_jobs():
+    with _jobs_lock:
+        return [dict(job, errors=list(job["errors"])) for job in _jobs.values()]
+
+def nfo_up_to_date(nfo_path, media_path=None):
+    """Un NFO est à jour s'il existe, n'est pas vide et n'est pas plus ancien que le média associé."""
+    try:
+        nfo_stat = os.stat(nfo_path)
+    except OSError:
+        return False
+    if nfo_stat.st_size == 0:
+        return False
+    if media_path:
+        try:
+            return nfo_stat.st_mtime >= os.stat(media_path).st_mtime
+        except OSError:
+            pass
+    return True
+
+def _find_media_file(folder, base_name):
+    for ext in VIDEO_EXTENSIONS:
+        candidate = os.path.join(folder, f"{base_name}.{ext}")
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def _episode_location(series_info, episode, season):
+    """Dossier de saison et nom de base (sans extension) du fichier d'un épisode."""
+    series_folder = series_folder_name(series_info)
+    episode_num = int(episode.get('episode_num', 0))
+    title = clean_episode_title(episode.get('title') or '', clean_name(series_info.get('name', '')), episode_num)
+    return season_path(series_folder, season), episode_base_name(series_folder, season, episode_num, title)
+
+# --- Génération unitaire ---
+def write_episode_nfo(series_info, tmdb_id, episode, season, force=False):
+    """Écrit le NFO d'un épisode à côté du fichier vidéo (même nom de base). Renvoie (résultat, chemin)."""
+    episode_num = int(episode.get('episode_num', 0))
+    folder, base_name = _episode_location(series_info, episode, season)
+    nfo_path = os.path.join(folder, f"{base_name}.nfo")
+
+    # Vignette de l'épisode (ignorée par le worker d'images si elle est déjà présente)
+    queue_episode_artwork(folder, base_name, tmdb_id, season, episode_num)
+    if not force and nfo_up_to_date(nfo_path, _find_media_file(folder, base_name)):
+        return "skipped", nfo_path
+    metadata = tmdb_cache.get_episode_metadata(tmdb_id, int(season), episode_num)
+    if not metadata:
+        return "failed", nfo_path
+    return "written", write_nfo(folder, f"{base_name}.nfo", episode_nfo(metadata, int(season), episode_num))
+
+def _write_library_movie_nfo(folder, media_path, force):
+    folder_name_on_disk = os.path.basename(folder)
+    base_name = os.path.splitext(os.path.basename(media_path))[0]
+    nfo_path = os.path.join(folder, f"{base_name}.nfo")
+    if not force and nfo_up_to_date(nfo_path, media_path):
+        return "skipped", nfo_path
+    name = FOLDER_PATTERN.match(folder_name_on_disk).group('name')
+    tmdb_id = tmdb_cache.search_movie_id(name)
+    metadata = tmdb_cache.get_movie_metadata(tmdb_id) if tmdb_id else None
+    if not metadata:
+        return "failed", nfo_path
+    queue_movie_artwork(folder, tmdb_id)
+    return "written", write_nfo(folder, f"{base_name}.nfo", movie_nfo(metadata))
+
+def _write_library_episode_nfo(series_name, folder, media_path, force):
+    base_name = os.path.splitext(os.path.basename(media_path))[0]
+    nfo_path = os.path.join(folder, f"{base_name}.nfo")
+    if not force and nfo_up_to_date(nfo_path, media_path):
+        return "skipped", nfo_path
+    match = EPISODE_FILE_PATTERN.match(base_name)
+    if not match:
+        return "failed", nfo_path
+    season, episode_num = int(match.group('season')), int(match.group('episode'))
+    tmdb_id = tmdb_cache.search_series_id(series_name)
+    metadata = tmdb_cache.get_episode_metadata(tmdb_id, season, episode_num) if tmdb_id else None
+    if not metadata:
+        return "failed", nfo_path
+    queue_series_artwork(os.path.dirname(folder), tmdb_id, [season])
+    queue_episode_artwork(folder, base_name, tmdb_id, season, episode_num)
+    return "written", write_nfo(folder, f"{base_name}.nfo", episode_nfo(metadata, season, episode_num))
+
+# --- Exécution des travaux ---
+def _run_tasks(job, tasks):
+    """Exécute les tâches (callables renvoyant (résultat, chemin)) en parallèle en suivant la progression."""
+    with _jobs_lock:
+        job["total"] = len(tasks)
+        job["status"] = "running"
+
+    def run(task):
+        try:
+            result, path = task()
+            _record(job, result, f"NFO non généré : {path}" if result == "failed" else None)
+        except Exception as e:
+            _record(job, "failed", str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, BULK_NFO_WORKERS)) as executor:
+        list(executor.map(run, tasks))
+
+    with _jobs_lock:
+        job["status"] = "finished"
+        job["finished"] = datetime.now().isoformat(timespec='seconds')
+    print(f"[{_now_str()}] Travail NFO '{job['description']}' terminé : {job['written']} écrit(s), {job['skipped']} à jour, {job['failed']} échec(s).")
+
+def _start(job, collect_tasks):
+    def target():
+        try:
+            tasks = collect_tasks()
+        except Exception as e:
+            with _jobs_lock:
+                job["status"] = "error"
+                job["errors"].append(str(e))
+                job["finished"] = datetime.now().isoformat(timespec='seconds')
+            print(f"[{_now_str()}] Erreur lors de la préparation du travail NFO '{job['description']}': {e}")
+            return
+        _run_tasks(job, tasks)
+    threading.Thread(target=target, daemon=True).start()
+    return get_bulk_job(job["id"])
+
+def start_series_nfo_job(series_id, season=None, force=False):
+    """NFO de tous les épisodes d'une série, ou d'une seule saison. Une seule requête get_series_info."""
+    description = f"série {series_id}" + (f" saison {season}" if season is not None else "")
+    job = _new_job("season" if season is not None else "series", description)
+
+    def collect_tasks():
+        data = xtream_api.get_series_info(series_id)
+        series_info = data.get('info', {})
+        tmdb_id = tmdb_cache.search_series_id(clean_name(series_info.get('name', '')))
+        if not tmdb_id:
+            raise ValueError(f"ID TMDB introuvable pour : {series_info.get('name', series_id)}")
+        tasks = []
+        seasons = set()
+        missing = 0
+        for season_num_str, episodes in (data.get('episodes') or {}).items():
+            for ep in episodes:
+                ep_season = int(ep.get('season', season_num_str))
+                if season is not None and ep_season != int(season):
+                    continue
+                # Comme pour la bibliothèque : seulement les épisodes présents sur le disque
+                if not _find_media_file(*_episode_location(series_info, ep, ep_season)):
+                    missing += 1
+                    continue
+                seasons.add(ep_season)
+                tasks.append(lambda ep=ep, ep_season=ep_season: write_episode_nfo(series_info, tmdb_id, ep, ep_season, force))
+        if missing:
+            print(f"[{_now_str()}] Travail NFO '{description}' : {missing} épisode(s) non téléchargé(s) ignoré(s).")
+        if seasons:
+            series_dir = os.path.join(DOWNLOAD_PATH_SERIES, series_folder_name(series_info))
+            queue_series_artwork(series_dir, tmdb_id, seasons)
+        return tasks
+
+    return _start(job, collect_tasks)
+
+def start_library_nfo_job(kind, force=False):
+    """NFO de tout ce qui est déjà présent sous DOWNLOAD_PATH_MOVIES ('movies') ou DOWNLOAD_PATH_SERIES ('series')."""
+    root = DOWNLOAD_PATH_MOVIES if kind == "movies" else DOWNLOAD_PATH_SERIES
+    job = _new_job("library", f"bibliothèque {kind} ({root})")
+
+    def collect_tasks():
+        tasks = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for file_name in filenames:
+                if file_name.rsplit('.', 1)[-1].lower() not in VIDEO_EXTENSIONS:
+                    continue
+                media_path = os.path.join(dirpath, file_name)
+                if kind == "movies":
+                    tasks.append(lambda d=dirpath, m=media_path: _write_library_movie_nfo(d, m, force))
+                else:
+                    # Série (Année)/Season NN/fichier : le nom de la série vient du dossier parent de la saison
+                    series_dir = os.path.basename(os.path.dirname(dirpath))
+                    series_name = FOLDER_PATTERN.match(series_dir).group('name')
+                    tasks.append(lambda n=series_name, d=dirpath, m=media_path: _write_library_episode_nfo(n, d, m, force))
+        return tasks
+
+    return _start(job, collect_tasks)
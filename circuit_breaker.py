@@ -0,0 +1,183 @@
+# circuit_breaker.py
+#
+# Disjoncteurs par service et par point d'accès (xtream:get_series_info, tmdb:search, xtream:stream...).
+# Chaque disjoncteur suit, sur une fenêtre glissante, le taux d'erreurs et la latence des appels. Quand
+# trop d'appels échouent (ou sont trop lents), il s'ouvre : les appels suivants échouent tout de suite
+# (CircuitOpenError) au lieu d'attendre une connexion, et les appelants servent leurs données en cache.
+# Après BREAKER_OPEN_SECONDS, un seul appel d'essai est laissé passer : sa réussite referme le disjoncteur.
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import requests
+
+import metrics
+
+# --- Configuration ---
+# Fenêtre glissante sur laquelle sont calculés le taux d'erreurs et la latence
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", 60))
+# Nombre minimal d'appels dans la fenêtre avant de pouvoir ouvrir le disjoncteur
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+# Part d'appels en échec (ou plus lents que BREAKER_SLOW_CALL_SECONDS) qui ouvre le disjoncteur
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+# Un appel plus long compte comme un échec (0 = latence ignorée)
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 30))
+# Durée d'ouverture avant l'appel d'essai
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 60))
+
+# Valeurs de la jauge vod_upstream_breaker_state
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Appel refusé sans contacter le service : son disjoncteur est ouvert.
+
+    Sous-classe de ConnectionError : les appelants qui gèrent déjà les erreurs réseau la traitent comme telle.
+    """
+
+class CircuitBreaker:
+
+    def __init__(self, service, endpoint):
+        self.service = service
+        self.endpoint = endpoint
+        self.name = f"{service}:{endpoint}"
+        self._lock = threading.Lock()
+        # (horodatage, réussite, durée en secondes ou None)
+        self._calls = deque()
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.last_error = None
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - BREAKER_WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < BREAKER_OPEN_SECONDS:
+            return "open"
+        return "half_open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.time())
+
+    def is_open(self):
+        """Ouvert et pas encore prêt pour l'appel d'essai."""
+        return self.state == "open"
+
+    def allow(self):
+        """Indique si un appel peut partir. En demi-ouverture, un seul appel d'essai à la fois."""
+        with self._lock:
+            state = self._state(time.time())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def check(self):
+        """Lève CircuitOpenError si l'appel ne peut pas partir."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} indisponible (disjoncteur ouvert), nouvel essai dans {self.retry_in():.0f}s.")
+
+    def retry_in(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + BREAKER_OPEN_SECONDS - time.time())
+
+    def record(self, ok, seconds=None, error=None):
+        """Enregistre l'issue d'un appel (seconds=None : durée non significative, un téléchargement par exemple)."""
+        now = time.time()
+        good = ok and not (BREAKER_SLOW_CALL_SECONDS and seconds is not None and seconds > BREAKER_SLOW_CALL_SECONDS)
+        with self._lock:
+            self._calls.append((now, good, seconds))
+            self._trim(now)
+            if not ok and error is not None:
+                self.last_error = str(error)[:300]
+            state = self._state(now)
+            if state != "closed":
+                if not self._probe_in_flight and state == "open":
+                    return # Appel parti avant l'ouverture : sans effet sur le disjoncteur ouvert
+                self._probe_in_flight = False
+                if good:
+                    self._opened_at = None
+                    self._calls.clear()
+                    transition = "refermé"
+                else:
+                    self._opened_at = now
+                    transition = "toujours ouvert"
+            else:
+                failures = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+                if len(self._calls) < BREAKER_MIN_CALLS or failures / len(self._calls) < BREAKER_FAILURE_RATE:
+                    return
+                self._opened_at = now
+                transition = f"ouvert ({failures}/{len(self._calls)} appels en échec ou trop lents)"
+        print(f"[{_now_str()}] Disjoncteur {self.name} {transition}.")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            self._trim(now)
+            calls = list(self._calls)
+            state = self._state(now)
+            opened_at = self._opened_at
+            last_error = self.last_error
+        durations = sorted(seconds for _, _, seconds in calls if seconds is not None)
+        return {
+            "service": self.service,
+            "endpoint": self.endpoint,
+            "state": state,
+            "calls": len(calls),
+            "failure_rate": round(sum(1 for _, ok, _ in calls if not ok) / len(calls), 3) if calls else 0.0,
+            "avg_seconds": round(sum(durations) / len(durations), 3) if durations else None,
+            "p95_seconds": round(durations[int(0.95 * (len(durations) - 1))], 3) if durations else None,
+            "opened_at": datetime.fromtimestamp(opened_at).isoformat(timespec='seconds') if opened_at else None,
+            "retry_in_seconds": round(max(0.0, opened_at + BREAKER_OPEN_SECONDS - now), 1) if opened_at else None,
+            "last_error": last_error,
+        }
+
+def get_breaker(service, endpoint):
+    name = f"{service}:{endpoint}"
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(service, endpoint)
+        return breaker
+
+def service_open(service):
+    """Indique si un disjoncteur du service est ouvert (fournisseur considéré comme indisponible)."""
+    with _registry_lock:
+        breakers = [b for b in _breakers.values() if b.service == service]
+    return any(b.is_open() for b in breakers)
+
+def service_retry_in(service):
+    """Secondes avant l'appel d'essai du disjoncteur ouvert du service le plus récent."""
+    with _registry_lock:
+        breakers = [b for b in _breakers.values() if b.service == service]
+    return max((b.retry_in() for b in breakers if b.is_open()), default=0.0)
+
+def get_breakers():
+    """État de tous les disjoncteurs (GET /health/upstream)."""
+    with _registry_lock:
+        breakers = sorted(_breakers.values(), key=lambda b: b.name)
+    return [b.stats() for b in breakers]
+
+def _collect_metrics():
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    metrics.UPSTREAM_BREAKER_STATE.replace({(b.service, b.endpoint): _STATE_VALUES[b.state] for b in breakers})
+
+metrics.register_collector(_collect_metrics)
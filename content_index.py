@@ -0,0 +1,76 @@
+# content_index.py
+
+import os
+import json
+import threading
+from datetime import datetime
+
+# --- Configuration ---
+# Empreinte SHA-256 de chaque fichier terminé : {item_id: {"sha256", "size", "path", "tmdb_id", "item_type", "completed_at"}}
+CONTENT_INDEX_FILE = "content_index.json"
+
+_lock = threading.Lock()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _load():
+    if not os.path.exists(CONTENT_INDEX_FILE):
+        return {}
+    try:
+        with open(CONTENT_INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"[{_now_str()}] Erreur : Le fichier {CONTENT_INDEX_FILE} est corrompu ou vide. Initialisation d'un index vide.")
+        return {}
+
+_items = _load()
+
+def _save():
+    """Enregistre l'index. Doit être appelée avec _lock détenu."""
+    try:
+        tmp_file = f"{CONTENT_INDEX_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(_items, f, indent=4)
+        os.replace(tmp_file, CONTENT_INDEX_FILE)
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {CONTENT_INDEX_FILE}: {e}")
+
+def record(item_id, sha256, size, path, tmdb_id=None, item_type=None):
+    with _lock:
+        _items[str(item_id)] = {
+            "sha256": sha256,
+            "size": size,
+            "path": path,
+            "tmdb_id": tmdb_id,
+            "item_type": item_type,
+            "completed_at": datetime.now().isoformat(timespec='seconds'),
+        }
+        _save()
+
+def get_record(item_id):
+    with _lock:
+        entry = _items.get(str(item_id))
+        return dict(entry) if entry else None
+
+def find_duplicate(sha256, size):
+    """Chemin d'un fichier terminé au contenu identique (même SHA-256 et même taille) encore présent, ou None."""
+    if not sha256:
+        return None
+    with _lock:
+        candidates = [entry["path"] for entry in _items.values() if entry.get("sha256") == sha256 and entry.get("size") == size]
+    for path in candidates:
+        try:
+            if os.path.getsize(path) == size:
+                return path
+        except OSError:
+            continue
+    return None
+
+def items_with_tmdb_id(tmdb_id, item_type="movie"):
+    """ID des éléments terminés qui correspondent au même titre TMDB (variantes PL/EN/4K du catalogue)."""
+    if not tmdb_id:
+        return []
+    with _lock:
+        return [item_id for item_id, entry in _items.items()
+                if str(entry.get("tmdb_id")) == str(tmdb_id) and entry.get("item_type") == item_type]
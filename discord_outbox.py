@@ -0,0 +1,273 @@
+# discord_outbox.py
+
+import os
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+# --- Configuration ---
+DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
+OUTBOX_FILE = "discord_outbox.json"
+# Notifications impossibles à construire (entrée mal formée), retirées de la boîte d'envoi
+OUTBOX_REJECTED_FILE = "discord_outbox_rejected.jsonl"
+# Délai d'attente avant l'envoi, pour regrouper les épisodes détectés dans un même passage
+OUTBOX_BATCH_DELAY_SECONDS = float(os.getenv("DISCORD_BATCH_DELAY_SECONDS", 5))
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+
+# Limites des embeds Discord (https://discord.com/developers/docs/resources/message#embed-object-embed-limits)
+EMBED_TITLE_LIMIT = 256
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBEDS_PER_MESSAGE = 10
+EMBED_TOTAL_CHARS_PER_MESSAGE = 6000
+
+EMBED_COLOR = 0x3498DB
+EMBED_FOOTER = "Moniteur de Séries (Xtream)"
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _load_outbox():
+    if not os.path.exists(OUTBOX_FILE):
+        return []
+    try:
+        with open(OUTBOX_FILE, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+            return json.loads(content) if content else []
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[{_now_str()}] Erreur : Le fichier {OUTBOX_FILE} est illisible ({e}). Boîte d'envoi Discord vide.")
+        return []
+
+# --- État de la boîte d'envoi ---
+# Liste de notifications en attente : une entrée par série, les épisodes y sont fusionnés
+_pending = _load_outbox()
+_lock = threading.Lock()
+_wake_event = threading.Event()
+_worker_thread = None
+
+def _save_outbox():
+    """Enregistre les notifications non livrées. Doit être appelée avec _lock détenu."""
+    try:
+        tmp_file = f"{OUTBOX_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(_pending, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, OUTBOX_FILE)
+    except Exception as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {OUTBOX_FILE}: {e}")
+
+def queue_new_episodes_notification(series_id, series_name, cover_url, episodes):
+    """Ajoute les nouveaux épisodes d'une série à la boîte d'envoi (non bloquant).
+
+    episodes : liste de dicts {'season', 'episode_num', 'title'}. Les épisodes d'une série
+    déjà en attente sont fusionnés dans la même notification.
+    """
+    if not episodes:
+        return
+    if not DISCORD_WEBHOOK_URL:
+        print(f"[{_now_str()}] Avertissement : DISCORD_WEBHOOK_URL non configuré. N'envoie pas de notification.")
+        return
+    start_discord_outbox()
+    series_id = str(series_id)
+    with _lock:
+        entry = next((e for e in _pending if e['series_id'] == series_id), None)
+        if entry is None:
+            entry = {
+                'id': uuid.uuid4().hex,
+                'series_id': series_id,
+                'series_name': series_name,
+                'cover_url': cover_url,
+                'episodes': [],
+                'created': datetime.now().isoformat(),
+            }
+            _pending.append(entry)
+        known = {_episode_key(ep) for ep in entry['episodes']}
+        for ep in episodes:
+            if _episode_key(ep) not in known:
+                entry['episodes'].append({'season': ep['season'], 'episode_num': ep['episode_num'], 'title': ep.get('title', '')})
+        _save_outbox()
+    _wake_event.set()
+
+def _episode_key(ep):
+    return (str(ep['season']), str(ep['episode_num']))
+
+def _build_embeds(entry):
+    """Construit les embeds d'une série en respectant la limite de description.
+
+    Renvoie une liste de tuples (embed, clés des épisodes contenus dans l'embed).
+    """
+    count = len(entry['episodes'])
+    if count == 1:
+        title = "Nouvel épisode de série ! 🔔"
+    else:
+        title = f"{count} nouveaux épisodes ! 🔔"
+    header = f"**{entry['series_name']}**\n"
+
+    chunks = []
+    current, current_keys = header, []
+    for ep in sorted(entry['episodes'], key=lambda e: (int(e['season']), int(e['episode_num']))):
+        line = f"S{int(ep['season']):02d}E{int(ep['episode_num']):02d}"
+        if ep.get('title'):
+            line += f" – {ep['title']}"
+        line = line[:200]
+        if current_keys and len(current) + len(line) + 1 > EMBED_DESCRIPTION_LIMIT:
+            chunks.append((current, current_keys))
+            current, current_keys = header, []
+        current += line + "\n"
+        current_keys.append(_episode_key(ep))
+    chunks.append((current, current_keys))
+
+    embeds = []
+    for index, (description, keys) in enumerate(chunks):
+        embed = {
+            "title": (title if index == 0 else f"{title} (suite)")[:EMBED_TITLE_LIMIT],
+            "description": description.strip(),
+            "color": EMBED_COLOR,
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "footer": {"text": EMBED_FOOTER},
+        }
+        if entry.get('cover_url'):
+            embed["thumbnail"] = {"url": entry['cover_url']}
+        embeds.append((embed, keys))
+    return embeds
+
+def _embed_size(embed):
+    return len(embed["title"]) + len(embed["description"]) + len(embed["footer"]["text"])
+
+def _quarantine(entry, error):
+    """Retire de la boîte d'envoi une entrée impossible à envoyer et la conserve dans OUTBOX_REJECTED_FILE."""
+    print(f"[{_now_str()}] Notification Discord mal formée pour la série {entry.get('series_id')} ({error}) : mise de côté dans {OUTBOX_REJECTED_FILE}.")
+    with _lock:
+        _pending[:] = [e for e in _pending if e.get('id') != entry.get('id')]
+        _save_outbox()
+    try:
+        with open(OUTBOX_REJECTED_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(entry, error=str(error), rejected=datetime.now().isoformat()), ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {OUTBOX_REJECTED_FILE}: {e}")
+
+def _next_batch():
+    """Sélectionne les embeds à envoyer dans un seul message.
+
+    Renvoie (embeds, {id d'entrée: clés des épisodes envoyés}). Les entrées mal formées sont mises de côté.
+    """
+    with _lock:
+        entries = [dict(e, episodes=list(e.get('episodes') or [])) for e in _pending]
+    embeds = []
+    sent_keys = {}
+    total_chars = 0
+    for entry in entries:
+        try:
+            entry_embeds = _build_embeds(entry)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            _quarantine(entry, e)
+            continue
+        for embed, keys in entry_embeds:
+            size = _embed_size(embed)
+            if embeds and (len(embeds) >= EMBEDS_PER_MESSAGE or total_chars + size > EMBED_TOTAL_CHARS_PER_MESSAGE):
+                return embeds, sent_keys
+            embeds.append(embed)
+            total_chars += size
+            sent_keys.setdefault(entry['id'], []).extend(keys)
+    return embeds, sent_keys
+
+def _acknowledge(sent_keys):
+    """Retire de la boîte d'envoi les épisodes livrés (en conservant ceux ajoutés pendant l'envoi)."""
+    with _lock:
+        remaining = []
+        for entry in _pending:
+            keys = set(sent_keys.get(entry['id'], []))
+            if keys:
+                entry['episodes'] = [ep for ep in entry['episodes'] if _episode_key(ep) not in keys]
+            if entry['episodes']:
+                remaining.append(entry)
+        _pending[:] = remaining
+        _save_outbox()
+
+def _retry_after_seconds(response):
+    """Délai imposé par Discord (en-tête Retry-After ou champ retry_after du corps JSON)."""
+    try:
+        body = response.json()
+        if isinstance(body, dict) and body.get('retry_after') is not None:
+            return float(body['retry_after'])
+    except ValueError:
+        pass
+    try:
+        return float(response.headers.get('Retry-After', 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+def _outbox_worker():
+    backoff = 1
+    while True:
+        _wake_event.wait()
+        # Laisser le moniteur terminer sa série en cours pour regrouper les épisodes
+        time.sleep(OUTBOX_BATCH_DELAY_SECONDS)
+        _wake_event.clear()
+
+        while True:
+            try:
+                embeds, sent_keys = _next_batch()
+            except Exception as e:
+                # Le seul thread d'envoi ne doit jamais s'arrêter : on réessaie au prochain réveil
+                print(f"[{_now_str()}] Erreur inattendue lors de la préparation des notifications Discord: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, OUTBOX_MAX_BACKOFF_SECONDS)
+                _wake_event.set()
+                break
+            if not embeds:
+                break
+            try:
+                response = requests.post(DISCORD_WEBHOOK_URL, json={"embeds": embeds}, timeout=15)
+            except requests.exceptions.RequestException as e:
+                print(f"[{_now_str()}] Erreur lors de l'envoi de la notification Discord: {e}. Nouvel essai dans {backoff}s.")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, OUTBOX_MAX_BACKOFF_SECONDS)
+                continue
+
+            if response.status_code == 429:
+                delay = _retry_after_seconds(response)
+                print(f"[{_now_str()}] Limite de débit Discord atteinte. Nouvel essai dans {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            if response.status_code >= 500:
+                print(f"[{_now_str()}] Erreur serveur Discord ({response.status_code}). Nouvel essai dans {backoff}s.")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, OUTBOX_MAX_BACKOFF_SECONDS)
+                continue
+            if response.status_code >= 400:
+                # Requête refusée (webhook invalide ou contenu rejeté) : inutile de réessayer
+                print(f"[{_now_str()}] Notification Discord rejetée ({response.status_code}): {response.text[:200]}. Abandon.")
+            else:
+                print(f"[{_now_str()}] Notification Discord envoyée avec succès ({len(embeds)} embed(s)).")
+            backoff = 1
+            _acknowledge(sent_keys)
+
+            # Respecter le quota restant annoncé par Discord avant le message suivant
+            if response.headers.get('X-RateLimit-Remaining') == '0':
+                try:
+                    time.sleep(float(response.headers.get('X-RateLimit-Reset-After', 1)))
+                except ValueError:
+                    time.sleep(1)
+
+def start_discord_outbox():
+    """Démarre le worker d'envoi (une seule fois) et reprend les notifications non livrées."""
+    global _worker_thread
+    with _lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(target=_outbox_worker, daemon=True)
+        _worker_thread.start()
+        pending_count = len(_pending)
+    if pending_count:
+        print(f"[{_now_str()}] Reprise de {pending_count} notification(s) Discord non livrée(s).")
+        _wake_event.set()
+
+def get_outbox_status():
+    with _lock:
+        return {
+            "pending_series": len(_pending),
+            "pending_episodes": sum(len(e['episodes']) for e in _pending),
+        }
@@ -0,0 +1,97 @@
+# disk_admission.py
+
+import os
+import shutil
+import threading
+
+import requests
+
+# --- Configuration ---
+# Espace toujours laissé libre sur chaque volume, en plus des réservations des tâches
+DISK_MIN_FREE_GB = float(os.getenv("DISK_MIN_FREE_GB", 5))
+# Délai avant de retenter une tâche retenue faute d'espace
+DISK_SPACE_RETRY_SECONDS = float(os.getenv("DISK_SPACE_RETRY_SECONDS", 300))
+SIZE_REQUEST_TIMEOUT_SECONDS = 15
+
+# --- Réservations ---
+# {item_id: {st_dev: octets}} : espace promis aux tâches admises mais pas encore écrit sur le volume
+_reservations = {}
+_lock = threading.Lock()
+
+def _existing_ancestor(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def _volume(path):
+    """(st_dev, espace libre en octets) du volume qui contiendra path."""
+    existing = _existing_ancestor(path)
+    return os.stat(existing).st_dev, shutil.disk_usage(existing).free
+
+def get_remote_size(url):
+    """Taille annoncée par le fournisseur (Content-Length d'une requête HEAD), ou None si inconnue."""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=SIZE_REQUEST_TIMEOUT_SECONDS)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        size = int(response.headers.get('Content-Length', ''))
+    except ValueError:
+        return None
+    return size if size > 0 else None
+
+def job_size(job):
+    """Taille du fichier d'une tâche, mise en cache dans job["size_bytes"] (None si inconnue)."""
+    if job.get("size_bytes") is None and not job.get("size_checked"):
+        job["size_bytes"] = get_remote_size(job["cmd"][3])
+        job["size_checked"] = True
+    return job.get("size_bytes")
+
+def try_reserve(item_id, needs):
+    """Réserve l'espace d'une tâche. needs : [(chemin, octets)] ; pour plusieurs chemins d'un même volume,
+    seul le plus grand besoin compte (le .part et le fichier final ne coexistent pas après un renommage).
+
+    Renvoie (True, None) si tout tient, sinon (False, message) sans rien réserver.
+    """
+    item_id = str(item_id)
+    min_free = DISK_MIN_FREE_GB * 1024 ** 3
+    with _lock:
+        wanted = {}
+        free_by_dev = {}
+        for path, size in needs:
+            dev, free = _volume(path)
+            wanted[dev] = max(wanted.get(dev, 0), size or 0)
+            free_by_dev[dev] = (free, path)
+        for dev, size in wanted.items():
+            free, path = free_by_dev[dev]
+            reserved = sum(r.get(dev, 0) for other_id, r in _reservations.items() if other_id != item_id)
+            available = free - reserved - min_free
+            if size > available:
+                return False, (f"Espace insuffisant sur le volume de {os.path.dirname(path)} : "
+                               f"{size / 1024 ** 3:.2f} Go nécessaires, {max(0, available) / 1024 ** 3:.2f} Go disponibles "
+                               f"({reserved / 1024 ** 3:.2f} Go réservés, {DISK_MIN_FREE_GB:g} Go gardés libres)")
+        _reservations[item_id] = wanted
+    return True, None
+
+def release(item_id, path=None):
+    """Libère la réservation d'une tâche, pour un seul volume (celui de path) ou entièrement."""
+    item_id = str(item_id)
+    with _lock:
+        if path is None:
+            _reservations.pop(item_id, None)
+            return
+        reservation = _reservations.get(item_id)
+        if reservation:
+            reservation.pop(_volume(path)[0], None)
+            if not reservation:
+                _reservations.pop(item_id, None)
+
+def get_reservations():
+    with _lock:
+        return {item_id: sum(r.values()) for item_id, r in _reservations.items()}
@@ -0,0 +1,131 @@
+# download_client.py
+#
+# Accès à la file de téléchargement depuis l'interface web. Sans DOWNLOAD_DAEMON_URL, les fonctions
+# sont celles des modules locaux (un seul processus, comme avant) ; sinon chaque appel passe par l'API
+# du démon (download_daemon.py), seul propriétaire de queue.json, et l'interface peut tourner sur
+# plusieurs processus.
+
+import os
+from urllib.parse import urlencode
+
+import requests
+
+# --- Configuration ---
+DOWNLOAD_DAEMON_URL = os.getenv("DOWNLOAD_DAEMON_URL", "").rstrip('/')
+DOWNLOAD_DAEMON_TOKEN = os.getenv("DOWNLOAD_DAEMON_TOKEN", "")
+DOWNLOAD_DAEMON_TIMEOUT_SECONDS = float(os.getenv("DOWNLOAD_DAEMON_TIMEOUT_SECONDS", 10))
+
+REMOTE = bool(DOWNLOAD_DAEMON_URL)
+
+class DownloadDaemonUnavailable(Exception):
+    """Le démon de téléchargement ne répond pas (ou renvoie une erreur)."""
+
+if not REMOTE:
+    from downloader_core import (
+        add_to_download_queue,
+        get_queue_status,
+        get_full_queue_data,
+        remove_from_queue,
+        reorder_queue,
+        get_completed_items,
+        get_held_jobs,
+        get_stall_events,
+        retry_job
+    )
+    from job_leases import get_leases
+    from job_history import query_history, history_trends
+    from circuit_breaker import get_breakers
+    from enrichment import schedule_movie_enrichment
+    from monitor_scheduler import trigger_monitor_run, get_monitor_status
+    from library_scanner import trigger_library_scan, get_library_scan_status
+    from bulk_nfo import start_series_nfo_job, start_library_nfo_job, get_bulk_job, list_bulk_jobs
+else:
+    _session = requests.Session()
+    if DOWNLOAD_DAEMON_TOKEN:
+        _session.headers["X-Daemon-Token"] = DOWNLOAD_DAEMON_TOKEN
+
+    def _call(method, path, json_body=None, missing_ok=False):
+        """missing_ok : une réponse 404 renvoie None au lieu de lever DownloadDaemonUnavailable."""
+        try:
+            response = _session.request(method, f"{DOWNLOAD_DAEMON_URL}{path}", json=json_body,
+                                        timeout=DOWNLOAD_DAEMON_TIMEOUT_SECONDS)
+        except requests.exceptions.RequestException as e:
+            raise DownloadDaemonUnavailable(f"Démon de téléchargement injoignable ({DOWNLOAD_DAEMON_URL}) : {e}")
+        if missing_ok and response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise DownloadDaemonUnavailable(f"Erreur du démon de téléchargement ({method} {path}) : statut {response.status_code}")
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    def add_to_download_queue(job_details):
+        return _call("POST", "/jobs", job_details)["added"]
+
+    def get_queue_status():
+        return _call("GET", "/queue/status")
+
+    def get_full_queue_data():
+        return _call("GET", "/queue")
+
+    def remove_from_queue(item_id):
+        _call("DELETE", f"/jobs/{item_id}")
+
+    def reorder_queue(order_list):
+        _call("POST", "/queue/reorder", {"order": order_list})
+
+    def get_completed_items():
+        return _call("GET", "/completed")
+
+    def get_held_jobs():
+        return _call("GET", "/queue/held")
+
+    def get_stall_events():
+        return _call("GET", "/queue/stalls")
+
+    def get_leases():
+        return _call("GET", "/leases")
+
+    def retry_job(item_id):
+        return _call("POST", f"/jobs/{item_id}/retry")["retried"]
+
+    def query_history(limit=200, **filters):
+        params = {key: value for key, value in filters.items() if value}
+        return _call("GET", f"/history?{urlencode(dict(params, limit=limit))}")
+
+    def history_trends(weeks=12, item_type=None, series_id=None):
+        params = {key: value for key, value in {"item_type": item_type, "series_id": series_id}.items() if value}
+        return _call("GET", f"/history/trends?{urlencode(dict(params, weeks=weeks))}")
+
+    def get_breakers():
+        # Disjoncteurs du démon (téléchargements, surveillance, enrichissement TMDB)
+        return _call("GET", "/health/upstream")
+
+    def schedule_movie_enrichment(job):
+        _call("POST", f"/jobs/{job['item_id']}/enrichment")
+
+    def trigger_monitor_run(trigger="manuel"):
+        return _call("POST", "/monitor/run", {"trigger": trigger})["started"]
+
+    def get_monitor_status():
+        return _call("GET", "/monitor/status")
+
+    def trigger_library_scan(trigger="manuel", full=False):
+        return _call("POST", "/library/scan", {"trigger": trigger, "full": full})["started"]
+
+    def get_library_scan_status():
+        return _call("GET", "/library/scan/status")
+
+    # Travaux NFO en masse : exécutés par le démon, pour que tous les processus web voient leur progression
+    # et que le débit TMDB (TMDB_MAX_REQUESTS_PER_SECOND) ne soit pas multiplié par le nombre de processus
+    def start_series_nfo_job(series_id, season=None, force=False):
+        return _call("POST", f"/nfo/bulk/series/{series_id}", {"season": season, "force": force})
+
+    def start_library_nfo_job(kind, force=False):
+        return _call("POST", "/nfo/bulk/library", {"kind": kind, "force": force})
+
+    def get_bulk_job(job_id):
+        return _call("GET", f"/nfo/jobs/{job_id}", missing_ok=True)
+
+    def list_bulk_jobs():
+        return _call("GET", "/nfo/jobs")
@@ -0,0 +1,270 @@
+# download_daemon.py
+#
+# Démon de téléchargement : seul processus propriétaire de queue.json et completed.json.
+# Il exécute le worker wget, le déplacement vers la bibliothèque, l'enrichissement TMDB, la surveillance
+# des épisodes et l'analyse de la bibliothèque, et expose une petite API JSON locale utilisée par
+# download_client.py quand l'interface web tourne sur plusieurs processus (gunicorn), ainsi que le
+# protocole de baux des nœuds de téléchargement distants (job_leases.py, remote_worker.py).
+#
+#   python download_daemon.py
+#   DOWNLOAD_DAEMON_URL=http://127.0.0.1:5055 gunicorn -w 4 -b 0.0.0.0:5000 app:app
+
+import hmac
+import ipaddress
+import os
+import re
+from datetime import datetime
+
+from flask import Flask, Response, request, jsonify, abort
+
+# --- Configuration ---
+DOWNLOAD_DAEMON_HOST = os.getenv("DOWNLOAD_DAEMON_HOST", "127.0.0.1")
+DOWNLOAD_DAEMON_PORT = int(os.getenv("DOWNLOAD_DAEMON_PORT", 5055))
+# Jeton partagé avec l'interface web (en-tête X-Daemon-Token) ; vide : pas de contrôle (écoute locale uniquement)
+DOWNLOAD_DAEMON_TOKEN = os.getenv("DOWNLOAD_DAEMON_TOKEN", "")
+
+XTREAM_HOST = os.getenv("XTREAM_HOST")
+XTREAM_PORT = os.getenv("XTREAM_PORT")
+XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
+XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
+DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
+DOWNLOAD_PATH_SERIES = os.getenv("DOWNLOAD_PATH_SERIES", "/downloads/Seriale")
+
+# Champs d'une tâche acceptés de l'interface ; les autres (part_path, final_path, lease, stage...) appartiennent au démon
+JOB_FIELDS = ("item_id", "item_type", "title", "file", "series", "series_id", "season", "episode_num")
+# Type de tâche : (chemin du flux Xtream, dossier de destination autorisé)
+STREAM_KINDS = {"movie": ("movie", DOWNLOAD_PATH_MOVIES), "serial_episode": ("series", DOWNLOAD_PATH_SERIES)}
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_SAFE_EXT = re.compile(r"^[A-Za-z0-9]{1,8}$")
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def build_job(data):
+    """Tâche à mettre en file à partir du corps de POST /jobs, ou None si elle est invalide.
+
+    La commande wget est exécutée telle quelle par le worker et par les nœuds distants : elle est
+    reconstruite ici (flux de XTREAM_HOST, destination sous DOWNLOAD_PATH_*) au lieu d'être reprise de la requête.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("cmd"), list) or len(data["cmd"]) != 4:
+        return None
+    item_id = str(data.get("item_id") or "")
+    kind = STREAM_KINDS.get(data.get("item_type"))
+    if kind is None or not _SAFE_ID.match(item_id) or not isinstance(data["cmd"][2], str):
+        return None
+    stream_path, root = kind
+    destination = os.path.abspath(data["cmd"][2])
+    ext = os.path.splitext(destination)[1].lstrip('.')
+    if not destination.startswith(os.path.abspath(root) + os.sep) or not _SAFE_EXT.match(ext):
+        return None
+    job = {key: data[key] for key in JOB_FIELDS if key in data}
+    job["item_id"] = item_id
+    job["cmd"] = ["wget", "-O", destination, f"{XTREAM_HOST}:{XTREAM_PORT}/{stream_path}/{XTREAM_USERNAME}/{XTREAM_PASSWORD}/{item_id}.{ext}"]
+    enrichment = data.get("enrichment")
+    if isinstance(enrichment, dict) and isinstance(enrichment.get("query"), str):
+        job["enrichment"] = {"status": "pending", "query": enrichment["query"], "ext": ext}
+    return job
+
+def start_background_services():
+    """Démarre tout ce qui modifie la file d'attente. Un seul processus doit l'appeler :
+    app.py quand l'interface tourne seule, ou ce démon."""
+    from downloader_core import start_download_workers
+    from monitor_scheduler import start_monitor_scheduler
+    from discord_outbox import start_discord_outbox
+    from enrichment import start_enrichment_worker
+    from library_scanner import start_library_scanner
+    from job_leases import start_lease_reaper
+
+    start_download_workers()
+    # Remise dans la file des tâches des nœuds distants qui ne renouvellent plus leur bail
+    start_lease_reaper()
+    # Vérification périodique des nouveaux épisodes (MONITOR_INTERVAL_MINUTES, MONITOR_JITTER_SECONDS)
+    start_monitor_scheduler()
+    # Reprise des notifications Discord non livrées avant le dernier arrêt
+    start_discord_outbox()
+    # Reprise de l'enrichissement TMDB des films ajoutés avec un dossier provisoire
+    start_enrichment_worker()
+    # Rapprochement périodique des fichiers présents sur le disque avec completed.json
+    start_library_scanner()
+
+def create_daemon_app():
+    import circuit_breaker
+    import downloader_core
+    import job_leases
+    import job_history
+    import metrics
+    from enrichment import schedule_movie_enrichment
+    from monitor_scheduler import trigger_monitor_run, get_monitor_status
+    from library_scanner import trigger_library_scan, get_library_scan_status
+    import bulk_nfo
+
+    daemon_app = Flask(__name__)
+
+    @daemon_app.before_request
+    def check_token():
+        if DOWNLOAD_DAEMON_TOKEN and not hmac.compare_digest(request.headers.get("X-Daemon-Token", "").encode(),
+                                                             DOWNLOAD_DAEMON_TOKEN.encode()):
+            abort(401)
+
+    @daemon_app.route("/jobs", methods=["POST"])
+    def enqueue():
+        job = build_job(request.get_json(silent=True))
+        if job is None:
+            return jsonify({"error": "Tâche invalide."}), 400
+        return jsonify({"added": downloader_core.add_to_download_queue(job)})
+
+    @daemon_app.route("/jobs/<item_id>", methods=["DELETE"])
+    def cancel(item_id):
+        downloader_core.remove_from_queue(item_id)
+        return '', 204
+
+    @daemon_app.route("/jobs/<item_id>/retry", methods=["POST"])
+    def retry(item_id):
+        return jsonify({"retried": downloader_core.retry_job(item_id)})
+
+    @daemon_app.route("/jobs/<item_id>/enrichment", methods=["POST"])
+    def enrich(item_id):
+        job = next((j for j in downloader_core.get_full_queue_data() if str(j.get("item_id")) == item_id), None)
+        if job is None:
+            return jsonify({"error": "Tâche introuvable."}), 404
+        schedule_movie_enrichment(job)
+        return '', 202
+
+    @daemon_app.route("/queue")
+    def full_queue():
+        return jsonify(downloader_core.get_full_queue_data())
+
+    @daemon_app.route("/queue/status")
+    def queue_status():
+        return jsonify(downloader_core.get_queue_status())
+
+    @daemon_app.route("/queue/reorder", methods=["POST"])
+    def queue_reorder():
+        order = (request.get_json(silent=True) or {}).get("order", [])
+        downloader_core.reorder_queue(order)
+        return '', 204
+
+    @daemon_app.route("/queue/held")
+    def queue_held():
+        return jsonify(downloader_core.get_held_jobs())
+
+    @daemon_app.route("/queue/stalls")
+    def queue_stalls():
+        return jsonify(downloader_core.get_stall_events())
+
+    @daemon_app.route("/completed")
+    def completed():
+        return jsonify(downloader_core.get_completed_items())
+
+    @daemon_app.route("/history")
+    def history():
+        filters = {key: request.args.get(key) or None for key in job_history.HISTORY_FILTERS}
+        return jsonify(job_history.query_history(**filters, limit=request.args.get("limit", 200, type=int)))
+
+    @daemon_app.route("/history/trends")
+    def history_trends():
+        return jsonify(job_history.history_trends(request.args.get("weeks", 12, type=int), request.args.get("item_type") or None,
+                                                  request.args.get("series_id") or None))
+
+    @daemon_app.route("/monitor/run", methods=["POST"])
+    def monitor_run():
+        trigger = (request.get_json(silent=True) or {}).get("trigger", "manuel")
+        return jsonify({"started": trigger_monitor_run(trigger)})
+
+    @daemon_app.route("/monitor/status")
+    def monitor_status():
+        return jsonify(get_monitor_status())
+
+    @daemon_app.route("/library/scan", methods=["POST"])
+    def library_scan():
+        data = request.get_json(silent=True) or {}
+        return jsonify({"started": trigger_library_scan(data.get("trigger", "manuel"), full=bool(data.get("full")))})
+
+    @daemon_app.route("/library/scan/status")
+    def library_scan_status():
+        return jsonify(get_library_scan_status())
+
+    # --- Travaux NFO en masse (bulk_nfo.py) ---
+    @daemon_app.route("/nfo/bulk/series/<int:series_id>", methods=["POST"])
+    def nfo_bulk_series(series_id):
+        data = request.get_json(silent=True) or {}
+        season = data.get("season")
+        return jsonify(bulk_nfo.start_series_nfo_job(series_id, season=int(season) if season is not None else None,
+                                                     force=bool(data.get("force")))), 202
+
+    @daemon_app.route("/nfo/bulk/library", methods=["POST"])
+    def nfo_bulk_library():
+        data = request.get_json(silent=True) or {}
+        if data.get("kind") not in ("movies", "series"):
+            return jsonify({"error": "kind doit valoir movies ou series."}), 400
+        return jsonify(bulk_nfo.start_library_nfo_job(data["kind"], force=bool(data.get("force")))), 202
+
+    @daemon_app.route("/nfo/jobs")
+    def nfo_jobs():
+        return jsonify(bulk_nfo.list_bulk_jobs())
+
+    @daemon_app.route("/nfo/jobs/<job_id>")
+    def nfo_job_status(job_id):
+        job = bulk_nfo.get_bulk_job(job_id)
+        if not job:
+            return jsonify({"error": "Travail NFO introuvable."}), 404
+        return jsonify(job)
+
+    # --- Nœuds distants (remote_worker.py) ---
+    @daemon_app.route("/leases", methods=["POST"])
+    def lease_acquire():
+        worker_id = (request.get_json(silent=True) or {}).get("worker_id")
+        if not worker_id:
+            return jsonify({"error": "worker_id manquant."}), 400
+        lease = job_leases.acquire(str(worker_id))
+        return (jsonify(lease), 200) if lease else ('', 204)
+
+    @daemon_app.route("/leases/<lease_id>/heartbeat", methods=["POST"])
+    def lease_heartbeat(lease_id):
+        if not job_leases.heartbeat(lease_id, (request.get_json(silent=True) or {}).get("progress")):
+            return jsonify({"error": "Bail inconnu ou expiré."}), 410
+        return '', 204
+
+    @daemon_app.route("/leases/<lease_id>/complete", methods=["POST"])
+    def lease_complete(lease_id):
+        data = request.get_json(silent=True) or {}
+        if not job_leases.complete(lease_id, data.get("sha256"), data.get("size"), data.get("ext"), data.get("stats")):
+            return jsonify({"error": "Bail inconnu ou expiré."}), 410
+        return '', 204
+
+    @daemon_app.route("/leases/<lease_id>/fail", methods=["POST"])
+    def lease_fail(lease_id):
+        data = request.get_json(silent=True) or {}
+        if not job_leases.fail(lease_id, data.get("reason") or "erreur inconnue", data.get("stats"), data.get("kind")):
+            return jsonify({"error": "Bail inconnu ou expiré."}), 410
+        return '', 204
+
+    @daemon_app.route("/leases")
+    def lease_list():
+        return jsonify(job_leases.get_leases())
+
+    @daemon_app.route("/health/upstream")
+    def upstream_health():
+        return jsonify(circuit_breaker.get_breakers())
+
+    # Métriques du moteur de téléchargement (celles de l'interface restent sur /metrics de chaque processus web)
+    @daemon_app.route("/metrics")
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    return daemon_app
+
+if __name__ == '__main__':
+    if not DOWNLOAD_DAEMON_TOKEN and not _is_loopback(DOWNLOAD_DAEMON_HOST):
+        raise SystemExit(f"DOWNLOAD_DAEMON_TOKEN est obligatoire pour écouter sur {DOWNLOAD_DAEMON_HOST} (adresse non locale).")
+    start_background_services()
+    print(f"[{_now_str()}] Démon de téléchargement à l'écoute sur http://{DOWNLOAD_DAEMON_HOST}:{DOWNLOAD_DAEMON_PORT}")
+    create_daemon_app().run(host=DOWNLOAD_DAEMON_HOST, port=DOWNLOAD_DAEMON_PORT, threaded=True, debug=False, use_reloader=False)
@@ -1,19 +1,58 @@
 # downloader_core.py
 
 import os
+import errno
 import json
 import threading
 import queue
 import subprocess
 import time
+import multiprocessing
+from datetime import datetime
+from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from post_process import verify_download, POSTPROCESS_WORKERS
+from transfer_monitor import TransferMonitor, TransferStalled, wget_failure_kind
+import circuit_breaker
+import content_index
+import job_history
+import metrics
+from state_manager import StateManager
+from disk_admission import job_size, try_reserve, release, get_reservations, DISK_SPACE_RETRY_SECONDS
 
 # --- Configuration des fichiers d'état ---
 QUEUE_FILE = "queue.json"
 COMPLETED_FILE = "completed.json"
 DOWNLOAD_LOG_FILE = "downloads.log"
 
+# --- Configuration du dossier de préparation ---
+# Les téléchargements sont écrits en .part dans ce dossier (SSD de cache par exemple), puis déplacés
+# vers la bibliothèque une fois terminés. Vide : le .part est écrit à côté de sa destination.
+DOWNLOAD_STAGING_DIR = os.getenv("DOWNLOAD_STAGING_DIR", "")
+# Débit maximal de la copie vers la bibliothèque pendant qu'un téléchargement est actif (0 = illimité).
+# Un déplacement sur le même volume est un simple renommage et n'est pas limité.
+MOVER_MAX_MB_PER_SECOND = float(os.getenv("MOVER_MAX_MB_PER_SECOND", 50))
+MOVER_CHUNK_SIZE = 1024 * 1024
+
+# --- Configuration des nouvelles tentatives ---
+# Nombre de tentatives d'une tâche (échec de wget ou fichier rejeté à la vérification)
+RETRY_COUNT = int(os.getenv("RETRY_COUNT", 3))
+# Délai avant une nouvelle tentative, multiplié par le numéro de la tentative
+RETRY_DELAY_SECONDS = float(os.getenv("RETRY_DELAY_SECONDS", 30))
+
+# --- Configuration du chien de garde ---
+# Un transfert dont le .part ne grossit plus pendant ce délai est tué puis repris (wget -c) ; 0 pour désactiver
+STALL_TIMEOUT_SECONDS = float(os.getenv("STALL_TIMEOUT_SECONDS", 120))
+# Reprises après blocage au sein d'une même tentative, avant de passer par le chemin des nouvelles tentatives
+STALL_MAX_RESUMES = int(os.getenv("STALL_MAX_RESUMES", 3))
+STALL_EVENTS_FILE = "stall_events.jsonl"
+# Worker wget local ("0" : seuls les nœuds distants téléchargent, voir job_leases.py et remote_worker.py)
+LOCAL_DOWNLOAD_WORKER = os.getenv("LOCAL_DOWNLOAD_WORKER", "1") == "1"
+
 # --- Initialisation des données d'état ---
-# Listes globales qui seront modifiées
+# Listes globales qui seront modifiées, uniquement par des commandes de l'écrivain unique (state)
 queue_data = []
 completed_data = []
 
@@ -42,163 +81,849 @@ else:
 
 # --- Files d'attente et statuts en mémoire ---
 download_queue = queue.Queue()
-# Statuts de téléchargement en cours {item_id: "⏳"/"✅"/"❌"}
+# Téléchargements terminés en attente de déplacement vers la bibliothèque
+mover_queue = queue.Queue()
+# Statuts de téléchargement en cours {item_id: "⏳"/"⏸"/"💾"/"🌐"/"🔎"/"🔁"/"📦"/"✅"/"❌"}
+# (⏸ : en pause, fournisseur indisponible ; 💾 : retenue faute d'espace disque, 🌐 : confiée à un nœud distant,
+#  🔎 : vérification, 🔁 : nouvelle tentative programmée, 📦 : déplacement vers la bibliothèque)
 # Stockera un ID de chaîne, car l'API XTream utilise des chaînes pour les séries et les films
 download_status = {}
 
+# Derniers blocages détectés par le chien de garde (l'historique complet est dans STALL_EVENTS_FILE)
+stall_events = deque(maxlen=100)
+
+# ID de la tâche en cours de téléchargement par le worker (None si inactif)
+active_item_id = None
+# Suivi du transfert en cours (débit pour /metrics)
+active_monitor = None
+# Disjoncteur des flux vidéo du fournisseur (issues des téléchargements locaux et distants)
+stream_breaker = circuit_breaker.get_breaker("xtream", "stream")
+# Causes d'échec imputables au fournisseur (réseau, délai, 5xx : voir wget_failure_kind), seules comptées par
+# son disjoncteur ; mises en pause plutôt que comptées si le disjoncteur est ouvert. "remote" : nœud sans cause détaillée
+PROVIDER_FAILURE_KINDS = ("wget", "stall", "remote")
+# Worker en pause faute de fournisseur disponible
+provider_paused = False
+
 # Remplissage de la file d'attente active à partir du fichier au démarrage (s'il y avait des tâches inachevées)
 # Marquer les tâches dans la file d'attente comme "en cours" (⏳) au démarrage de l'application
 for job in queue_data:
     item_id = str(job.get("item_id")) # Assurez-vous que l'ID est une chaîne
-    if item_id:
+    # Les baux des nœuds distants ne valent plus après un redémarrage
+    job.pop("lease", None)
+    if item_id and job.get("failed"):
+        # Échec définitif avant l'arrêt : la tâche reste en échec jusqu'à une nouvelle tentative demandée (retry_job)
+        download_status[item_id] = "❌"
+        continue
+    # Nouveau démarrage : le compteur de tentatives repart de zéro
+    job.pop("attempts", None)
+    if item_id and job.get("stage") == "verifying":
+        # Vérification interrompue par l'arrêt : relancée par start_download_workers()
+        download_status[item_id] = "🔎"
+    elif item_id and job.get("stage") == "moving":
+        # Téléchargement terminé avant l'arrêt, mais pas encore déplacé vers la bibliothèque
+        mover_queue.put(job)
+        download_status[item_id] = "📦"
+    elif item_id:
         download_queue.put(job)
-        download_status[item_id] = "⏳" # Marquer comme en cours au démarrage
+        # Retenue faute d'espace disque avant l'arrêt : le worker réévalue l'espace à son tour
+        download_status[item_id] = "💾" if job.get("hold_reason") else "⏳"
     else:
         print(f"Avertissement : Tâche dans queue.json sans item_id, ignorée : {job}")
 
 print(f"Chargé {len(queue_data)} tâches dans la file d'attente depuis {QUEUE_FILE}.")
 print(f"Chargé {len(completed_data)} éléments terminés depuis {COMPLETED_FILE}.")
 
+# Écrivain unique : toutes les modifications de queue_data, completed_data et download_status passent par
+# state.execute() (attend le résultat) ou state.submit() ; les lecteurs utilisent state.snapshot()
+state = StateManager(QUEUE_FILE, COMPLETED_FILE, queue_data, completed_data, download_status)
+
 
 # --- Fonctions de sauvegarde de l'état ---
+# L'écriture elle-même est faite par l'écrivain à la fin du lot de commandes en cours
 def save_queue():
-    try:
-        with open(QUEUE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(queue_data, f, indent=4)
-    except Exception as e:
-        print(f"Erreur d'écriture du fichier {QUEUE_FILE}: {e}")
+    state.mark_dirty("queue")
 
 def save_completed():
+    state.mark_dirty("completed")
+
+def set_status(item_id, status):
+    state.set_status(str(item_id), status)
+
+def _find_job(item_id):
+    """Tâche vivante de la file d'attente. À n'appeler que dans une commande."""
+    return next((j for j in queue_data if str(j.get('item_id')) == item_id), None)
+
+def _is_queued(job):
+    """La tâche (l'objet lui-même) est-elle encore dans la file d'attente ? À n'appeler que dans une commande."""
+    return any(q_job is job for q_job in queue_data)
+
+def update_job(item_id, fn):
+    """Applique fn(job) à la tâche item_id dans l'écrivain et l'enregistre. Renvoie False si elle n'est plus dans la file."""
+    def apply():
+        job = _find_job(str(item_id))
+        if job is None:
+            return False
+        fn(job)
+        save_queue()
+        return True
+    return state.execute(apply)
+
+# --- Déplacement des fichiers téléchargés ---
+def move_downloaded_file(src_path, dst_path):
+    """Déplace un fichier terminé vers son emplacement définitif et supprime l'ancien dossier s'il est vide."""
+    if not src_path or not dst_path or os.path.abspath(src_path) == os.path.abspath(dst_path):
+        return False
+    if not os.path.exists(src_path):
+        print(f"Avertissement : Fichier introuvable pour le déplacement : {src_path}")
+        return False
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    os.replace(src_path, dst_path)
     try:
-        with open(COMPLETED_FILE, 'w', encoding='utf-8') as f:
-            json.dump(completed_data, f, indent=4)
+        os.rmdir(os.path.dirname(src_path))
+    except OSError:
+        pass # Le dossier contient encore d'autres fichiers
+    print(f"Fichier déplacé : {src_path} -> {dst_path}")
+    return True
+
+def relocate_job(item_id, new_file_path, new_file_name):
+    """Change le chemin de destination d'une tâche de la file d'attente.
+
+    Renvoie "updated" si la tâche n'a pas encore démarré (la commande est réécrite),
+    "pending_move" si elle est en cours (le fichier sera déplacé à la fin du téléchargement)
+    ou "not_found" si la tâche n'est plus dans la file d'attente.
+    """
+    item_id = str(item_id)
+    def apply():
+        job = _find_job(item_id)
+        if job is None:
+            return "not_found", None
+        if item_id == active_item_id or job.get("lease"):
+            job["final_path"] = new_file_path
+            job["file"] = new_file_name
+            save_queue()
+            return "pending_move", None
+        old_path = job["cmd"][2]
+        os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+        job["cmd"][2] = new_file_path
+        job["file"] = new_file_name
+        save_queue()
+        return "updated", old_path
+    result, old_path = state.execute(apply)
+    if result != "updated":
+        return result
+    # Supprimer le dossier provisoire créé à l'ajout, s'il est resté vide
+    try:
+        os.rmdir(os.path.dirname(old_path))
+    except OSError:
+        pass
+    return "updated"
+
+# --- Fichiers .part et déplacement vers la bibliothèque ---
+def part_path_for(job):
+    """Chemin du fichier .part d'une tâche : dans DOWNLOAD_STAGING_DIR, ou à côté de la destination."""
+    destination = job["cmd"][2]
+    if DOWNLOAD_STAGING_DIR:
+        return os.path.join(DOWNLOAD_STAGING_DIR, f"{job['item_id']}-{os.path.basename(destination)}.part")
+    return f"{destination}.part"
+
+def _copy_throttled(src_path, dst_path):
+    """Copie en flux, ralentie à MOVER_MAX_MB_PER_SECOND tant qu'un téléchargement est en cours."""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        while True:
+            started = time.time()
+            chunk = src.read(MOVER_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+            if MOVER_MAX_MB_PER_SECOND > 0 and active_item_id is not None:
+                min_duration = len(chunk) / (MOVER_MAX_MB_PER_SECOND * 1024 * 1024)
+                elapsed = time.time() - started
+                if elapsed < min_duration:
+                    time.sleep(min_duration - elapsed)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+def _move_to_library(job):
+    """Déplace le .part terminé vers sa destination (lue au dernier moment : l'enrichissement TMDB a pu la changer)."""
+    part_path = job["part_path"]
+
+    def place():
+        # Dans l'écrivain : relocate_job ne peut pas changer la destination pendant le renommage
+        destination = job.pop("final_path", None) or job["cmd"][2]
+        job["cmd"][2] = destination
+        if not os.path.exists(part_path) and os.path.exists(destination):
+            return destination, "done" # Déjà déplacé avant un arrêt de l'application
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        duplicate = content_index.find_duplicate(job.get("sha256"), os.path.getsize(part_path))
+        if duplicate and os.path.abspath(duplicate) != os.path.abspath(destination) and _link_duplicate(duplicate, destination):
+            # Contenu identique à un fichier déjà présent (autre variante du catalogue) : lien dur, pas de copie
+            os.remove(part_path)
+            job["duplicate_of"] = duplicate
+            print(f"Contenu identique à {duplicate} : lien dur créé pour {destination}")
+            return destination, "done"
+        try:
+            # Même volume : renommage atomique, Plex ne voit jamais de fichier partiel
+            os.replace(part_path, destination)
+            return destination, "moved"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return destination, "copy"
+
+    destination, outcome = state.execute(place)
+    if outcome == "done":
+        return destination
+    if outcome == "copy":
+        # Volume différent (SSD de cache -> baie) : copie en flux vers un .part dans la bibliothèque, puis renommage
+        tmp_path = f"{destination}.part"
+        _copy_throttled(part_path, tmp_path)
+
+        def finish_copy():
+            destination = job.pop("final_path", None) or job["cmd"][2]
+            job["cmd"][2] = destination
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(tmp_path, destination)
+            return destination
+
+        destination = state.execute(finish_copy)
+        os.remove(part_path)
+    if not DOWNLOAD_STAGING_DIR and os.path.dirname(part_path) != os.path.dirname(destination):
+        try:
+            os.rmdir(os.path.dirname(part_path)) # Dossier provisoire resté vide
+        except OSError:
+            pass
+    return destination
+
+def _link_duplicate(existing_path, destination):
+    tmp_path = f"{destination}.link.tmp"
+    try:
+        os.link(existing_path, tmp_path)
+        os.replace(tmp_path, destination)
+        return True
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False # Autre volume : déplacement normal
+
+def _complete_job(job, size=None):
+    """Enregistre une tâche terminée. size : taille annoncée par un nœud distant (fichier absent de ce volume)."""
+    item_id = str(job.get("item_id"))
+    metrics.JOBS_COMPLETED.inc(item_type=job.get("item_type", "unknown"))
+    job_history.record_attempt(job, "completed")
+    destination = job["cmd"][2]
+    if job.get("sha256"):
+        try:
+            content_index.record(item_id, job["sha256"], size if size is not None else os.path.getsize(destination), destination,
+                                 tmdb_id=(job.get("enrichment") or {}).get("tmdb_id"), item_type=job.get("item_type"))
+        except OSError as e:
+            print(f"Avertissement : Empreinte non enregistrée pour {destination}: {e}")
+    def apply():
+        if item_id not in completed_data:
+            completed_data.append(item_id)
+            save_completed()
+        queue_data[:] = [item for item in queue_data if str(item.get('item_id')) != item_id]
+        save_queue()
+        set_status(item_id, "✅")
+    state.execute(apply)
+
+def mover_worker():
+    while True:
+        job = mover_queue.get()
+        item_id = str(job.get("item_id"))
+        try:
+            with metrics.JOB_DURATION.time(item_type=job.get("item_type", "unknown"), stage="move"):
+                destination = _move_to_library(job)
+            _complete_job(job)
+            print(f"Fichier déplacé vers la bibliothèque : {destination}")
+        except (OSError, KeyError) as e:
+            # La tâche reste à l'étape "moving" : le déplacement sera retenté au prochain démarrage
+            set_status(item_id, "❌")
+            job_history.record_attempt(job, "failed", str(e), kind="move")
+            print(f"Erreur lors du déplacement de {job.get('file')} (ID: {item_id}) vers la bibliothèque : {e}")
+        finally:
+            release(item_id)
+            mover_queue.task_done()
+
+# --- Vérification et nouvelles tentatives ---
+_verify_pool = None
+_verify_pool_lock = threading.Lock()
+
+def _get_verify_pool():
+    global _verify_pool
+    with _verify_pool_lock:
+        if _verify_pool is None:
+            # "forkserver" plutôt que "fork" : un fork de ce processus (plusieurs threads) peut hériter d'un verrou
+            # tenu par un autre thread et se bloquer. Le serveur de fork démarre d'un processus neuf qui ne
+            # précharge que post_process ; app.py ne relance pas ses services sous le nom __mp_main__.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["post_process"])
+            _verify_pool = ProcessPoolExecutor(max_workers=max(1, POSTPROCESS_WORKERS), mp_context=context)
+        return _verify_pool
+
+def submit_verification(job):
+    """Vérifie le .part (taille, ffprobe, remux) dans le pool de processus, puis le confie au déménageur."""
+    set_status(job.get("item_id"), "🔎")
+    ext = os.path.splitext(job["cmd"][2])[1].lstrip('.')
+    started = time.time()
+    future = _get_verify_pool().submit(verify_download, job["part_path"], job.get("size_bytes"), ext)
+    future.add_done_callback(lambda f: _on_verified(job, f, started))
+
+def _change_extension(job, ext):
+    """Applique la nouvelle extension (après remux) à la destination de la tâche."""
+    job["cmd"][2] = f"{os.path.splitext(job['cmd'][2])[0]}.{ext}"
+    job["file"] = f"{os.path.splitext(job['file'])[0]}.{ext}"
+    if job.get("final_path"):
+        job["final_path"] = f"{os.path.splitext(job['final_path'])[0]}.{ext}"
+
+def _on_verified(job, future, started):
+    item_id = str(job.get("item_id"))
+    metrics.JOB_DURATION.observe(time.time() - started, item_type=job.get("item_type", "unknown"), stage="verify")
+    try:
+        result = future.result()
     except Exception as e:
-        print(f"Erreur d'écriture du fichier {COMPLETED_FILE}: {e}")
+        # Pool de processus indisponible : le fichier n'a pas été jugé, il sera revérifié après la reprise wget -c
+        _retry_or_fail(job, f"vérification impossible : {e}", keep_part=True, kind="verify_pool")
+        return
+    if not result["ok"]:
+        _retry_or_fail(job, result["reason"], keep_part=result["resumable"], kind="verification")
+        return
+    def apply():
+        if result["ext"]:
+            job["part_path"] = result["path"]
+            job["sha256"] = result["sha256"]
+            _change_extension(job, result["ext"])
+        job["stage"] = "moving"
+        save_queue()
+        set_status(item_id, "📦")
+    state.execute(apply)
+    mover_queue.put(job)
+
+def _pause_job(job, reason, kind):
+    """Remet la tâche dans la file sans compter la tentative : le fournisseur est indisponible (disjoncteur ouvert)."""
+    item_id = str(job.get("item_id"))
+
+    def apply():
+        job.pop("stage", None)
+        job["last_error"] = reason
+        if job.get("final_path"):
+            job["cmd"][2] = job.pop("final_path")
+        set_status(item_id, "⏸")
+        save_queue()
+    state.execute(apply)
+    job_history.record_attempt(job, "paused", reason, kind=kind)
+    print(f"Téléchargement de {job.get('title')} (ID: {item_id}) mis en pause : fournisseur indisponible ({reason}).")
+    _requeue_job(job)
+
+def _retry_or_fail(job, reason, keep_part=False, kind="wget"):
+    """Reprogramme la tâche (RETRY_COUNT tentatives au total) ou la laisse en échec dans la file d'attente.
+
+    kind : cause résumée pour les métriques (wget, stall, http, io, verification, verify_pool, remote).
+    Un échec imputable au fournisseur (PROVIDER_FAILURE_KINDS) alors que son disjoncteur est ouvert
+    met la tâche en pause au lieu de consommer une tentative, sauf si la tâche était l'appel d'essai.
+    """
+    item_id = str(job.get("item_id"))
+    release(item_id)
+    if kind in PROVIDER_FAILURE_KINDS:
+        # Appel d'essai en échec : la tentative est comptée, sinon un lien mort servant d'essai rouvrirait
+        # le disjoncteur à chaque fois et la tâche resterait en pause sans jamais aboutir
+        trial = stream_breaker.state == "half_open"
+        # Cause résumée seulement : le message de wget contient l'URL du flux, avec les identifiants Xtream
+        stream_breaker.record(False, error=kind)
+        if not trial and circuit_breaker.service_open("xtream"):
+            _pause_job(job, reason, kind)
+            return
+
+    def apply():
+        job.pop("stage", None)
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["last_error"] = reason
+        if job.get("final_path"):
+            # La destination définitive remplace la provisoire pour la prochaine tentative
+            job["cmd"][2] = job.pop("final_path")
+        if not keep_part and job.get("part_path") and os.path.exists(job["part_path"]):
+            os.remove(job["part_path"])
+        retry = job["attempts"] < RETRY_COUNT
+        if not retry:
+            # Conservé dans queue.json : la tâche reste en échec après un redémarrage
+            job["failed"] = True
+        set_status(item_id, "🔁" if retry else "❌")
+        save_queue()
+        return retry
+    retry = state.execute(apply)
+    job_history.record_attempt(job, "retry" if retry else "failed", reason, kind=kind, retries=job["attempts"] - 1)
+    with open(DOWNLOAD_LOG_FILE, "a", encoding='utf-8') as logf:
+        logf.write(f"❌ Erreur de téléchargement {job.get('item_type', 'unknown')}: {job.get('title')} (ID: {item_id}) - tentative {job['attempts']}/{RETRY_COUNT} - {reason}\n")
+    (metrics.JOB_RETRIES if retry else metrics.JOB_FAILURES).inc(reason=kind)
+    if retry:
+        delay = RETRY_DELAY_SECONDS * job["attempts"]
+        print(f"Erreur de téléchargement pour {job.get('title')} avec l'ID {item_id} ({reason}), nouvelle tentative dans {delay}s.")
+        _schedule_requeue(job, delay)
+    else:
+        print(f"Erreur de téléchargement pour {job.get('title')} avec l'ID {item_id} après {job['attempts']} tentative(s) : {reason}")
+
+# --- Chien de garde ---
+def _kill(process):
+    if process is not None and process.poll() is None:
+        process.kill()
+
+def _record_stall(job, monitor, resumed):
+    """Conserve un blocage (mémoire et STALL_EVENTS_FILE) pour le diagnostic."""
+    event = {
+        "time": datetime.now().isoformat(timespec='seconds'),
+        "item_id": str(job.get("item_id")),
+        "title": job.get("title"),
+        "url_host": urlparse(job["cmd"][3]).netloc,
+        "bytes_written": monitor.offset,
+        "size_bytes": job.get("size_bytes"),
+        "stall_timeout_seconds": STALL_TIMEOUT_SECONDS,
+        "transfer_seconds": round(time.time() - monitor.started, 1),
+        "stall_count": monitor.stall_count,
+        "resumed": resumed,
+    }
+    stall_events.append(event)
+    metrics.STALLS.inc(resumed=str(resumed).lower())
+    try:
+        with open(STALL_EVENTS_FILE, "a", encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Erreur d'écriture du fichier {STALL_EVENTS_FILE}: {e}")
+    print(f"Transfert bloqué pour {job.get('title')} (ID: {event['item_id']}) après {monitor.offset} octets, "
+          f"{'reprise' if resumed else 'abandon de la tentative'}.")
+
+def get_stall_events():
+    return list(stall_events)
+
+# --- Métriques calculées à la collecte ---
+def _job_state(job, statuses):
+    item_id = str(job.get("item_id"))
+    if item_id == active_item_id:
+        return "downloading"
+    if job.get("lease"):
+        return "remote"
+    if job.get("stage"):
+        return job["stage"]
+    if job.get("hold_reason"):
+        return "held"
+    status = statuses.get(item_id)
+    if status == "🔁":
+        return "retry_wait"
+    if status == "⏸":
+        return "paused"
+    if status == "❌":
+        return "failed"
+    return "queued"
+
+def _collect_metrics():
+    counts = {}
+    snapshot = state.snapshot()
+    for job in snapshot.queue:
+        key = (job.get("item_type", "unknown"), _job_state(job, snapshot.status))
+        counts[key] = counts.get(key, 0) + 1
+    monitor = active_monitor
+    metrics.QUEUE_JOBS.replace(counts)
+    metrics.ACTIVE_TRANSFERS.set(1 if monitor else 0)
+    metrics.THROUGHPUT.set(round(monitor.rate, 1) if monitor else 0)
+
+# --- Admission selon l'espace disque ---
+def _admit(job, part_path):
+    """Réserve l'espace du .part et, s'il est sur un autre volume, du fichier final. Renvoie (admis, raison)."""
+    if not job.get("size_checked"):
+        # Requête HEAD une seule fois par tâche, hors de l'écrivain ; résultat conservé dans queue.json
+        probe = {"cmd": job["cmd"], "size_bytes": job.get("size_bytes")}
+        job_size(probe)
+        def apply():
+            job["size_bytes"] = probe["size_bytes"]
+            job["size_checked"] = True
+            save_queue()
+        state.execute(apply)
+    size = job.get("size_bytes") or 0
+    # Un .part existant (reprise wget -c) occupe déjà une partie de l'espace
+    try:
+        already_written = os.path.getsize(part_path)
+    except OSError:
+        already_written = 0
+    needs = [(part_path, max(0, size - already_written))]
+    if DOWNLOAD_STAGING_DIR:
+        needs.append((job["cmd"][2], size))
+    return try_reserve(job["item_id"], needs)
+
+# ID des tâches dont le retour dans download_queue est déjà programmé (retenue disque, nouvelle tentative) :
+# une seule minuterie par tâche, et reorder_queue ne les remet pas en double
+_scheduled_requeues = set()
+_requeue_lock = threading.Lock()
+
+def _schedule_requeue(job, delay):
+    """Remet la tâche dans download_queue après delay secondes, sauf si c'est déjà programmé."""
+    item_id = str(job.get("item_id"))
+    with _requeue_lock:
+        if item_id in _scheduled_requeues:
+            return
+        _scheduled_requeues.add(item_id)
+    timer = threading.Timer(delay, _requeue_job, args=(job,))
+    timer.daemon = True
+    timer.start()
+
+def _requeue_job(job):
+    def apply():
+        with _requeue_lock:
+            _scheduled_requeues.discard(str(job.get("item_id")))
+        if _is_queued(job):
+            download_queue.put(job)
+    state.submit(apply)
+
+def get_held_jobs():
+    """Tâches retenues faute d'espace disque, et espace réservé par tâche admise (octets)."""
+    held = [{"item_id": job.get("item_id"), "file": job.get("file"), "size_bytes": job.get("size_bytes"),
+             "reason": job.get("hold_reason")} for job in state.snapshot().queue if job.get("hold_reason")]
+    return {"held": held, "reservations": get_reservations()}
+
+# --- Pause pendant l'indisponibilité du fournisseur ---
+def _set_queue_paused(paused):
+    """Passe les tâches en attente de ⏳ à ⏸ (ou l'inverse) pour l'affichage de la file."""
+    def apply():
+        for job in queue_data:
+            item_id = str(job.get("item_id"))
+            current = download_status.get(item_id)
+            if paused and current == "⏳" and item_id != active_item_id:
+                set_status(item_id, "⏸")
+            elif not paused and current == "⏸":
+                set_status(item_id, "⏳")
+    state.execute(apply)
+
+def _wait_for_provider():
+    """Bloque le worker tant qu'un disjoncteur Xtream est ouvert ; le téléchargement suivant sert d'appel d'essai."""
+    global provider_paused
+    while circuit_breaker.service_open("xtream"):
+        if not provider_paused:
+            provider_paused = True
+            _set_queue_paused(True)
+            print(f"Fournisseur Xtream indisponible : téléchargements en pause (nouvel essai dans {circuit_breaker.service_retry_in('xtream'):.0f}s).")
+        time.sleep(min(30.0, max(1.0, circuit_breaker.service_retry_in("xtream"))))
+    if provider_paused:
+        provider_paused = False
+        _set_queue_paused(False)
+        print("Fournisseur Xtream de nouveau joignable : reprise des téléchargements.")
 
 # --- Worker de téléchargement principal ---
 def download_worker():
-    global queue_data, completed_data # Nous devons modifier les listes globales
+    global active_item_id, active_monitor
     while True:
+        _wait_for_provider()
         job = download_queue.get()
         if job is None: # Signal de fin pour le worker
             break
 
         # Assurez-vous que item_id est une chaîne pour correspondre aux clés dans completed_data
         item_id = str(job.get("item_id"))
-        file_name = job.get("file")
-        cmd = job.get("cmd")
+
+        def claim():
+            global active_item_id
+            if not _is_queued(job) or job.get("stage") in ("verifying", "moving") or job.get("lease") or job.get("failed"):
+                # Tâche supprimée de la file d'attente entre-temps, déjà téléchargée (en cours de déplacement),
+                # confiée à un nœud distant (job_leases.py) ou en échec définitif (remise par reorder_queue)
+                return None
+            active_item_id = item_id
+            cmd = list(job.get("cmd") or [])
+            if cmd and "part_path" not in job:
+                # Chemin figé à la première tentative pour pouvoir reprendre le .part (wget -c)
+                job["part_path"] = part_path_for(job)
+                save_queue()
+            return job.get("file"), cmd, job.get("part_path")
+
+        claimed = state.execute(claim)
+        if claimed is None:
+            download_queue.task_done()
+            continue
+        file_name, cmd, part_path = claimed
         item_title = job.get("title", "Titre inconnu") # Utiliser le 'titre' générique
         item_type = job.get("item_type", "unknown")
 
         if not item_id or not file_name or not cmd:
             print(f"Erreur : Tâche incomplète dans la file d'attente : {job}")
+            active_item_id = None
             download_queue.task_done()
             continue
 
+        admitted, reason = _admit(job, part_path)
+        if not admitted:
+            # Retenue plutôt que démarrée : les tâches suivantes qui tiennent sur le disque passent devant
+            def hold():
+                global active_item_id
+                active_item_id = None
+                first_hold = job.get("hold_reason") is None
+                job["hold_reason"] = reason
+                save_queue()
+                set_status(item_id, "💾")
+                return first_hold
+
+            first_hold = state.execute(hold)
+            metrics.DISK_HOLDS.inc()
+            if first_hold:
+                print(f"Téléchargement de {item_title} (ID: {item_id}) retenu : {reason}. Nouvel essai toutes les {DISK_SPACE_RETRY_SECONDS:g}s.")
+            _schedule_requeue(job, DISK_SPACE_RETRY_SECONDS)
+            download_queue.task_done()
+            continue
+        if job.get("hold_reason"):
+            update_job(item_id, lambda j: j.pop("hold_reason", None))
+
+        failure = None
+        # Début, octets reçus et durée du transfert de cette tentative (job_history.py)
+        attempt = {"started": time.time(), "worker": "local"}
         try:
-            download_status[item_id] = "⏳"
+            set_status(item_id, "⏳")
             print(f"Début du téléchargement {item_type}: {item_title} (ID: {item_id})")
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            # wget écrit dans le .part (repris s'il existe déjà) au lieu de la destination finale
+            download_cmd = list(cmd)
+            download_cmd[2] = part_path
+            download_cmd.insert(1, "-c")
             with open(DOWNLOAD_LOG_FILE, "a", encoding='utf-8') as logf:
                 logf.write(f"\n=== Téléchargement {item_type}: {item_title} (ID: {item_id}) ===\n")
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-                for line in process.stdout:
-                    logf.write(line)
-                process.wait()
+                # Empreinte SHA-256 calculée pendant l'écriture du .part, et chien de garde sur sa progression
+                current = {}
+                monitor = TransferMonitor(
+                    part_path, stall_timeout=STALL_TIMEOUT_SECONDS, on_stall=lambda: _kill(current.get("process")),
+                    on_progress=lambda n: metrics.DOWNLOADED_BYTES.inc(n, item_type=item_type)
+                )
+                monitor.start()
+                active_monitor = monitor
+                download_started = time.time()
+                resumes = 0
+                # Fin de la sortie de wget : statut HTTP d'une erreur (wget_failure_kind)
+                output_tail = deque(maxlen=20)
+                try:
+                    while True:
+                        process = subprocess.Popen(download_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+                        current["process"] = process
+                        for line in process.stdout:
+                            logf.write(line)
+                            output_tail.append(line)
+                        process.wait()
+                        if process.returncode == 0 or not monitor.consume_stall():
+                            break
+                        resumed = resumes < STALL_MAX_RESUMES
+                        _record_stall(job, monitor, resumed)
+                        logf.write(f"⚠️ Transfert bloqué depuis {STALL_TIMEOUT_SECONDS:g}s, wget arrêté{', reprise' if resumed else ''}.\n")
+                        if not resumed:
+                            raise TransferStalled(f"transfert bloqué : aucune donnée reçue pendant {STALL_TIMEOUT_SECONDS:g}s ({resumes} reprise(s))")
+                        resumes += 1
+                finally:
+                    # Toujours arrêter le suivi, même si wget n'a pas pu être lancé (OSError)
+                    sha256, _ = monitor.finish()
+                    attempt.update(bytes=monitor.received, download_seconds=round(time.time() - download_started, 1))
                 if process.returncode != 0:
-                   raise subprocess.CalledProcessError(process.returncode, cmd)
-
-            status = "✅"
-            if item_id not in completed_data:
-                completed_data.append(item_id)
-                save_completed()
-
-            # Supprimer la tâche de queue_data après avoir réussi
-            # Actualiser la variable globale queue_data
-            queue_data[:] = [item for item in queue_data if str(item.get('item_id')) != item_id]
-            save_queue()
-            print(f"Téléchargement terminé pour {item_title} avec l'ID {item_id} avec le statut : {status}")
-
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            with open(DOWNLOAD_LOG_FILE, "a", encoding='utf-8') as logf:
-                logf.write(f"❌ Erreur de téléchargement {item_type}: {item_title} (ID: {item_id}) - {e}\n")
+                   raise subprocess.CalledProcessError(process.returncode, download_cmd, output="".join(output_tail))
+                stream_breaker.record(True)
+                metrics.JOB_DURATION.observe(time.time() - download_started, item_type=item_type, stage="download")
+
+            # Le .part est écrit : seule la réservation du volume de la bibliothèque reste utile
+            release(item_id, part_path)
+            # Vérification puis déplacement vers la bibliothèque (et final_path éventuel) hors du worker
+            def downloaded():
+                global active_item_id
+                job["sha256"] = sha256
+                job["stage"] = "verifying"
+                active_item_id = None
+                save_queue()
+
+            state.execute(downloaded)
+            status = "🔎"
+            print(f"Téléchargement terminé pour {item_title} avec l'ID {item_id}, vérification en attente.")
+
+        except (subprocess.CalledProcessError, TransferStalled, OSError) as e:
             status = "❌"
-            print(f"Erreur de téléchargement pour {item_title} avec l'ID {item_id}: {e}")
+            failure = str(e)
+            if isinstance(e, TransferStalled):
+                failure_kind = "stall"
+            elif isinstance(e, subprocess.CalledProcessError):
+                failure_kind = wget_failure_kind(e.returncode, e.output)
+            else:
+                failure_kind = "io"
         finally:
-            download_status[item_id] = status
+            def finished():
+                global active_item_id, active_monitor
+                active_item_id = None
+                active_monitor = None
+                job["attempt"] = attempt
+                save_queue()
+                set_status(item_id, status)
+
+            state.execute(finished)
             download_queue.task_done()
-
-
-# --- Démarrage du worker dans un thread séparé ---
-download_worker_thread = threading.Thread(target=download_worker, daemon=True)
-download_worker_thread.start()
-print("Le worker de téléchargement a été démarré.")
+        if status == "🔎":
+            submit_verification(job)
+        else:
+            # L'échec de wget suit le même chemin que les fichiers rejetés à la vérification ; le .part est repris
+            _retry_or_fail(job, failure, keep_part=True, kind=failure_kind)
+
+
+# --- Démarrage des workers ---
+_workers_started = False
+_workers_lock = threading.Lock()
+
+def start_download_workers():
+    """Démarre le worker de téléchargement et le déplacement vers la bibliothèque (une seule fois par processus).
+
+    À n'appeler que dans le processus propriétaire de queue.json : app.py quand l'interface tourne seule,
+    sinon le démon de téléchargement (download_daemon.py).
+    """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+    if LOCAL_DOWNLOAD_WORKER:
+        threading.Thread(target=download_worker, daemon=True).start()
+        print("Le worker de téléchargement a été démarré.")
+    threading.Thread(target=mover_worker, daemon=True).start()
+    metrics.register_collector(_collect_metrics)
+    # Reprise des vérifications interrompues par le dernier arrêt
+    for job in state.execute(lambda: [j for j in queue_data if j.get("stage") == "verifying"]):
+        submit_verification(job)
 
 
 # Fonction pour ajouter des tâches à la file d'attente de l'extérieur
 def add_to_download_queue(job_details):
+    """Ajoute une tâche (l'objet appartient ensuite à l'écrivain). Renvoie False si elle est déjà terminée ou en file."""
     # Vérifiez si la tâche existe déjà dans la file d'attente ou si elle est terminée
     item_id = str(job_details.get("item_id")) # Assurez-vous que l'ID est une chaîne
     if not item_id:
         print("Erreur : Tentative d'ajout d'une tâche sans item_id à la file d'attente.")
         return False
 
-    if item_id in completed_data:
-        print(f"La tâche avec l'ID {item_id} est déjà terminée. Ne pas ajouter à la file d'attente.")
-        return False
-
-    # Vérifiez si la tâche est déjà dans 'queue_data' (par exemple, en attente de téléchargement ou en cours)
-    if any(str(q_job.get('item_id')) == item_id for q_job in queue_data):
-        print(f"La tâche avec l'ID {item_id} est déjà dans la file d'attente. Ne pas ajouter de doublon.")
-        return False
-
-    download_queue.put(job_details)
-    download_status[item_id] = "⏳" # Marquer comme en cours
-    queue_data.append(job_details)
-    save_queue()
-    print(f"Tâche avec l'ID {item_id} ajoutée à la file d'attente.")
-    return True
+    def apply():
+        # Vérification et ajout dans la même commande : deux ajouts simultanés ne peuvent pas se croiser
+        if item_id in completed_data:
+            print(f"La tâche avec l'ID {item_id} est déjà terminée. Ne pas ajouter à la file d'attente.")
+            return False
+        # Vérifiez si la tâche est déjà dans 'queue_data' (par exemple, en attente de téléchargement ou en cours)
+        if _find_job(item_id) is not None:
+            print(f"La tâche avec l'ID {item_id} est déjà dans la file d'attente. Ne pas ajouter de doublon.")
+            return False
+        queue_data.append(job_details)
+        save_queue()
+        set_status(item_id, "⏸" if provider_paused else "⏳") # Marquer comme en cours (ou en pause si le fournisseur est indisponible)
+        download_queue.put(job_details)
+        print(f"Tâche avec l'ID {item_id} ajoutée à la file d'attente.")
+        return True
+    return state.execute(apply)
 
 # Fonctions de gestion de la file d'attente (déplacées de seriale.py)
+# Lectures sur l'instantané publié par l'écrivain : jamais de verrou, jamais d'attente du worker
 def get_queue_status():
-    return download_status
+    return dict(state.snapshot().status)
 
 def get_full_queue_data():
-    return queue_data
+    return list(state.snapshot().queue)
 
 def remove_from_queue(item_id):
-    global queue_data
     item_id = str(item_id) # Assurez-vous que l'ID est une chaîne
-    # Supprimer de la liste principale des données de la file d'attente
-    queue_data[:] = [item for item in queue_data if str(item.get('item_id')) != item_id]
-    save_queue()
-    # Supprimer du statut, s'il existe
-    download_status.pop(item_id, None)
+
+    def apply():
+        # Supprimer de la liste principale des données de la file d'attente
+        queue_data[:] = [item for item in queue_data if str(item.get('item_id')) != item_id]
+        save_queue()
+        # Supprimer du statut, s'il existe
+        set_status(item_id, None)
+    state.execute(apply)
     print(f"Tâche avec l'ID {item_id} supprimée de la file d'attente.")
 
+def remove_idle_job(item_id):
+    """Retire une tâche qui n'a pas encore démarré (ni en cours, ni confiée à un nœud, ni en vérification ou déplacement).
+
+    La vérification et le retrait forment une seule commande de l'écrivain. Renvoie False si la tâche a été gardée.
+    """
+    item_id = str(item_id)
+    def apply():
+        job = _find_job(item_id)
+        if job is None or item_id == active_item_id or job.get("lease") or job.get("stage") in ("verifying", "moving"):
+            return False
+        queue_data.remove(job)
+        save_queue()
+        set_status(item_id, None)
+        return True
+    removed = state.execute(apply)
+    if removed:
+        print(f"Tâche avec l'ID {item_id} supprimée de la file d'attente.")
+    return removed
+
+def clear_queue():
+    """Vide la file d'attente (tâches, statuts et file du worker). Un téléchargement en cours n'est pas interrompu."""
+    def apply():
+        for job in queue_data:
+            set_status(job.get("item_id"), None)
+        queue_data.clear()
+        save_queue()
+        while True:
+            try:
+                download_queue.get_nowait()
+            except queue.Empty:
+                break
+    state.execute(apply)
+
 def reorder_queue(order_list):
-    global queue_data
     # Assurez-vous que tous les ID dans order_list sont des chaînes
     order_list_str = [str(x) for x in order_list]
     order_map = {item_id: i for i, item_id in enumerate(order_list_str)}
-    
-    # Tri de 'queue_data' basé sur la carte
-    # Assurez-vous que item.get('item_id') est converti en chaîne pour la comparaison
-    queue_data.sort(key=lambda x: order_map.get(str(x['item_id']), len(order_list_str)))
-    save_queue()
-    
-    # Actualisation de la file d'attente dans le worker : nous vidons et ajoutons à nouveau
-    with download_queue.mutex: # Sécuriser l'accès à la liste interne de la file d'attente
-        # Assurez-vous que le worker n'est pas en train de télécharger quelque chose que nous allons supprimer
-        # ou qu'il peut gérer une file d'attente vide et un nouvel ajout
-        # Il est plus simple de simplement vider et ajouter
-        while not download_queue.empty():
+
+    def apply():
+        # Tri de 'queue_data' basé sur la carte
+        queue_data.sort(key=lambda x: order_map.get(str(x['item_id']), len(order_list_str)))
+        save_queue()
+        # Actualisation de la file d'attente du worker : on la vide puis on la remplit dans le nouvel ordre.
+        # Les tâches dont le retour est déjà programmé (retenue disque, nouvelle tentative) reviendront seules ;
+        # celles en cours, en échec ou confiées à un nœud distant ne sont pas remises.
+        while True:
             try:
-                download_queue.get_nowait() # Ne pas bloquer si vide
+                download_queue.get_nowait()
             except queue.Empty:
                 break
-    for job in queue_data:
-        download_queue.put(job)
+        with _requeue_lock:
+            scheduled = set(_scheduled_requeues)
+        for job in queue_data:
+            if (str(job.get("item_id")) in scheduled or str(job.get("item_id")) == active_item_id or job.get("failed")
+                    or job.get("lease") or job.get("stage") in ("verifying", "moving")):
+                continue
+            download_queue.put(job)
+    state.execute(apply)
     print("La file d'attente a été réorganisée.")
 
+def retry_job(item_id):
+    """Remet dans la file une tâche en échec définitif. Renvoie False si elle n'est pas (ou plus) en échec."""
+    item_id = str(item_id)
+
+    def apply():
+        job = _find_job(item_id)
+        if job is None or not job.pop("failed", None):
+            return False
+        job.pop("attempts", None)
+        save_queue()
+        set_status(item_id, "⏳")
+        download_queue.put(job)
+        return True
+    retried = state.execute(apply)
+    if retried:
+        print(f"Tâche avec l'ID {item_id} remise dans la file d'attente.")
+    return retried
+
 def get_completed_items():
-    return completed_data
+    return list(state.snapshot().completed)
+
+def mark_completed(item_ids):
+    """Ajoute des éléments déjà présents sur le disque à completed_data. Renvoie les ID ajoutés.
+
+    Les éléments encore dans la file d'attente sont ignorés : leur fichier peut être en cours d'écriture.
+    """
+    def apply():
+        added = []
+        queued_ids = {str(job.get('item_id')) for job in queue_data}
+        for item_id in item_ids:
+            item_id = str(item_id)
+            if item_id in queued_ids or item_id in completed_data or item_id in added:
+                continue
+            completed_data.append(item_id)
+            added.append(item_id)
+        if added:
+            save_completed()
+        return added
+    return state.execute(apply)
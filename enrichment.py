@@ -0,0 +1,153 @@
+# enrichment.py
+
+import os
+import queue
+import threading
+from datetime import datetime
+
+import circuit_breaker
+import tmdb_cache
+from downloader_core import (
+    relocate_job,
+    move_downloaded_file,
+    get_full_queue_data,
+    get_completed_items,
+    remove_idle_job,
+    update_job
+)
+import content_index
+from plex_naming import folder_name, release_year
+from nfo_writer import movie_nfo, write_nfo
+from artwork import queue_movie_artwork
+
+# --- Configuration ---
+DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
+# Variantes du catalogue ("PL -", "EN -", 4K) résolues vers un film déjà téléchargé ou en file d'attente :
+# signalées dans la tâche, et retirées de la file d'attente si SKIP_DUPLICATE_VARIANTS=1
+SKIP_DUPLICATE_VARIANTS = os.getenv("SKIP_DUPLICATE_VARIANTS", "0") == "1"
+# Délai avant de reprendre un film quand TMDB ne répond pas (au moins jusqu'à l'appel d'essai de son disjoncteur)
+ENRICHMENT_RETRY_SECONDS = float(os.getenv("ENRICHMENT_RETRY_SECONDS", 300))
+
+# --- File d'enrichissement ---
+# Les recherches TMDB sont faites ici, hors de la requête HTTP d'ajout à la file d'attente.
+_enrichment_queue = queue.Queue()
+_worker_thread = None
+_worker_lock = threading.Lock()
+_resumed = False
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def schedule_movie_enrichment(job):
+    """Planifie la résolution TMDB (année, NFO) d'une tâche de film ajoutée avec un chemin provisoire."""
+    _ensure_worker()
+    enrichment = job.get("enrichment") or {}
+    _enrichment_queue.put({
+        "item_id": str(job["item_id"]),
+        "query": enrichment.get("query", ""),
+        "ext": enrichment.get("ext", "mp4"),
+        "provisional_path": job["cmd"][2],
+    })
+
+def _mark_enrichment_done(item_id, tmdb_id, year):
+    def apply(job):
+        if job.get("enrichment"):
+            job["enrichment"].update({"status": "done", "tmdb_id": tmdb_id, "year": year})
+    update_job(item_id, apply)
+
+def _find_variants(item_id, tmdb_id):
+    """Autres ID du catalogue (terminés ou en file d'attente) qui correspondent au même film TMDB."""
+    if not tmdb_id:
+        return []
+    variants = [other_id for other_id in content_index.items_with_tmdb_id(tmdb_id, "movie") if other_id != item_id]
+    for job in get_full_queue_data():
+        other_id = str(job.get("item_id"))
+        if other_id != item_id and other_id not in variants and str((job.get("enrichment") or {}).get("tmdb_id")) == str(tmdb_id):
+            variants.append(other_id)
+    return variants
+
+def _flag_variants(item_id, variants):
+    update_job(item_id, lambda job: job.update(duplicate_variant_of=variants))
+
+def _retry_later(task):
+    """TMDB injoignable : la tâche reste "pending" et revient dans la file d'enrichissement plus tard."""
+    delay = max(ENRICHMENT_RETRY_SECONDS, circuit_breaker.service_retry_in("tmdb"))
+    timer = threading.Timer(delay, _enrichment_queue.put, args=(task,))
+    timer.daemon = True
+    timer.start()
+    print(f"[{_now_str()}] TMDB indisponible : enrichissement du film {task['item_id']} reporté de {delay:.0f}s.")
+
+def _enrich_movie(task):
+    item_id = task["item_id"]
+    status, tmdb_id = tmdb_cache.search_movie(task["query"])
+    metadata = None
+    if status == 'ok':
+        status, metadata = tmdb_cache.lookup_movie_metadata(tmdb_id)
+    if status == 'error':
+        # Ne pas confondre une panne avec un film introuvable : pas de dossier sans année ni de NFO manquant
+        _retry_later(task)
+        return
+
+    variants = _find_variants(item_id, tmdb_id)
+    if variants:
+        # Une tâche déjà lancée (en cours, confiée à un nœud, en vérification ou déplacement) est gardée
+        if SKIP_DUPLICATE_VARIANTS and item_id not in get_completed_items() and remove_idle_job(item_id):
+            try:
+                os.rmdir(os.path.dirname(task["provisional_path"])) # Dossier provisoire resté vide
+            except OSError:
+                pass
+            print(f"[{_now_str()}] Film {item_id} retiré de la file d'attente : même film TMDB ({tmdb_id}) que {', '.join(variants)}.")
+            return
+        _flag_variants(item_id, variants)
+        print(f"[{_now_str()}] Attention : le film {item_id} correspond au même film TMDB ({tmdb_id}) que {', '.join(variants)}.")
+
+    year = release_year(metadata.get('release_date', '')) if metadata else ''
+
+    final_folder = folder_name(task["query"], year)
+    final_file_name = f"{final_folder}.{task['ext']}"
+    final_path = os.path.join(DOWNLOAD_PATH_MOVIES, final_folder, final_file_name)
+
+    if os.path.abspath(final_path) != os.path.abspath(task["provisional_path"]):
+        result = relocate_job(item_id, final_path, final_file_name)
+        if result == "not_found" and item_id in get_completed_items():
+            # Téléchargement déjà terminé : déplacer le fichier vers le dossier définitif
+            move_downloaded_file(task["provisional_path"], final_path)
+        print(f"[{_now_str()}] Enrichissement TMDB du film {item_id} : dossier '{final_folder}' ({result}).")
+
+    if metadata:
+        try:
+            write_nfo(os.path.dirname(final_path), f"{final_folder}.nfo", movie_nfo(metadata))
+        except (KeyError, TypeError, AttributeError, OSError) as e:
+            print(f"[{_now_str()}] Erreur lors de l'écriture du NFO pour le film {item_id}: {e}")
+        queue_movie_artwork(os.path.dirname(final_path), tmdb_id)
+    _mark_enrichment_done(item_id, tmdb_id, year)
+
+def _enrichment_worker():
+    while True:
+        task = _enrichment_queue.get()
+        try:
+            _enrich_movie(task)
+        except Exception as e:
+            print(f"[{_now_str()}] Erreur inattendue lors de l'enrichissement TMDB de {task.get('item_id')}: {e}")
+        finally:
+            _enrichment_queue.task_done()
+
+def _ensure_worker():
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_enrichment_worker, daemon=True)
+            _worker_thread.start()
+
+def start_enrichment_worker():
+    """Démarre le worker d'enrichissement et reprend les tâches restées en attente d'enrichissement."""
+    global _resumed
+    _ensure_worker()
+    with _worker_lock:
+        if _resumed:
+            return
+        _resumed = True
+    pending_jobs = [job for job in get_full_queue_data() if (job.get("enrichment") or {}).get("status") == "pending"]
+    for job in pending_jobs:
+        schedule_movie_enrichment(job)
+    print(f"Le worker d'enrichissement TMDB a été démarré ({len(pending_jobs)} tâche(s) reprise(s)).")
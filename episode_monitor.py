@@ -6,17 +6,29 @@ from datetime import datetime
 import re
 import sys
 
+from discord_outbox import queue_new_episodes_notification
+from plex_naming import build_episode_job
+import circuit_breaker
+import xtream_api
+
 # --- Configuration ---
 XTREAM_HOST = os.getenv("XTREAM_HOST")
 XTREAM_PORT = os.getenv("XTREAM_PORT")
 XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
 XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
-DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 
 BASE_API = f"{XTREAM_HOST}:{XTREAM_PORT}/player_api.php?username={XTREAM_USERNAME}&password={XTREAM_PASSWORD}"
 
 FAVORITES_FILE = "favorites.json"
 MONITORED_STATE_FILE = "monitored_series_state.json"
+FAVORITE_RULES_FILE = "favorite_rules.json"
+
+# Règle appliquée aux favoris sans configuration : notification seule
+DEFAULT_FAVORITE_RULE = {
+    'auto_download': False,
+    'seasons': [], # Liste vide : toutes les saisons
+    'ext': '' # Vide : extension fournie par Xtream (container_extension)
+}
 
 # --- Fonctions utilitaires pour charger/enregistrer JSON ---
 def load_json_file(filepath, default_value):
@@ -44,6 +56,48 @@ def save_json_file(filepath, data):
     except Exception as e:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur lors de l'enregistrement du fichier {filepath}: {e}")
 
+# --- Règles de téléchargement automatique par favori ---
+def normalize_favorite_rule(rule):
+    """Complète une règle avec les valeurs par défaut et normalise ses types."""
+    normalized = dict(DEFAULT_FAVORITE_RULE)
+    if isinstance(rule, dict):
+        normalized['auto_download'] = bool(rule.get('auto_download', False))
+        normalized['seasons'] = sorted({int(s) for s in rule.get('seasons') or [] if str(s).strip().isdigit()})
+        normalized['ext'] = re.sub(r'[^A-Za-z0-9]', '', str(rule.get('ext') or '')).lower()
+    return normalized
+
+def load_favorite_rules():
+    return load_json_file(FAVORITE_RULES_FILE, {})
+
+def get_favorite_rule(series_id, rules=None):
+    if rules is None:
+        rules = load_favorite_rules()
+    return normalize_favorite_rule(rules.get(str(series_id)))
+
+def save_favorite_rule(series_id, rule):
+    rules = load_favorite_rules()
+    rules[str(series_id)] = normalize_favorite_rule(rule)
+    save_json_file(FAVORITE_RULES_FILE, rules)
+    return rules[str(series_id)]
+
+def enqueue_new_episodes(series_id, series_info, new_episodes, rule):
+    """Ajoute à la file de téléchargement les nouveaux épisodes couverts par la règle du favori.
+
+    Utilise les données get_series_info déjà récupérées par le moniteur : aucune requête supplémentaire.
+    """
+    # Import tardif : seriale.py importe ce module pour les règles des favoris, et les processus web
+    # d'un démon de téléchargement (DOWNLOAD_DAEMON_URL) ne doivent pas charger la file d'attente
+    from downloader_core import add_to_download_queue
+    added_count = 0
+    for episode_obj in new_episodes:
+        season = int(episode_obj['season'])
+        if rule['seasons'] and season not in rule['seasons']:
+            continue
+        job = build_episode_job(series_id, series_info, episode_obj, season, ext=rule['ext'] or None)
+        if add_to_download_queue(job):
+            added_count += 1
+    return added_count
+
 # --- Fonction pour nettoyer les noms de fichiers ---
 def sanitize_filename(name):
     return re.sub(r'[<>:"/\\|?*]', '', name).strip()
@@ -51,9 +105,8 @@ def sanitize_filename(name):
 # --- Fonction pour récupérer les détails d'une série depuis Xtream ---
 def get_xtream_series_details(series_id):
     try:
-        response = requests.get(f"{BASE_API}&action=get_series_info&series_id={series_id}")
-        response.raise_for_status()
-        series_info = response.json()
+        # Toujours une requête fraîche pour la surveillance ; la réponse rafraîchit aussi le cache de xtream_api
+        series_info = xtream_api.get_series_info(series_id, max_age=0)
         
         if not series_info or 'info' not in series_info or 'episodes' not in series_info:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur : Données de série incomplètes {series_id} depuis Xtream.")
@@ -68,13 +121,16 @@ def get_xtream_series_details(series_id):
                         'id': ep['id'],
                         'episode_num': ep['episode_num'],
                         'title': ep.get('title', f'Épisode {ep["episode_num"]}'),
-                        'ext': ep.get('container_extension', 'mp4')
+                        'ext': ep.get('container_extension', 'mp4'),
+                        'container_extension': ep.get('container_extension', 'mp4'),
+                        'season': str(season_num_str)
                     })
         
         return {
             'name': series_info['info'].get('name', f'Série inconnue {series_id}'),
             'episodes_by_season': episodes_by_season,
-            'cover_url': series_info['info'].get('cover')
+            'cover_url': series_info['info'].get('cover'),
+            'series_info': series_info['info']
         }
 
     except requests.exceptions.RequestException as e:
@@ -84,40 +140,41 @@ def get_xtream_series_details(series_id):
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur inattendue lors de la récupération des détails de la série {series_id}: {e}")
         return None
 
-# --- Fonction pour envoyer des notifications Discord Webhook ---
-def send_discord_notification(title, description, color=0x00FF00, image_url=None):
-    if not DISCORD_WEBHOOK_URL:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Avertissement : DISCORD_WEBHOOK_URL non configuré. N'envoie pas de notification.")
-        return
-
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    embed = {
-        "title": title,
-        "description": description,
-        "color": color,
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "footer": {
-            "text": "Moniteur de Séries (Xtream)"
-        }
-    }
-    if image_url:
-        embed["thumbnail"] = {"url": image_url}
-
-    payload = {
-        "embeds": [embed]
-    }
-
+# --- Fonction pour récupérer la liste complète des séries (une seule requête) ---
+def get_xtream_series_listing():
+    """Renvoie un dictionnaire {series_id: entrée get_series} ou None si la liste est indisponible."""
     try:
-        response = requests.post(DISCORD_WEBHOOK_URL, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Notification Discord envoyée avec succès.")
+        series_list = xtream_api.get_catalog("get_series", max_age=0)
+        return {str(s.get('series_id')): s for s in series_list if s.get('series_id') is not None}
     except requests.exceptions.RequestException as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur lors de l'envoi de la notification Discord: {e}")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur de connexion à l'API Xtream pour la liste des séries : {e}")
+        return None
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur inattendue lors de la préparation/envoi de la notification Discord: {e}")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Erreur inattendue lors de la récupération de la liste des séries : {e}")
+        return None
+
+def get_listing_fingerprint(listing_entry):
+    """Extrait de l'entrée get_series les champs permettant de détecter une modification de la série."""
+    fingerprint = {'last_modified': str(listing_entry.get('last_modified') or '')}
+    # Certains panels Xtream exposent aussi le nombre d'épisodes dans la liste
+    for key in ('episode_count', 'num_episodes'):
+        if listing_entry.get(key) not in (None, ''):
+            try:
+                fingerprint['episode_count'] = int(listing_entry[key])
+            except (TypeError, ValueError):
+                pass
+            break
+    return fingerprint
+
+def series_unchanged(saved_state, fingerprint):
+    """Indique si la série peut être ignorée : déjà analysée et identique à la dernière vérification."""
+    if not saved_state or not saved_state.get('monitored_seasons'):
+        return False
+    if not fingerprint['last_modified'] or saved_state.get('last_modified') != fingerprint['last_modified']:
+        return False
+    if 'episode_count' in fingerprint and saved_state.get('episode_count') != fingerprint['episode_count']:
+        return False
+    return True
 
 # --- Logique principale de surveillance ---
 def monitor_new_episodes():
@@ -129,14 +186,41 @@ def monitor_new_episodes():
     
     favorites = load_json_file(FAVORITES_FILE, [])
     monitored_series_state = load_json_file(MONITORED_STATE_FILE, {})
+    favorite_rules = load_favorite_rules()
 
     new_episodes_found_overall = False
+    state_changed = False
 
-    for series_id in favorites:
+    # Passe de détection des changements : une seule requête get_series pour toutes les séries,
+    # puis get_series_info uniquement pour les favoris dont last_modified (ou le nombre d'épisodes) a changé.
+    series_listing = get_xtream_series_listing()
+    if series_listing is None and circuit_breaker.service_open("xtream"):
+        # Fournisseur indisponible : une seule ligne, plutôt qu'une erreur par favori
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Fournisseur Xtream indisponible (disjoncteur ouvert) : surveillance reportée au prochain passage.")
+        return
+    if series_listing is None:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Liste des séries indisponible. Vérification complète de tous les favoris.")
+
+    skipped_count = 0
+    fetched_count = 0
+
+    for position, series_id in enumerate(favorites):
         series_id_str = str(series_id)
-        
+
+        fingerprint = None
+        if series_listing is not None and series_id_str in series_listing:
+            fingerprint = get_listing_fingerprint(series_listing[series_id_str])
+            if series_unchanged(monitored_series_state.get(series_id_str), fingerprint):
+                skipped_count += 1
+                continue
+
+        if circuit_breaker.service_open("xtream"):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Fournisseur Xtream indisponible (disjoncteur ouvert) : {len(favorites) - position} favori(s) reporté(s) au prochain passage.")
+            break
+
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Vérification de la série ID : {series_id_str}")
 
+        fetched_count += 1
         xtream_details = get_xtream_series_details(series_id)
         if not xtream_details:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Série {series_id_str} ignorée en raison de problèmes de récupération des données depuis Xtream.")
@@ -146,7 +230,8 @@ def monitor_new_episodes():
         series_name_for_log = xtream_details['name']
         series_cover_url = xtream_details.get('cover_url') 
 
-        if series_id_str not in monitored_series_state:
+        is_first_scan = series_id_str not in monitored_series_state
+        if is_first_scan:
             monitored_series_state[series_id_str] = {
                 'name': series_name_for_log,
                 'monitored_seasons': {}
@@ -156,6 +241,7 @@ def monitor_new_episodes():
         saved_seasons_data = monitored_series_state[series_id_str].get('monitored_seasons', {})
         
         new_episodes_for_this_series = False
+        new_episodes_for_notification = []
 
         for season_num_str, current_ep_objects in current_episodes_by_season.items():
             saved_ep_nums = saved_seasons_data.get(season_num_str, [])
@@ -166,20 +252,7 @@ def monitor_new_episodes():
                 if ep_num not in saved_ep_nums:
                     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]   >>> NOUVEL ÉPISODE TROUVÉ : {series_name_for_log} S{int(season_num_str):02d}E{int(ep_num):02d} ({episode_obj['title']})")
                     
-                    notification_title = f"Nouvel épisode de série ! 🔔"
-                    notification_description = (
-                        f"**{series_name_for_log}**\n"
-                        f"Saison : {int(season_num_str)}\n"
-                        f"Épisode : {int(ep_num)}\n"
-                        f"Titre : {episode_obj['title']}"
-                    )
-                    
-                    send_discord_notification(
-                        title=notification_title,
-                        description=notification_description,
-                        color=0x3498DB,
-                        image_url=series_cover_url
-                    )
+                    new_episodes_for_notification.append(episode_obj)
                     
                     saved_ep_nums.append(ep_num)
                     new_episodes_found_overall = True
@@ -187,17 +260,37 @@ def monitor_new_episodes():
             
             monitored_series_state[series_id_str]['monitored_seasons'][season_num_str] = sorted(list(set(saved_ep_nums)))
 
+        # Une seule notification par série, envoyée en arrière-plan par la boîte d'envoi Discord
+        queue_new_episodes_notification(series_id_str, series_name_for_log, series_cover_url, new_episodes_for_notification)
+
+        rule = get_favorite_rule(series_id_str, favorite_rules)
+        # Au premier passage, tous les épisodes existants sont "nouveaux" : seuls les suivants sont téléchargés
+        if rule['auto_download'] and new_episodes_for_notification and not is_first_scan:
+            added_count = enqueue_new_episodes(series_id_str, xtream_details['series_info'], new_episodes_for_notification, rule)
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Téléchargement automatique : {added_count} épisode(s) de '{series_name_for_log}' ajouté(s) à la file d'attente.")
+
         monitored_series_state[series_id_str]['last_checked'] = datetime.now().isoformat()
+        if fingerprint is not None:
+            # Empreinte de la liste get_series telle quelle : comparée à la liste au prochain passage. Le nombre
+            # d'épisodes de la liste peut différer de celui de get_series_info (épisodes spéciaux, num_episodes)
+            monitored_series_state[series_id_str]['last_modified'] = fingerprint['last_modified']
+            if 'episode_count' in fingerprint:
+                monitored_series_state[series_id_str]['episode_count'] = fingerprint['episode_count']
+            else:
+                monitored_series_state[series_id_str].pop('episode_count', None)
+        state_changed = True
         
         if new_episodes_for_this_series:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Vérification de la série '{series_name_for_log}' terminée. Nouveaux épisodes trouvés.")
         else:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Vérification de la série '{series_name_for_log}' terminée. Aucun nouvel épisode.")
 
-    if new_episodes_found_overall:
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {fetched_count} série(s) vérifiée(s), {skipped_count} série(s) inchangée(s) ignorée(s).")
+
+    if state_changed:
         save_json_file(MONITORED_STATE_FILE, monitored_series_state)
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] État des séries surveillées mis à jour.")
-    else:
+    if not new_episodes_found_overall:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Aucun nouvel épisode trouvé pour les séries surveillées.")
 
 # Suppression de if __name__ == "__main__": monitor_new_episodes() # pour que la fonction soit importable et appelable depuis app.py/seriale.py
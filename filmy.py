@@ -5,18 +5,30 @@ import os
 import requests
 import subprocess
 from urllib.parse import quote
-import re
-from datetime import datetime # Nécessaire pour les noms de dossiers Plex
 
-# Importer les composants communs de downloader_core
-from downloader_core import (
+# File d'attente et travaux NFO en masse : locaux ou via le démon de téléchargement (DOWNLOAD_DAEMON_URL)
+from download_client import (
+    start_library_nfo_job,
+    get_bulk_job,
+    schedule_movie_enrichment,
     add_to_download_queue,
     get_queue_status,
     get_full_queue_data,
     remove_from_queue,
     reorder_queue,
-    get_completed_items
+    get_completed_items,
+    get_held_jobs,
+    get_stall_events,
+    get_leases,
+    retry_job
 )
+import tmdb_cache
+import xtream_api
+from nfo_writer import movie_nfo, write_nfo
+from plex_naming import clean_name, folder_name, release_year
+from circuit_breaker import CircuitOpenError
+from artwork import queue_movie_artwork
+from request_timing import phase
 
 filmy_bp = Blueprint('filmy', __name__, url_prefix='/filmy')
 
@@ -26,77 +38,32 @@ XTREAM_PORT = os.getenv("XTREAM_PORT")
 XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
 XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
 DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
-TMDB_API_KEY = "cfdfac787bf2a6e2c521b93a0309ff2c" # Si vous ajoutez des détails de film
-BASE_API = f"{XTREAM_HOST}:{XTREAM_PORT}/player_api.php?username={XTREAM_USERNAME}&password={XTREAM_PASSWORD}"
-
-# --- Fonction d'assistance sanitize_filename ---
-def sanitize_filename(name):
-    """Supprime les caractères non valides du nom de fichier/dossier pour assurer la compatibilité."""
-    s = re.sub(r'[^\w\s\-\._()]', '', name)
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
 
 # --- Fonctions TMDB pour les films (facultatif, si vous voulez plus de détails) ---
-from functools import lru_cache
-
-@lru_cache(maxsize=128)
 def search_tmdb_movie_id(title):
-    cleaned_title = (
-        title
-        .replace("PL -", "")
-        .replace("PL-", "")
-        .replace("POLSKI", "")
-        .replace("LEKTOR", "")
-        .replace("DUBBING", "")
-        .strip()
-        .title()
-    )
-    url = f"https://api.themoviedb.org/3/search/movie?api_key={TMDB_API_KEY}&query={quote(cleaned_title)}&language=pl-PL"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get("results", [])
-        if results:
-            return results[0]["id"]
-    return None
+    # Nettoyage du titre et cache disque partagé (tmdb_cache.py), y compris pour les titres introuvables
+    return tmdb_cache.search_movie_id(title)
 
 def get_tmdb_movie_metadata(tmdb_id):
-    url = f"https://api.themoviedb.org/3/movie/{tmdb_id}?api_key={TMDB_API_KEY}&language=pl-PL"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return None
+    return tmdb_cache.get_movie_metadata(tmdb_id)
 
 # --- ROUTE NFO pour les films ---
 @filmy_bp.route("/nfo/<int:movie_id>")
 def download_movie_nfo(movie_id):
     try:
-        response = requests.get(f"{BASE_API}&action=get_vod_info&vod_id={movie_id}")
-        response.raise_for_status()
-        info = response.json()
+        # Disjoncteur, délai d'attente et métriques communs à tous les appels Xtream
+        info = xtream_api.xtream_get("get_vod_info", vod_id=movie_id)
+    except CircuitOpenError as e:
+        return f"Fournisseur Xtream indisponible : {e}", 503
     except requests.exceptions.RequestException as e:
-        return f"Erreur de communication avec l'API : {e}", 500
+        # Nom de l'exception seulement : son message contient l'URL, avec les identifiants Xtream
+        return f"Erreur de communication avec l'API : {type(e).__name__}", 500
     except ValueError:
         return "Erreur : Réponse JSON non valide de l'API.", 500
 
     movie_info = info.get('info', {})
-    movie_name_raw = movie_info.get('name', f"film_{movie_id}")
-    
-    # === LOGIQUE DE NOMMAGE PLEX POUR LE FILM ===
-    prefix_pattern = r"^(?:[pP][lL]|[eE][nN]|[aA]\+|[dD]\+)\s*-\s*"
-    movie_name_cleaned = re.sub(prefix_pattern, "", movie_name_raw).strip()
-    
-    release_date_str = movie_info.get('releaseDate', '') # Pour les films, c'est 'releasedate' (API v2) ou 'added' (API v1)
-    year_str = ''
-    if release_date_str:
-        try:
-            year_str = f"({datetime.strptime(release_date_str, '%Y-%m-%d').year})"
-        except ValueError:
-            if release_date_str.strip()[:4].isdigit():
-                 year_str = f"({release_date_str.strip()[:4]})"
-    
-    movie_folder_name = sanitize_filename(f"{movie_name_cleaned} {year_str}".strip())
-    # ==========================================
+    movie_name_cleaned = clean_name(movie_info.get('name', f"film_{movie_id}"))
+    movie_folder_name = folder_name(movie_name_cleaned, release_year(movie_info.get('releaseDate', '')))
 
     tmdb_id = search_tmdb_movie_id(movie_name_cleaned)
     if not tmdb_id:
@@ -105,34 +72,26 @@ def download_movie_nfo(movie_id):
     if not metadata:
         return "Pas de métadonnées de TMDB", 404
 
-    nfo = f"""
-<movie>
-  <title>{metadata['title']}</title>
-  <originaltitle>{metadata['original_title']}</originaltitle>
-  <plot>{metadata['overview']}</plot>
-  <tagline>{metadata['tagline']}</tagline>
-  <runtime>{metadata['runtime']}</runtime>
-  <year>{metadata['release_date'].split('-')[0]}</year>
-  <rating>{metadata['vote_average']}</rating>
-  <country>{', '.join([c['name'] for c in metadata['production_countries']])}</country>
-  <director>{', '.join([c['name'] for c in metadata.get('credits', {}).get('crew', []) if c['job'] == 'Director'])}</director>
-  <writer>{', '.join([c['name'] for c in metadata.get('credits', {}).get('crew', []) if c['job'] == 'Screenplay'])}</writer>
-  <genre>{', '.join([g['name'] for g in metadata['genres']])}</genre>
-  <premiered>{metadata['release_date']}</premiered>
-  <releasedate>{metadata['release_date']}</releasedate>
-  <thumb>{'https://image.tmdb.org/t/p/original' + metadata['poster_path'] if metadata.get('poster_path') else ''}</thumb>
-</movie>
-"""
     path = os.path.join(DOWNLOAD_PATH_MOVIES, movie_folder_name)
-    os.makedirs(path, exist_ok=True)
-    file_name_nfo = f"{movie_folder_name}.nfo"
-    file_path = os.path.join(path, file_name_nfo)
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(nfo.strip())
+    file_path = write_nfo(path, f"{movie_folder_name}.nfo", movie_nfo(metadata))
+    queue_movie_artwork(path, tmdb_id)
     return f"📄 Fichier enregistré : {file_path}", 200
 
 
+# --- Génération de NFO en masse pour les films déjà présents sous DOWNLOAD_PATH_MOVIES ---
+@filmy_bp.route("/nfo/bulk/library", methods=["POST"])
+def bulk_nfo_library():
+    force = request.values.get("force") == "1"
+    return jsonify(start_library_nfo_job("movies", force=force)), 202
+
+@filmy_bp.route("/nfo/jobs/<job_id>")
+def bulk_nfo_job_status(job_id):
+    job = get_bulk_job(job_id)
+    if not job:
+        return jsonify({"message": "Travail NFO introuvable."}), 404
+    return jsonify(job)
+
+
 # --- Vues de gestion de la file d'attente (utilisent des fonctions communes de downloader_core) ---
 # Ces routes sont déjà disponibles sous /series/queue/..., mais peuvent être dupliquées pour /films/queue/
 # Si vous voulez qu'elles ne soient disponibles qu'une seule fois pour toute l'application, enregistrez-les une seule fois dans le app.py principal
@@ -148,6 +107,13 @@ def queue_remove():
     remove_from_queue(item_id)
     return '', 204
     
+@filmy_bp.route("/queue/retry", methods=["POST"])
+def queue_retry():
+    # Nouvelle tentative d'une tâche en échec définitif (❌), conservée dans la file d'attente
+    if retry_job(request.form.get("id")):
+        return '', 204
+    return "Tâche introuvable ou pas en échec.", 409
+
 @filmy_bp.route("/queue/reorder", methods=["POST"])
 def queue_reorder():
     order = request.json.get("order", [])
@@ -162,28 +128,46 @@ def completed_movies(): # Le nom de la fonction a été modifié pour être spé
 def get_full_queue():
     return jsonify(get_full_queue_data())
 
+@filmy_bp.route("/queue/held")
+def queue_held():
+    # Tâches retenues faute d'espace disque et espace réservé par les tâches admises
+    return jsonify(get_held_jobs())
+
+@filmy_bp.route("/queue/stalls")
+def queue_stalls():
+    # Derniers transferts bloqués détectés par le chien de garde
+    return jsonify(get_stall_events())
+
+@filmy_bp.route("/queue/leases")
+def queue_leases():
+    # Tâches confiées aux nœuds distants (progression, registre des nœuds, derniers événements)
+    return jsonify(get_leases())
+
 
 # --- Vue principale de la liste des films ---
 @filmy_bp.route("/")
 def filmy_list():
     query = request.args.get('query', '').lower()
 
-    response = requests.get(f"{BASE_API}&action=get_vod_streams")
-    if response.status_code != 200:
+    # Catalogue gardé en mémoire XTREAM_CATALOG_TTL_SECONDS secondes (recherches successives sans nouvelle requête),
+    # affiché partiellement tant que toutes les catégories ne sont pas arrivées
+    try:
+        all_movies, catalog_progress = xtream_api.get_catalog_partial("get_vod_streams")
+    except (requests.exceptions.RequestException, ValueError):
         return "Erreur lors du téléchargement de la liste de films", 500
     
-    all_movies = response.json()
-    
-    if query:
-        filtered_movies = []
-        for movie in all_movies:
-            if movie.get('name') and query in movie['name'].lower():
-                filtered_movies.append(movie)
-        movies_to_display = filtered_movies
-    else:
-        movies_to_display = all_movies
-
-    return render_template("filmy_list.html", movies=movies_to_display, completed_data=get_completed_items())
+    with phase("filter"):
+        if query:
+            filtered_movies = []
+            for movie in all_movies:
+                if movie.get('name') and query in movie['name'].lower():
+                    filtered_movies.append(movie)
+            movies_to_display = filtered_movies
+        else:
+            movies_to_display = all_movies
+        completed_items = get_completed_items()
+
+    return render_template("filmy_list.html", movies=movies_to_display, completed_data=completed_items, catalog_progress=catalog_progress)
 
 # --- ROUTE DE TÉLÉCHARGEMENT DE FILM (utilise add_to_download_queue) ---
 @filmy_bp.route("/download", methods=["POST"])
@@ -196,21 +180,10 @@ def download_movie():
         return "Erreur : Données requises manquantes pour télécharger le film.", 400
 
     # === LOGIQUE DE NOMMAGE PLEX POUR LE FILM ===
-    prefix_pattern = r"^(?:[pP][lL]|[eE][nN]|[aA]\+|[dD]\+)\s*-\s*"
-    movie_name_cleaned = re.sub(prefix_pattern, "", name_raw).strip()
-    
-    # Essayez d'obtenir l'année de TMDB pour un nom de dossier plus précis
-    tmdb_id = search_tmdb_movie_id(movie_name_cleaned)
-    release_year_str = ''
-    if tmdb_id:
-        tmdb_metadata = get_tmdb_movie_metadata(tmdb_id)
-        if tmdb_metadata and tmdb_metadata.get('release_date'):
-            release_year_str = tmdb_metadata['release_date'].split('-')[0]
-    
-    if release_year_str:
-        movie_folder_name = sanitize_filename(f"{movie_name_cleaned} ({release_year_str})")
-    else:
-        movie_folder_name = sanitize_filename(movie_name_cleaned)
+    movie_name_cleaned = clean_name(name_raw)
+    # Nom de dossier provisoire (sans année) : l'année TMDB est résolue en arrière-plan
+    # par enrichment.py, qui finalise le dossier et le NFO avant ou après le téléchargement.
+    movie_folder_name = folder_name(movie_name_cleaned, '')
     # ==========================================
 
     path = os.path.join(DOWNLOAD_PATH_MOVIES, movie_folder_name)
@@ -228,10 +201,12 @@ def download_movie():
         "file": file_name,
         "item_id": stream_id, # Nous utilisons un item_id générique
         "item_type": "movie", # Nous ajoutons le type d'élément
-        "title": name_raw # Titre original pour les journaux et l'affichage
+        "title": name_raw, # Titre original pour les journaux et l'affichage
+        "enrichment": {"status": "pending", "query": movie_name_cleaned, "ext": ext}
     }
 
     if add_to_download_queue(job):
+        schedule_movie_enrichment(job)
         return "🕐 Film ajouté à la file d'attente", 202
     else:
         return "Film déjà dans la file d'attente ou téléchargé.", 200
\ No newline at end of file
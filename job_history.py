@@ -0,0 +1,171 @@
+# job_history.py
+#
+# Historique des tentatives de téléchargement (JOB_HISTORY_FILE) : une ligne JSON par tentative, avec
+# début et fin, octets reçus, débit moyen, issue (completed, retry, failed, expired, paused), cause et nombre de
+# tentatives précédentes. Interrogé par la page /history pour suivre le débit du fournisseur semaine par semaine.
+
+import json
+import os
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+# --- Configuration ---
+JOB_HISTORY_FILE = "job_history.jsonl"
+# Ancienneté maximale des tentatives conservées, appliquée au premier chargement (0 = tout garder)
+JOB_HISTORY_RETENTION_DAYS = int(os.getenv("JOB_HISTORY_RETENTION_DAYS", 365))
+
+# Filtres acceptés par query_history (paramètres de /history/data et de l'API du démon)
+HISTORY_FILTERS = ("series_id", "item_type", "since", "until", "reason", "outcome")
+
+_lock = threading.Lock()
+_entries = []
+_loaded = False
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+def _ensure_loaded():
+    """Charge le fichier (une fois) et retire les tentatives trop anciennes. Doit être appelée avec _lock détenu."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not os.path.exists(JOB_HISTORY_FILE):
+        return
+    cutoff = (datetime.now() - timedelta(days=JOB_HISTORY_RETENTION_DAYS)).isoformat(timespec='seconds') if JOB_HISTORY_RETENTION_DAYS > 0 else ""
+    dropped = 0
+    try:
+        with open(JOB_HISTORY_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    dropped += 1 # Ligne tronquée par un arrêt brutal
+                    continue
+                if entry.get("started", "") < cutoff:
+                    dropped += 1
+                    continue
+                _entries.append(entry)
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur de lecture du fichier {JOB_HISTORY_FILE}: {e}")
+        return
+    if dropped:
+        tmp_path = f"{JOB_HISTORY_FILE}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in _entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, JOB_HISTORY_FILE)
+        except OSError as e:
+            print(f"[{_now_str()}] Erreur d'écriture du fichier {JOB_HISTORY_FILE}: {e}")
+
+def record_attempt(job, outcome, reason=None, kind=None, retries=None):
+    """Enregistre la fin d'une tentative. job["attempt"] porte le début, les octets reçus et la durée du transfert.
+
+    outcome : completed, retry (nouvelle tentative programmée), failed (échec définitif), expired (bail perdu)
+    ou paused (fournisseur indisponible, tentative non comptée).
+    """
+    attempt = job.get("attempt") or {}
+    ended = time.time()
+    started = attempt.get("started") or ended
+    received = attempt.get("bytes") or 0
+    download_seconds = attempt.get("download_seconds") or max(0.0, ended - started)
+    cmd = job.get("cmd") or []
+    host = urlparse(cmd[3]).netloc if len(cmd) > 3 else None
+    if reason and host:
+        # Le message de wget contient l'URL du flux, avec l'identifiant et le mot de passe Xtream
+        reason = reason.replace(cmd[3], host)
+    entry = {
+        "item_id": str(job.get("item_id")),
+        "item_type": job.get("item_type", "unknown"),
+        "title": job.get("title"),
+        "series_id": job.get("series_id"),
+        "series": job.get("series"),
+        "host": host,
+        "worker": attempt.get("worker", "local"),
+        "started": _iso(started),
+        "ended": _iso(ended),
+        "duration_seconds": round(ended - started, 1),
+        "bytes": received,
+        "download_seconds": round(download_seconds, 1),
+        "avg_bytes_per_second": round(received / download_seconds) if received and download_seconds > 0 else None,
+        "outcome": outcome,
+        "kind": kind,
+        "reason": reason,
+        "retries": job.get("attempts", 0) if retries is None else retries,
+    }
+    with _lock:
+        _ensure_loaded()
+        _entries.append(entry)
+        try:
+            with open(JOB_HISTORY_FILE, "a", encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[{_now_str()}] Erreur d'écriture du fichier {JOB_HISTORY_FILE}: {e}")
+    return entry
+
+def _matches(entry, series_id=None, item_type=None, since=None, until=None, reason=None, outcome=None):
+    if series_id and str(entry.get("series_id")) != str(series_id):
+        return False
+    if item_type and entry.get("item_type") != item_type:
+        return False
+    # Dates au format ISO (AAAA-MM-JJ) : la comparaison de chaînes suffit
+    if since and entry.get("started", "") < since:
+        return False
+    if until and entry.get("started", "")[:len(until)] > until:
+        return False
+    if outcome and entry.get("outcome") != outcome:
+        return False
+    if reason:
+        # Cause résumée exacte (wget, stall, verification, remote...) ou texte contenu dans le message d'erreur
+        if entry.get("kind") != reason and reason.lower() not in (entry.get("reason") or "").lower():
+            return False
+    return True
+
+def query_history(series_id=None, item_type=None, since=None, until=None, reason=None, outcome=None, limit=200):
+    """Tentatives correspondant aux filtres, les plus récentes d'abord."""
+    with _lock:
+        _ensure_loaded()
+        entries = list(_entries)
+    matching = [entry for entry in reversed(entries)
+                if _matches(entry, series_id, item_type, since, until, reason, outcome)]
+    return matching[:limit] if limit else matching
+
+def history_trends(weeks=12, item_type=None, series_id=None):
+    """Agrégats par semaine ISO et par hôte du fournisseur : tentatives, issues, octets et débit."""
+    since = (datetime.now() - timedelta(weeks=weeks)).date().isoformat()
+    groups = {}
+    for entry in query_history(series_id=series_id, item_type=item_type, since=since, limit=0):
+        year, week, _ = datetime.fromisoformat(entry["started"]).isocalendar()
+        key = (f"{year}-S{week:02d}", entry.get("host") or "?")
+        group = groups.setdefault(key, {"week": key[0], "host": key[1], "attempts": 0, "completed": 0, "retry": 0,
+                                        "failed": 0, "expired": 0, "paused": 0, "bytes": 0, "download_seconds": 0.0,
+                                        "speeds": [], "failures_by_kind": {}})
+        group["attempts"] += 1
+        outcome = entry.get("outcome")
+        if outcome in ("completed", "retry", "failed", "expired", "paused"):
+            group[outcome] += 1
+        if outcome != "completed":
+            kind = entry.get("kind") or "unknown"
+            group["failures_by_kind"][kind] = group["failures_by_kind"].get(kind, 0) + 1
+        if entry.get("bytes"):
+            group["bytes"] += entry["bytes"]
+            group["download_seconds"] += entry.get("download_seconds") or 0
+        if entry.get("avg_bytes_per_second"):
+            group["speeds"].append(entry["avg_bytes_per_second"])
+    trends = []
+    for key in sorted(groups):
+        group = groups.pop(key)
+        speeds = group.pop("speeds")
+        group["download_seconds"] = round(group["download_seconds"], 1)
+        group["avg_bytes_per_second"] = round(group["bytes"] / group["download_seconds"]) if group["download_seconds"] else None
+        group["median_bytes_per_second"] = round(statistics.median(speeds)) if speeds else None
+        group["success_rate"] = round(group["completed"] / group["attempts"], 3)
+        trends.append(group)
+    return trends
@@ -0,0 +1,264 @@
+# job_leases.py
+#
+# Répartition des téléchargements vers des nœuds distants (remote_worker.py) par baux.
+# Un nœud prend une tâche de la file (acquire), renouvelle son bail en envoyant sa progression
+# (heartbeat), puis rend la tâche terminée (complete) ou en échec (fail). Le bail d'un nœud qui ne
+# donne plus de nouvelles expire : la tâche revient dans la file et un autre worker la reprend.
+
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import circuit_breaker
+import downloader_core
+import job_history
+from downloader_core import state, save_queue, set_status, download_queue
+import metrics
+from disk_admission import release
+
+# --- Configuration ---
+# Durée d'un bail sans nouvelles du nœud (les nœuds renouvellent au tiers de cette durée)
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", 60))
+# Causes d'échec qu'un nœud peut envoyer (libellés des métriques) ; toute autre valeur devient "remote"
+REMOTE_FAILURE_KINDS = ("wget", "stall", "http", "io", "verification")
+
+# --- Baux en cours ---
+# Modifiés uniquement dans des commandes de l'écrivain de downloader_core (state.execute)
+# {lease_id: {"lease_id", "item_id", "worker_id", "job", "acquired", "expires", "progress"}}
+_leases = {}
+# {worker_id: {"last_seen", "leases", "completed", "failed", "expired"}}
+_workers = {}
+# Derniers événements (attribution, fin, échec, expiration) pour le diagnostic
+lease_events = deque(maxlen=200)
+_reaper_thread = None
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _worker(worker_id):
+    """Entrée du registre des nœuds. À n'appeler que dans une commande."""
+    entry = _workers.setdefault(worker_id, {"last_seen": None, "leases": 0, "completed": 0, "failed": 0, "expired": 0})
+    entry["last_seen"] = time.time()
+    return entry
+
+def _event(kind, lease, detail=None):
+    lease_events.append({"time": datetime.now().isoformat(timespec='seconds'), "event": kind,
+                         "item_id": lease["item_id"], "worker_id": lease["worker_id"], "detail": detail})
+    metrics.REMOTE_LEASES.inc(event=kind)
+
+def acquire(worker_id):
+    """Confie la prochaine tâche disponible au nœud worker_id. Renvoie le bail (dict) ou None si la file est vide.
+
+    Aucune tâche n'est confiée tant qu'un disjoncteur Xtream est ouvert : la file reste en pause.
+    """
+    def apply():
+        _worker(worker_id)
+        if circuit_breaker.service_open("xtream"):
+            return None
+        while True:
+            try:
+                job = download_queue.get_nowait()
+            except queue.Empty:
+                return None
+            download_queue.task_done()
+            item_id = str(job.get("item_id"))
+            if (not downloader_core._is_queued(job) or job.get("lease") or job.get("failed")
+                    or job.get("stage") in ("verifying", "moving") or item_id == downloader_core.active_item_id):
+                continue # Même règle que le worker local : tâche supprimée, déjà téléchargée ou en cours
+            break
+        # Le nœud écrit sur ses propres disques : la réservation et la retenue locales ne s'appliquent pas
+        release(item_id)
+        job.pop("hold_reason", None)
+        if job.get("final_path"):
+            job["cmd"][2] = job.pop("final_path")
+        now = time.time()
+        lease = {
+            "lease_id": uuid.uuid4().hex,
+            "item_id": item_id,
+            "worker_id": worker_id,
+            "job": job,
+            "destination": job["cmd"][2],
+            "acquired": now,
+            "expires": now + LEASE_TTL_SECONDS,
+            "progress": {},
+        }
+        _leases[lease["lease_id"]] = lease
+        job["lease"] = {"lease_id": lease["lease_id"], "worker_id": worker_id}
+        job["attempt"] = {"started": now, "worker": worker_id}
+        _workers[worker_id]["leases"] += 1
+        save_queue()
+        set_status(item_id, "🌐")
+        return lease
+
+    lease = state.execute(apply)
+    if lease is None:
+        return None
+    job, item_id = lease["job"], lease["item_id"]
+    _event("granted", lease)
+    print(f"[{_now_str()}] Tâche {job.get('title')} (ID: {item_id}) confiée au nœud {worker_id}.")
+    return {
+        "lease_id": lease["lease_id"],
+        "ttl_seconds": LEASE_TTL_SECONDS,
+        "job": {key: job.get(key) for key in ("item_id", "item_type", "title", "file", "cmd", "size_bytes")},
+    }
+
+def heartbeat(lease_id, progress=None):
+    """Renouvelle un bail et enregistre la progression du nœud. Renvoie False si le bail n'existe plus."""
+    def apply():
+        lease = _leases.get(lease_id)
+        if lease is None:
+            return False
+        _worker(lease["worker_id"])
+        lease["expires"] = time.time() + LEASE_TTL_SECONDS
+        if progress:
+            lease["progress"] = dict(progress, updated=time.time())
+        return True
+    return state.execute(apply)
+
+def _release_lease(lease_id, stats=None):
+    """Retire le bail et renvoie (bail, tâche), ou (None, None). À n'appeler que dans une commande.
+
+    stats : {"received", "download_seconds"} du compte rendu final du nœud ; à défaut, dernière progression reçue.
+    """
+    lease = _leases.pop(lease_id, None)
+    if lease is None:
+        return None, None
+    job = lease["job"]
+    job.pop("lease", None)
+    stats = stats or {}
+    attempt = job.setdefault("attempt", {"started": lease["acquired"], "worker": lease["worker_id"]})
+    received = stats.get("received", lease["progress"].get("received"))
+    if received is not None:
+        attempt["bytes"] = received
+    if stats.get("download_seconds"):
+        attempt["download_seconds"] = stats["download_seconds"]
+    return lease, job
+
+def complete(lease_id, sha256=None, size=None, ext=None, stats=None):
+    """Fin d'un téléchargement distant (fichier vérifié et placé à destination par le nœud)."""
+    def apply():
+        lease, job = _release_lease(lease_id, stats)
+        if lease is None:
+            return None, None
+        if not downloader_core._is_queued(job):
+            return lease, False # Tâche supprimée de la file pendant le téléchargement
+        _worker(lease["worker_id"])["completed"] += 1
+        job["cmd"][2] = lease["destination"]
+        if ext:
+            downloader_core._change_extension(job, ext)
+        job["sha256"] = sha256
+        job["remote_worker"] = lease["worker_id"]
+        return lease, job.pop("final_path", None)
+
+    lease, final_path = state.execute(apply)
+    if lease is None:
+        return False
+    downloader_core.stream_breaker.record(True)
+    job = lease["job"]
+    if final_path is False:
+        _event("cancelled", lease)
+        print(f"[{_now_str()}] Téléchargement distant de {job.get('title')} (ID: {lease['item_id']}) terminé après sa suppression "
+              f"de la file : non marqué comme téléchargé, le fichier reste sur le nœud {lease['worker_id']}.")
+        return True
+
+    def relocate():
+        job["cmd"][2] = final_path
+
+    if final_path and final_path != job["cmd"][2]:
+        # Destination changée pendant le téléchargement (enrichissement TMDB) : possible si le volume est partagé
+        if os.path.exists(job["cmd"][2]) and downloader_core.move_downloaded_file(job["cmd"][2], final_path):
+            state.execute(relocate)
+        else:
+            print(f"[{_now_str()}] Avertissement : {job['cmd'][2]} n'est pas visible ici, il reste à l'emplacement choisi au départ.")
+    downloader_core._complete_job(job, size=size)
+    _event("completed", lease)
+    print(f"[{_now_str()}] Téléchargement distant terminé : {job.get('title')} (ID: {lease['item_id']}, nœud {lease['worker_id']}).")
+    return True
+
+def fail(lease_id, reason, stats=None, kind=None):
+    """Échec d'un téléchargement distant : même chemin que les échecs locaux (nouvelle tentative ou échec définitif).
+
+    kind : cause résumée par le nœud (wget, stall, http, io, verification) ; "remote" pour un nœud qui ne l'envoie pas.
+    """
+    def apply():
+        lease, job = _release_lease(lease_id, stats)
+        if lease is not None:
+            _worker(lease["worker_id"])["failed"] += 1
+        return lease, job, lease is not None and downloader_core._is_queued(job)
+
+    lease, job, queued = state.execute(apply)
+    if lease is None:
+        return False
+    _event("failed", lease, reason)
+    if not queued:
+        return True # Tâche supprimée de la file pendant le téléchargement : rien à reprogrammer
+    downloader_core._retry_or_fail(job, f"nœud {lease['worker_id']} : {reason}", keep_part=True, kind=kind if kind in REMOTE_FAILURE_KINDS else "remote")
+    return True
+
+def expire_leases():
+    """Remet dans la file les tâches des nœuds qui n'ont pas renouvelé leur bail à temps. Renvoie leur nombre.
+
+    Le bail d'une tâche supprimée de la file entre-temps est simplement retiré.
+    """
+    def apply():
+        now = time.time()
+        expired = []
+        for lease_id in [lease_id for lease_id, lease in _leases.items() if lease["expires"] < now]:
+            lease, job = _release_lease(lease_id)
+            _workers.get(lease["worker_id"], {"expired": 0})["expired"] += 1
+            queued = downloader_core._is_queued(job)
+            if queued:
+                set_status(lease["item_id"], "⏳")
+                download_queue.put(job)
+            expired.append((lease, job, queued))
+        if expired:
+            save_queue()
+        return expired
+
+    expired = state.execute(apply)
+    for lease, job, queued in expired:
+        if not queued:
+            _event("expired", lease, "tâche supprimée de la file")
+            continue
+        _event("expired", lease)
+        job_history.record_attempt(job, "expired", f"bail expiré (nœud {lease['worker_id']})", kind="remote")
+        print(f"[{_now_str()}] Bail expiré pour {job.get('title')} (ID: {lease['item_id']}) : le nœud {lease['worker_id']} "
+              f"ne répond plus, tâche remise dans la file d'attente.")
+    return sum(1 for _, _, queued in expired if queued)
+
+def _reaper_loop():
+    while True:
+        time.sleep(max(1.0, LEASE_TTL_SECONDS / 4))
+        try:
+            expire_leases()
+        except Exception as e:
+            print(f"[{_now_str()}] Erreur lors de l'expiration des baux : {e}")
+
+def start_lease_reaper():
+    global _reaper_thread
+    if _reaper_thread is not None and _reaper_thread.is_alive():
+        return
+    _reaper_thread = threading.Thread(target=_reaper_loop, daemon=True)
+    _reaper_thread.start()
+
+def get_leases():
+    """Baux en cours (progression envoyée par les nœuds), registre des nœuds et derniers événements."""
+    def view():
+        now = time.time()
+        leases = [{
+                "lease_id": lease["lease_id"],
+                "item_id": lease["item_id"],
+                "worker_id": lease["worker_id"],
+                "title": lease["job"].get("title"),
+                "held_seconds": round(now - lease["acquired"], 1),
+                "expires_in_seconds": round(lease["expires"] - now, 1),
+                "progress": lease["progress"],
+            } for lease in _leases.values()]
+        workers = {worker_id: dict(entry, last_seen_seconds_ago=round(now - entry["last_seen"], 1) if entry["last_seen"] else None)
+                   for worker_id, entry in _workers.items()}
+        return {"leases": leases, "workers": workers, "events": list(lease_events)}
+    return state.execute(view)
@@ -0,0 +1,269 @@
+# library_scanner.py
+
+import os
+import json
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+import xtream_api
+from downloader_core import mark_completed
+from plex_naming import clean_name, folder_name, series_folder_name, release_year
+from bulk_nfo import FOLDER_PATTERN, EPISODE_FILE_PATTERN, VIDEO_EXTENSIONS
+
+# --- Configuration ---
+DOWNLOAD_PATH_MOVIES = os.getenv("DOWNLOAD_PATH_MOVIES", "/downloads/Filmy")
+DOWNLOAD_PATH_SERIES = os.getenv("DOWNLOAD_PATH_SERIES", "/downloads/Seriale")
+# Intervalle entre deux analyses automatiques de la bibliothèque (0 pour désactiver)
+LIBRARY_SCAN_INTERVAL_MINUTES = float(os.getenv("LIBRARY_SCAN_INTERVAL_MINUTES", 360))
+LIBRARY_SCAN_INITIAL_DELAY_SECONDS = 120
+# Dossiers déjà analysés : {chemin: {"mtime", "dirs", "files"}}. Un dossier dont le mtime
+# n'a pas changé n'est pas relu ; seuls ses sous-dossiers sont revisités.
+LIBRARY_SCAN_STATE_FILE = "library_scan_state.json"
+LIBRARY_SCAN_MAX_UNMATCHED = 100
+
+# --- État ---
+_run_lock = threading.Lock()
+_state_lock = threading.Lock()
+_scheduler_thread = None
+
+_status = {
+    "running": False,
+    "last_run_started": None,
+    "last_run_finished": None,
+    "last_trigger": None,
+    "last_error": None,
+    "last_result": None,
+}
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _load_scan_state():
+    if not os.path.exists(LIBRARY_SCAN_STATE_FILE):
+        return {}
+    try:
+        with open(LIBRARY_SCAN_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"[{_now_str()}] Fichier {LIBRARY_SCAN_STATE_FILE} illisible, analyse complète de la bibliothèque.")
+        return {}
+
+def _save_scan_state(state):
+    try:
+        tmp_file = f"{LIBRARY_SCAN_STATE_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, LIBRARY_SCAN_STATE_FILE)
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {LIBRARY_SCAN_STATE_FILE}: {e}")
+
+def _is_media(file_name):
+    return '.' in file_name and file_name.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS
+
+# --- Parcours incrémental ---
+def _walk_changed(root, previous, current):
+    """Parcourt root avec os.scandir et renvoie {dossier: [fichiers vidéo]} pour les dossiers nouveaux ou modifiés.
+
+    previous : état de l'analyse précédente ; current : rempli avec l'état de cette analyse.
+    """
+    changed = {}
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        cached = previous.get(path)
+        if cached and cached.get("mtime") == mtime:
+            # Contenu direct inchangé : réutiliser la liste, mais descendre quand même dans les sous-dossiers
+            current[path] = cached
+            pending.extend(cached.get("dirs", []))
+            continue
+        dirs, files = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file() and _is_media(entry.name):
+                        files.append(entry.name)
+        except OSError as e:
+            print(f"[{_now_str()}] Dossier illisible lors de l'analyse de la bibliothèque ({path}): {e}")
+            continue
+        current[path] = {"mtime": mtime, "dirs": dirs, "files": files}
+        new_files = sorted(set(files) - set((cached or {}).get("files", [])))
+        if new_files:
+            changed[path] = new_files
+        pending.extend(dirs)
+    return changed
+
+def _name_key(name):
+    return folder_name(name, '').lower()
+
+# --- Correspondance avec les ID du fournisseur ---
+def _movie_name_year(movie):
+    """(clé du titre, année) d'un film du catalogue : année du nom 'Titre (2020)', sinon de sa date de sortie."""
+    match = FOLDER_PATTERN.match(clean_name(movie['name']))
+    year = match.group('year') or str(movie.get('year') or '')[:4] or release_year(movie.get('releaseDate') or movie.get('release_date'))
+    return _name_key(match.group('name')), year if year.isdigit() else ''
+
+def _match_movies(changed):
+    """ID des films (stream_id) dont le dossier 'Titre (Année)' correspond au catalogue VOD.
+
+    Titre et année doivent correspondre quand le dossier a une année (un remake n'est pas marqué) ;
+    sur le titre seul, le film n'est retenu que s'il est le seul candidat du catalogue.
+    """
+    by_name_year, by_name = {}, {}
+    for movie in xtream_api.get_catalog("get_vod_streams", max_age=0) or []:
+        if movie.get('name') and movie.get('stream_id') is not None:
+            key, year = _movie_name_year(movie)
+            stream_id = str(movie['stream_id'])
+            if year:
+                by_name_year.setdefault((key, year), []).append(stream_id)
+            by_name.setdefault(key, []).append((stream_id, year))
+    matched, unmatched = [], []
+    for path, files in changed.items():
+        folder = FOLDER_PATTERN.match(os.path.basename(path))
+        key, year = _name_key(folder.group('name')), folder.group('year')
+        ids = by_name_year.get((key, year)) if year else None
+        if not ids:
+            # Titre seul : candidats sans année connue (ou sans année de dossier), et un seul possible
+            candidates = [stream_id for stream_id, movie_year in by_name.get(key, []) if not year or not movie_year]
+            ids = candidates if len(candidates) == 1 else None
+        if ids:
+            matched.extend(ids)
+        else:
+            unmatched.extend(os.path.join(path, f) for f in files)
+    return matched, unmatched
+
+def _match_episodes(changed):
+    """ID des épisodes dont le fichier 'Série (Année) - S01E02 - Titre' correspond à une série du catalogue."""
+    by_folder, by_name = {}, {}
+    for entry in xtream_api.get_catalog("get_series", max_age=0) or []:
+        if not entry.get('name') or entry.get('series_id') is None:
+            continue
+        series_id = str(entry['series_id'])
+        by_folder.setdefault(series_folder_name(entry).lower(), []).append(series_id)
+        by_name.setdefault(_name_key(clean_name(entry['name'])), []).append(series_id)
+
+    # Regrouper les fichiers par dossier de série : un seul get_series_info par série
+    wanted = {}
+    for path, files in changed.items():
+        series_dir = os.path.basename(os.path.dirname(path))
+        for file_name in files:
+            match = EPISODE_FILE_PATTERN.match(file_name.rsplit('.', 1)[0])
+            if match:
+                wanted.setdefault(series_dir, set()).add((int(match.group('season')), int(match.group('episode'))))
+
+    matched, unmatched = [], []
+    for series_dir, episodes in wanted.items():
+        series_ids = by_folder.get(series_dir.lower()) or by_name.get(_name_key(FOLDER_PATTERN.match(series_dir).group('name'))) or []
+        found = set()
+        for series_id in series_ids:
+            try:
+                data = xtream_api.get_series_info(series_id)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"[{_now_str()}] Erreur lors de la récupération de la série {series_id} pour l'analyse de la bibliothèque : {e}")
+                continue
+            for season_num_str, season_episodes in (data.get('episodes') or {}).items():
+                for ep in season_episodes:
+                    key = (int(ep.get('season', season_num_str)), int(ep.get('episode_num', 0)))
+                    if key in episodes:
+                        matched.append(str(ep['id']))
+                        found.add(key)
+        unmatched.extend(f"{series_dir} S{s:02d}E{e:02d}" for s, e in sorted(episodes - found))
+    return matched, unmatched
+
+# --- Passage d'analyse ---
+def scan_library(full=False):
+    """Rapproche les fichiers présents sur le disque de completed.json.
+
+    Seuls les dossiers nouveaux ou modifiés depuis la dernière analyse sont relus et rapprochés
+    du catalogue Xtream ; full=True ignore l'état précédent (après la perte de completed.json par exemple).
+    Renvoie un résumé du passage.
+    """
+    previous = {} if full else _load_scan_state()
+    current = {}
+    result = {"marked": 0, "unmatched": [], "errors": []}
+    for kind, root, match in (("movies", DOWNLOAD_PATH_MOVIES, _match_movies), ("series", DOWNLOAD_PATH_SERIES, _match_episodes)):
+        changed = _walk_changed(root, previous, current)
+        if not changed:
+            continue
+        try:
+            matched, unmatched = match(changed)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # Catalogue indisponible : oublier ces dossiers pour les relire au prochain passage
+            for path in changed:
+                current.pop(path, None)
+            result["errors"].append(f"{kind}: {e}")
+            print(f"[{_now_str()}] Catalogue Xtream indisponible pendant l'analyse de la bibliothèque ({kind}): {e}")
+            continue
+        added = mark_completed(matched)
+        result["marked"] += len(added)
+        result["unmatched"].extend(unmatched[:LIBRARY_SCAN_MAX_UNMATCHED - len(result["unmatched"])])
+        print(f"[{_now_str()}] Analyse de la bibliothèque ({kind}) : {sum(len(f) for f in changed.values())} nouveau(x) fichier(s), {len(added)} élément(s) marqué(s) comme terminé(s), {len(unmatched)} sans correspondance.")
+    _save_scan_state(current)
+    return result
+
+def _run_scan(trigger, full=False):
+    """Exécute une analyse. Le verrou _run_lock doit être détenu par l'appelant."""
+    started = time.time()
+    with _state_lock:
+        _status["running"] = True
+        _status["last_run_started"] = started
+    error = None
+    result = None
+    try:
+        result = scan_library(full)
+    except Exception as e:
+        error = str(e)
+        print(f"[{_now_str()}] Erreur inattendue pendant l'analyse de la bibliothèque : {e}")
+    finally:
+        with _state_lock:
+            _status["running"] = False
+            _status["last_run_finished"] = time.time()
+            _status["last_error"] = error
+            _status["last_result"] = result
+            _status["last_trigger"] = trigger
+        _run_lock.release()
+
+def trigger_library_scan(trigger="manuel", full=False):
+    """Lance une analyse en arrière-plan. Renvoie False si une analyse est déjà en cours."""
+    if not _run_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_run_scan, args=(trigger, full), daemon=True).start()
+    return True
+
+def _scheduler_loop():
+    time.sleep(LIBRARY_SCAN_INITIAL_DELAY_SECONDS)
+    while True:
+        if _run_lock.acquire(blocking=False):
+            _run_scan("planificateur")
+        time.sleep(LIBRARY_SCAN_INTERVAL_MINUTES * 60)
+
+def start_library_scanner():
+    """Démarre l'analyse périodique de la bibliothèque (une seule fois par processus)."""
+    global _scheduler_thread
+    if LIBRARY_SCAN_INTERVAL_MINUTES <= 0:
+        print("Analyse périodique de la bibliothèque désactivée (LIBRARY_SCAN_INTERVAL_MINUTES <= 0).")
+        return
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, daemon=True)
+    _scheduler_thread.start()
+    print(f"L'analyse périodique de la bibliothèque a été démarrée (intervalle : {LIBRARY_SCAN_INTERVAL_MINUTES} min).")
+
+def get_library_scan_status():
+    with _state_lock:
+        status = dict(_status)
+    for key in ("last_run_started", "last_run_finished"):
+        if status[key] is not None:
+            status[key] = datetime.fromtimestamp(status[key]).isoformat(timespec='seconds')
+    status["interval_minutes"] = LIBRARY_SCAN_INTERVAL_MINUTES
+    return status
@@ -0,0 +1,155 @@
+# metrics.py
+#
+# Métriques au format texte Prometheus (exposition 0.0.4), sans dépendance supplémentaire.
+
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+_registry = []
+_collectors = []
+_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def values(self):
+        """Copie des valeurs par tuple de labels (histogrammes : (compteurs par seuil, somme))."""
+        with _lock:
+            return dict(self._values)
+
+    def _samples(self):
+        with _lock:
+            return [(self.name, key, value, None) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value, extra in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, values):
+        """Remplace toutes les séries : values est {tuple de labels: valeur} (jauges calculées à la collecte)."""
+        with _lock:
+            self._values = dict(values)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = [c + 1 if value <= bound else c for c, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with _lock:
+            items = list(self._values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, count, [("le", _format_value(bound))]))
+            samples.append((f"{self.name}_sum", key, total, None))
+            samples.append((f"{self.name}_count", key, counts[-1], None))
+        return samples
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+def register_collector(collector):
+    """Fonction appelée avant chaque rendu, pour les jauges calculées à partir de l'état courant."""
+    with _lock:
+        _collectors.append(collector)
+
+def render():
+    with _lock:
+        collectors = list(_collectors)
+        registry = list(_registry)
+    for collector in collectors:
+        try:
+            collector()
+        except Exception as e:
+            print(f"Erreur lors de la collecte des métriques : {e}")
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Métriques de l'application ---
+QUEUE_JOBS = Gauge("vod_queue_jobs", "Tâches dans la file d'attente par type et par état.", ("item_type", "status"))
+ACTIVE_TRANSFERS = Gauge("vod_active_transfers", "Transferts wget en cours.")
+DOWNLOADED_BYTES = Counter("vod_downloaded_bytes_total", "Octets écrits dans les fichiers .part.", ("item_type",))
+THROUGHPUT = Gauge("vod_download_throughput_bytes_per_second", "Débit du transfert en cours (moyenne sur quelques secondes).")
+JOB_DURATION = Histogram("vod_job_stage_duration_seconds", "Durée des étapes d'une tâche (download, verify, move).",
+                         ("item_type", "stage"), buckets=JOB_DURATION_BUCKETS)
+JOBS_COMPLETED = Counter("vod_jobs_completed_total", "Tâches terminées et déplacées dans la bibliothèque.", ("item_type",))
+JOB_RETRIES = Counter("vod_job_retries_total", "Nouvelles tentatives programmées, par cause.", ("reason",))
+JOB_FAILURES = Counter("vod_job_failures_total", "Tâches abandonnées après RETRY_COUNT tentatives, par cause.", ("reason",))
+STALLS = Counter("vod_transfer_stalls_total", "Transferts bloqués détectés par le chien de garde.", ("resumed",))
+DISK_HOLDS = Counter("vod_disk_space_holds_total", "Démarrages refusés faute d'espace disque.")
+REMOTE_LEASES = Counter("vod_remote_leases_total", "Baux des nœuds distants (granted, completed, failed, expired).", ("event",))
+UPSTREAM_LATENCY = Histogram("vod_upstream_request_duration_seconds", "Durée des requêtes vers Xtream et TMDB.",
+                             ("service", "endpoint", "outcome"))
+UPSTREAM_BREAKER_STATE = Gauge("vod_upstream_breaker_state", "État des disjoncteurs Xtream/TMDB (0 fermé, 1 appel d'essai, 2 ouvert).",
+                               ("service", "endpoint"))
+CACHE_REQUESTS = Counter("vod_cache_requests_total", "Accès aux caches (catalogue, détails de série, TMDB).", ("cache", "result"))
@@ -0,0 +1,126 @@
+# monitor_scheduler.py
+
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from episode_monitor import monitor_new_episodes
+
+# --- Configuration du planificateur ---
+# Intervalle entre deux vérifications automatiques (0 pour désactiver le planificateur intégré)
+MONITOR_INTERVAL_MINUTES = float(os.getenv("MONITOR_INTERVAL_MINUTES", 60))
+# Décalage aléatoire ajouté à chaque intervalle pour ne pas solliciter le fournisseur à heure fixe
+MONITOR_JITTER_SECONDS = float(os.getenv("MONITOR_JITTER_SECONDS", 120))
+# Délai avant la première vérification après le démarrage
+MONITOR_INITIAL_DELAY_SECONDS = float(os.getenv("MONITOR_INITIAL_DELAY_SECONDS", 60))
+
+# --- État partagé ---
+# Un seul passage de monitor_new_episodes à la fois : les déclenchements concurrents
+# (bouton manuel, webhook, planificateur) sont rattachés au passage en cours.
+_run_lock = threading.Lock()
+_state_lock = threading.Lock()
+_scheduler_thread = None
+
+_status = {
+    "running": False,
+    "current_trigger": None,
+    "last_run_started": None,
+    "last_run_finished": None,
+    "last_run_duration_seconds": None,
+    "last_run_trigger": None,
+    "last_error": None,
+    "next_run": None,
+    "runs": 0,
+    "coalesced_triggers": 0,
+}
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _compute_next_run(delay_seconds):
+    jitter = random.uniform(0, MONITOR_JITTER_SECONDS) if MONITOR_JITTER_SECONDS > 0 else 0
+    return time.time() + delay_seconds + jitter
+
+def _run_pass(trigger):
+    """Exécute un passage de surveillance. Le verrou _run_lock doit être détenu par l'appelant."""
+    started = time.time()
+    with _state_lock:
+        _status["running"] = True
+        _status["current_trigger"] = trigger
+        _status["last_run_started"] = started
+    print(f"[{_now_str()}] Passage de surveillance démarré (déclencheur : {trigger}).")
+    error = None
+    try:
+        monitor_new_episodes()
+    except Exception as e:
+        error = str(e)
+        print(f"[{_now_str()}] Erreur inattendue pendant la surveillance des épisodes : {e}")
+    finally:
+        finished = time.time()
+        with _state_lock:
+            _status["running"] = False
+            _status["current_trigger"] = None
+            _status["last_run_finished"] = finished
+            _status["last_run_duration_seconds"] = round(finished - started, 2)
+            _status["last_run_trigger"] = trigger
+            _status["last_error"] = error
+            _status["runs"] += 1
+        _run_lock.release()
+        print(f"[{_now_str()}] Passage de surveillance terminé en {finished - started:.1f}s.")
+
+def trigger_monitor_run(trigger="manuel"):
+    """Lance un passage de surveillance en arrière-plan.
+
+    Renvoie True si un nouveau passage a démarré, False si un passage était déjà en cours
+    (le déclenchement est alors rattaché au passage existant).
+    """
+    if not _run_lock.acquire(blocking=False):
+        with _state_lock:
+            _status["coalesced_triggers"] += 1
+        print(f"[{_now_str()}] Surveillance déjà en cours, déclenchement '{trigger}' rattaché au passage actuel.")
+        return False
+    thread = threading.Thread(target=_run_pass, args=(trigger,), daemon=True)
+    thread.start()
+    return True
+
+def _scheduler_loop():
+    interval_seconds = MONITOR_INTERVAL_MINUTES * 60
+    with _state_lock:
+        _status["next_run"] = _compute_next_run(MONITOR_INITIAL_DELAY_SECONDS)
+    while True:
+        with _state_lock:
+            wait_seconds = max(0, _status["next_run"] - time.time())
+        time.sleep(wait_seconds)
+        if _run_lock.acquire(blocking=False):
+            _run_pass("planificateur")
+        else:
+            with _state_lock:
+                _status["coalesced_triggers"] += 1
+        with _state_lock:
+            _status["next_run"] = _compute_next_run(interval_seconds)
+
+def start_monitor_scheduler():
+    """Démarre le planificateur intégré (une seule fois par processus)."""
+    global _scheduler_thread
+    if MONITOR_INTERVAL_MINUTES <= 0:
+        print("Planificateur de surveillance désactivé (MONITOR_INTERVAL_MINUTES <= 0).")
+        return
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, daemon=True)
+    _scheduler_thread.start()
+    print(f"Le planificateur de surveillance a été démarré (intervalle : {MONITOR_INTERVAL_MINUTES} min, jitter : {MONITOR_JITTER_SECONDS}s).")
+
+def get_monitor_status():
+    """Renvoie l'état du planificateur et du dernier passage (dates au format ISO)."""
+    with _state_lock:
+        status = dict(_status)
+    for key in ("last_run_started", "last_run_finished", "next_run"):
+        if status[key] is not None:
+            status[key] = datetime.fromtimestamp(status[key]).isoformat(timespec='seconds')
+    status["scheduler_enabled"] = MONITOR_INTERVAL_MINUTES > 0
+    status["interval_minutes"] = MONITOR_INTERVAL_MINUTES
+    status["jitter_seconds"] = MONITOR_JITTER_SECONDS
+    return status
@@ -0,0 +1,47 @@
+# nfo_writer.py
+
+import os
+
+TMDB_IMAGE_URL = "https://image.tmdb.org/t/p/original"
+
+def movie_nfo(metadata):
+    """Contenu NFO (Kodi/Plex) d'un film à partir des métadonnées TMDB /movie/{id}."""
+    return f"""
+<movie>
+  <title>{metadata['title']}</title>
+  <originaltitle>{metadata['original_title']}</originaltitle>
+  <plot>{metadata['overview']}</plot>
+  <tagline>{metadata['tagline']}</tagline>
+  <runtime>{metadata['runtime']}</runtime>
+  <year>{metadata['release_date'].split('-')[0]}</year>
+  <rating>{metadata['vote_average']}</rating>
+  <country>{', '.join([c['name'] for c in metadata['production_countries']])}</country>
+  <director>{', '.join([c['name'] for c in metadata.get('credits', {}).get('crew', []) if c['job'] == 'Director'])}</director>
+  <writer>{', '.join([c['name'] for c in metadata.get('credits', {}).get('crew', []) if c['job'] == 'Screenplay'])}</writer>
+  <genre>{', '.join([g['name'] for g in metadata['genres']])}</genre>
+  <premiered>{metadata['release_date']}</premiered>
+  <releasedate>{metadata['release_date']}</releasedate>
+  <thumb>{TMDB_IMAGE_URL + metadata['poster_path'] if metadata.get('poster_path') else ''}</thumb>
+</movie>
+"""
+
+def episode_nfo(metadata, season, episode):
+    """Contenu NFO d'un épisode à partir des métadonnées TMDB de l'épisode."""
+    return f"""
+<episodedetails>
+  <title>{metadata['name']}</title>
+  <season>{season}</season>
+  <episode>{episode}</episode>
+  <plot>{metadata['overview']}</plot>
+  <aired>{metadata['air_date']}</aired>
+  <thumb>{TMDB_IMAGE_URL + metadata['still_path'] if metadata.get('still_path') else ''}</thumb>
+</episodedetails>
+"""
+
+def write_nfo(folder_path, file_name_nfo, content):
+    """Écrit le fichier NFO dans le dossier du média et renvoie son chemin."""
+    os.makedirs(folder_path, exist_ok=True)
+    file_path = os.path.join(folder_path, file_name_nfo)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content.strip())
+    return file_path
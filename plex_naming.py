@@ -0,0 +1,102 @@
+# plex_naming.py
+
+import os
+import re
+from datetime import datetime
+
+# --- Configuration ---
+XTREAM_HOST = os.getenv("XTREAM_HOST")
+XTREAM_PORT = os.getenv("XTREAM_PORT")
+XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
+XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
+DOWNLOAD_PATH_SERIES = os.getenv("DOWNLOAD_PATH_SERIES", "/downloads/Seriale")
+
+# Préfixes de langue/plateforme ajoutés par le fournisseur devant les noms ("PL - ", "EN - ", "A+ - ", "D+ - ")
+PREFIX_PATTERN = r"^(?:[pP][lL]|[eE][nN]|[aA]\+|[dD]\+)\s*-\s*"
+EPISODE_PREFIX_PATTERN = r"^(?:[pP][lL]|[nN][fF]|[hH][bB][oO]|\[\s*[pP][lL]\s*\]|\[\s*[nN][fF]\s*\]|\s*\[\s*\d{4}[pP]\s*\])\s*-\s*"
+
+# --- Fonction d'assistance sanitize_filename ---
+def sanitize_filename(name):
+    """Supprime les caractères non valides du nom de fichier/dossier pour assurer la compatibilité."""
+    s = re.sub(r'[^\w\s\-\._()]', '', name)
+    s = re.sub(r'\s+', ' ', s).strip()
+    return s
+
+def clean_name(name_raw):
+    """Retire le préfixe de langue/plateforme du nom fourni par Xtream."""
+    return re.sub(PREFIX_PATTERN, "", name_raw).strip()
+
+def release_year(release_date_str):
+    """Renvoie l'année ('2021') d'une date Xtream/TMDB, ou '' si elle est absente ou illisible."""
+    if not release_date_str:
+        return ''
+    try:
+        return str(datetime.strptime(release_date_str, '%Y-%m-%d').year)
+    except ValueError:
+        if release_date_str.strip()[:4].isdigit():
+            return release_date_str.strip()[:4]
+    return ''
+
+def folder_name(name_cleaned, year):
+    """Nom de dossier Plex : 'Titre (Année)' ou 'Titre' si l'année est inconnue."""
+    if year:
+        return sanitize_filename(f"{name_cleaned} ({year})")
+    return sanitize_filename(name_cleaned)
+
+def series_folder_name(series_info):
+    """Nom du dossier de la série à partir du bloc 'info' de get_series_info."""
+    name_cleaned = clean_name(series_info.get('name', ''))
+    return folder_name(name_cleaned, release_year(series_info.get('releaseDate', '')))
+
+def clean_episode_title(title, series_name_cleaned, episode_num):
+    """Retire du titre d'épisode les préfixes, le nom de la série, SxxEyy et la résolution."""
+    cleaned_episode_title = re.sub(EPISODE_PREFIX_PATTERN, "", title).strip()
+
+    pattern_to_remove_series_info = r"^(?:" + re.escape(series_name_cleaned) + r"(?:\s*\(\d+K\))?|\s*\d+K)?\s*-\s*S\d{2}E\d{2}\s*[\s-]*"
+    cleaned_episode_title = re.sub(pattern_to_remove_series_info, "", cleaned_episode_title, flags=re.IGNORECASE).strip()
+
+    cleaned_episode_title = re.sub(r"\s*\(\d+K\)\s*|\s*\d+K\s*|\s*\d{3,4}p\s*", "", cleaned_episode_title, flags=re.IGNORECASE).strip()
+
+    if not cleaned_episode_title:
+        cleaned_episode_title = f"Épisode {int(episode_num):02d}"
+    return sanitize_filename(cleaned_episode_title)
+
+def season_path(series_folder, season):
+    return os.path.join(DOWNLOAD_PATH_SERIES, series_folder, f"Season {int(season):02d}")
+
+def episode_base_name(series_folder, season, episode_num, episode_title_sanitized):
+    """Nom de fichier Plex sans extension : 'Série (Année) - S01E02 - Titre'."""
+    return f"{series_folder} - S{int(season):02d}E{int(episode_num):02d} - {episode_title_sanitized}"
+
+def build_episode_job(series_id, series_info, episode, season, ext=None):
+    """Construit la tâche de téléchargement d'un épisode au format Plex.
+
+    series_info : bloc 'info' de get_series_info ; episode : entrée d'épisode Xtream
+    (id, episode_num, title, container_extension). ext remplace l'extension du fournisseur.
+    """
+    episode_id = episode['id']
+    episode_num = episode['episode_num']
+    title = episode.get('title') or f"Épisode {int(episode_num):02d}"
+    ext = ext or episode.get("container_extension") or "mp4"
+
+    series_folder = series_folder_name(series_info)
+    path = season_path(series_folder, season)
+    os.makedirs(path, exist_ok=True)
+
+    episode_title_sanitized = clean_episode_title(title, clean_name(series_info.get('name', '')), episode_num)
+    file_name = f"{episode_base_name(series_folder, season, episode_num, episode_title_sanitized)}.{ext}"
+    file_path = os.path.join(path, file_name)
+
+    url = f"{XTREAM_HOST}:{XTREAM_PORT}/series/{XTREAM_USERNAME}/{XTREAM_PASSWORD}/{episode_id}.{ext}"
+
+    return {
+        "cmd": ["wget", "-O", file_path, url],
+        "file": file_name,
+        "item_id": episode_id, # Nous utilisons un item_id générique
+        "item_type": "serial_episode", # Nous ajoutons le type d'élément
+        "series": series_folder,
+        "series_id": str(series_id),
+        "season": int(season),
+        "episode_num": int(episode_num),
+        "title": title
+    }
@@ -0,0 +1,108 @@
+# post_process.py
+#
+# Vérification des fichiers téléchargés. Les fonctions de ce module sont exécutées dans un pool de
+# processus (voir downloader_core.py) : elles ne doivent dépendre d'aucun état de l'application.
+
+import os
+import json
+import hashlib
+import shutil
+import subprocess
+
+# --- Configuration ---
+# Contrôle du fichier par ffprobe (durée lisible) ; ignoré si ffprobe n'est pas installé
+POSTPROCESS_FFPROBE = os.getenv("POSTPROCESS_FFPROBE", "1") == "1"
+# Conteneur cible du remux sans réencodage ("mkv" ou "mp4"), vide pour garder le fichier tel quel
+POSTPROCESS_REMUX_TO = os.getenv("POSTPROCESS_REMUX_TO", "").lower().lstrip('.')
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", 2))
+FFPROBE_TIMEOUT_SECONDS = 120
+REMUX_TIMEOUT_SECONDS = 3600
+
+REMUX_FORMATS = {'mkv': 'matroska', 'mp4': 'mp4'}
+# Début des pages d'erreur que le fournisseur renvoie parfois avec un statut 200
+HTML_SIGNATURES = (b'<!doctype', b'<html', b'<?xml', b'{"')
+
+def _looks_like_html(path):
+    with open(path, 'rb') as f:
+        head = f.read(512).lstrip().lower()
+    return head.startswith(HTML_SIGNATURES)
+
+def _probe_duration(path):
+    """Durée en secondes lue par ffprobe, ou None si le fichier n'est pas lisible."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFPROBE_TIMEOUT_SECONDS, universal_newlines=True
+    )
+    if result.returncode != 0:
+        return None
+    try:
+        return float(json.loads(result.stdout)["format"]["duration"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _remux(path, target_ext):
+    """Remux sans réencodage vers target_ext. Renvoie le chemin du nouveau .part."""
+    base = path[:-len('.part')] if path.endswith('.part') else path
+    output = f"{os.path.splitext(base)[0]}.{target_ext}.part"
+    tmp_output = f"{output}.tmp"
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", path, "-map", "0", "-c", "copy", "-f", REMUX_FORMATS[target_ext], tmp_output],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=REMUX_TIMEOUT_SECONDS, universal_newlines=True
+    )
+    if result.returncode != 0:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise RuntimeError(f"remux vers {target_ext} impossible : {result.stderr.strip()[-300:]}")
+    os.replace(tmp_output, output)
+    if os.path.abspath(output) != os.path.abspath(path):
+        os.remove(path)
+    return output
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def verify_download(path, expected_size=None, current_ext=None):
+    """Vérifie (et remuxe éventuellement) un fichier téléchargé.
+
+    Renvoie {"ok": bool, "reason": str|None, "resumable": bool, "path": str, "ext": str|None, "sha256": str|None}.
+    "resumable" indique qu'un fichier incomplet mais sain peut être repris (wget -c) plutôt que supprimé ;
+    "sha256" n'est renseigné qu'après un remux (l'empreinte calculée pendant le téléchargement ne vaut plus).
+    """
+    result = {"ok": False, "reason": None, "resumable": False, "path": path, "ext": None, "sha256": None}
+    try:
+        size = os.path.getsize(path)
+    except OSError as e:
+        result["reason"] = f"fichier introuvable : {e}"
+        return result
+    if size == 0:
+        result["reason"] = "fichier vide"
+        return result
+    if expected_size and size != expected_size:
+        result["reason"] = f"taille incorrecte : {size} octets sur disque, {expected_size} annoncés (Content-Length)"
+        result["resumable"] = size < expected_size
+        return result
+    if _looks_like_html(path):
+        result["reason"] = "le fournisseur a renvoyé une page d'erreur au lieu de la vidéo"
+        return result
+    if POSTPROCESS_FFPROBE and shutil.which("ffprobe"):
+        try:
+            duration = _probe_duration(path)
+        except subprocess.TimeoutExpired:
+            duration = None
+        if not duration or duration <= 0:
+            result["reason"] = "ffprobe ne trouve aucune durée lisible"
+            return result
+    if POSTPROCESS_REMUX_TO in REMUX_FORMATS and POSTPROCESS_REMUX_TO != (current_ext or '').lower() and shutil.which("ffmpeg"):
+        try:
+            result["path"] = _remux(path, POSTPROCESS_REMUX_TO)
+            result["ext"] = POSTPROCESS_REMUX_TO
+            result["sha256"] = _file_sha256(result["path"])
+        except (RuntimeError, subprocess.TimeoutExpired, OSError) as e:
+            result["reason"] = str(e)
+            return result
+    result["ok"] = True
+    return result
@@ -0,0 +1,182 @@
+# remote_worker.py
+#
+# Nœud de téléchargement distant : prend des tâches au démon de téléchargement (download_daemon.py)
+# par baux (job_leases.py), les télécharge avec wget -c, renvoie sa progression à chaque renouvellement
+# du bail, vérifie le fichier puis le place à destination sur ses propres volumes.
+#
+#   DOWNLOAD_DAEMON_URL=http://192.168.1.10:5055 WORKER_PATH_MAP="/downloads=/mnt/nas/downloads" python remote_worker.py
+#
+# Plusieurs nœuds (ou plusieurs processus sur la même machine) peuvent tourner en même temps.
+
+import os
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from post_process import verify_download
+from transfer_monitor import TransferMonitor, wget_failure_kind
+
+# --- Configuration ---
+DOWNLOAD_DAEMON_URL = os.getenv("DOWNLOAD_DAEMON_URL", "").rstrip('/')
+DOWNLOAD_DAEMON_TOKEN = os.getenv("DOWNLOAD_DAEMON_TOKEN", "")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Correspondance des chemins du démon vers ceux de ce nœud : "/downloads=/mnt/nas/downloads;/autre=/local"
+WORKER_PATH_MAP = [tuple(pair.split("=", 1)) for pair in os.getenv("WORKER_PATH_MAP", "").split(";") if "=" in pair]
+# Attente entre deux demandes quand la file est vide
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", 10))
+STALL_TIMEOUT_SECONDS = float(os.getenv("STALL_TIMEOUT_SECONDS", 120))
+STALL_MAX_RESUMES = int(os.getenv("STALL_MAX_RESUMES", 3))
+REQUEST_TIMEOUT_SECONDS = 15
+
+_session = requests.Session()
+if DOWNLOAD_DAEMON_TOKEN:
+    _session.headers["X-Daemon-Token"] = DOWNLOAD_DAEMON_TOKEN
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _post(path, body=None):
+    return _session.post(f"{DOWNLOAD_DAEMON_URL}{path}", json=body or {}, timeout=REQUEST_TIMEOUT_SECONDS)
+
+def map_path(path):
+    for source, target in WORKER_PATH_MAP:
+        if path == source or path.startswith(source.rstrip('/') + '/'):
+            return target.rstrip('/') + path[len(source.rstrip('/')):]
+    return path
+
+def _kill(process):
+    if process is not None and process.poll() is None:
+        process.kill()
+
+def _report(lease_id, outcome, body, transfer):
+    """Envoie la fin (complete) ou l'échec (fail) d'un bail, avec quelques nouvelles tentatives réseau.
+
+    transfer : octets reçus et durée du transfert de cette tentative (historique du démon, job_history.py).
+    """
+    for attempt in range(5):
+        try:
+            response = _post(f"/leases/{lease_id}/{outcome}", dict(body, stats=transfer))
+            if response.status_code == 410:
+                print(f"[{_now_str()}] Bail {lease_id} expiré avant le compte rendu : la tâche a été remise dans la file.")
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"[{_now_str()}] Compte rendu impossible ({e}), nouvel essai dans {2 ** attempt}s.")
+            time.sleep(2 ** attempt)
+
+def _heartbeat_loop(lease, monitor, size, stop, lost, current):
+    interval = max(1.0, lease["ttl_seconds"] / 3)
+    while not stop.wait(interval):
+        progress = {"bytes": monitor.offset, "received": monitor.received, "size": size,
+                    "rate": round(monitor.rate, 1), "stage": current.get("stage")}
+        try:
+            response = _post(f"/leases/{lease['lease_id']}/heartbeat", {"progress": progress})
+        except requests.exceptions.RequestException as e:
+            print(f"[{_now_str()}] Renouvellement du bail impossible : {e}")
+            continue
+        if response.status_code == 410:
+            # Bail expiré (coupure réseau trop longue) : la tâche a déjà été confiée à un autre worker
+            lost.set()
+            _kill(current.get("process"))
+            return
+
+def run_lease(lease):
+    job = lease["job"]
+    lease_id = lease["lease_id"]
+    cmd = job.get("cmd")
+    if not isinstance(cmd, list) or len(cmd) != 4 or cmd[0] != "wget" or cmd[1] != "-O":
+        # Le démon ne confie que des commandes wget : toute autre commande est refusée sans être exécutée
+        _report(lease_id, "fail", {"reason": "commande de téléchargement refusée (wget -O attendu)", "kind": "io"}, {})
+        return
+    destination = map_path(job["cmd"][2])
+    part_path = f"{destination}.part"
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # Même commande que le worker local : wget -c vers le .part
+    download_cmd = list(job["cmd"])
+    download_cmd[2] = part_path
+    download_cmd.insert(1, "-c")
+    print(f"[{_now_str()}] Début du téléchargement {job.get('title')} (ID: {job.get('item_id')}) vers {destination}")
+
+    current = {"stage": "downloading"}
+    monitor = TransferMonitor(part_path, stall_timeout=STALL_TIMEOUT_SECONDS, on_stall=lambda: _kill(current.get("process")))
+    stop, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(lease, monitor, job.get("size_bytes"), stop, lost, current), daemon=True)
+    heartbeat.start()
+    transfer = {}
+    started = time.time()
+    try:
+        resumes = 0
+        stalled = None
+        monitor.start()
+        try:
+            while True:
+                process = subprocess.Popen(download_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+                current["process"] = process
+                _, errors = process.communicate()
+                if lost.is_set() or process.returncode == 0 or not monitor.consume_stall():
+                    break
+                if resumes >= STALL_MAX_RESUMES:
+                    stalled = f"transfert bloqué : aucune donnée reçue pendant {STALL_TIMEOUT_SECONDS:g}s ({resumes} reprise(s))"
+                    break
+                resumes += 1
+                print(f"[{_now_str()}] Transfert bloqué, reprise {resumes}/{STALL_MAX_RESUMES}.")
+        finally:
+            # Toujours arrêter le suivi, même si wget n'a pas pu être lancé (OSError)
+            sha256, _ = monitor.finish()
+            transfer.update(received=monitor.received, download_seconds=round(time.time() - started, 1))
+        if lost.is_set():
+            print(f"[{_now_str()}] Bail perdu pour l'ID {job.get('item_id')} : téléchargement abandonné.")
+            return
+        if stalled:
+            _report(lease_id, "fail", {"reason": stalled, "kind": "stall"}, transfer)
+            return
+        if process.returncode != 0:
+            _report(lease_id, "fail", {"reason": f"wget a échoué (code {process.returncode}) : {errors.strip()[-300:]}",
+                                       "kind": wget_failure_kind(process.returncode, errors[-2000:])}, transfer)
+            return
+
+        current["stage"] = "verifying"
+        ext = os.path.splitext(destination)[1].lstrip('.')
+        result = verify_download(part_path, job.get("size_bytes"), ext)
+        if not result["ok"]:
+            if not result["resumable"] and os.path.exists(part_path):
+                os.remove(part_path)
+            _report(lease_id, "fail", {"reason": result["reason"], "kind": "verification"}, transfer)
+            return
+        if result["ext"]:
+            destination = f"{os.path.splitext(destination)[0]}.{result['ext']}"
+            sha256 = result["sha256"]
+        os.replace(result["path"], destination)
+        _report(lease_id, "complete", {"sha256": sha256, "size": os.path.getsize(destination), "ext": result["ext"]}, transfer)
+        print(f"[{_now_str()}] Téléchargement terminé : {destination}")
+    except OSError as e:
+        _report(lease_id, "fail", {"reason": str(e), "kind": "io"}, transfer)
+    finally:
+        stop.set()
+
+def main():
+    if not DOWNLOAD_DAEMON_URL:
+        raise SystemExit("DOWNLOAD_DAEMON_URL doit indiquer l'adresse du démon de téléchargement.")
+    print(f"[{_now_str()}] Nœud {WORKER_ID} connecté à {DOWNLOAD_DAEMON_URL}.")
+    while True:
+        try:
+            response = _post("/leases", {"worker_id": WORKER_ID})
+        except requests.exceptions.RequestException as e:
+            print(f"[{_now_str()}] Démon injoignable : {e}")
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        if response.status_code != 200:
+            if response.status_code != 204:
+                print(f"[{_now_str()}] Réponse inattendue du démon : statut {response.status_code}")
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        run_lease(response.json())
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,171 @@
+# request_timing.py
+#
+# Durée de chaque requête HTTP découpée en phases (appels Xtream/TMDB, filtrage, rendu Jinja),
+# journal des requêtes lentes et profilage à la demande d'une seule requête.
+
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+
+# --- Configuration ---
+# Au-delà de ce seuil (en millisecondes), la requête est inscrite dans SLOW_REQUEST_LOG
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 1000))
+SLOW_REQUEST_LOG = "slow_requests.jsonl"
+# Profilage sur demande (en-tête X-Profile ou paramètre ?_profile= valant "cpu" ou "memory")
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_ENTRIES = 40
+TRACEMALLOC_FRAMES = 25
+
+# Dernières requêtes lentes (consultables sans relire le fichier)
+slow_requests = deque(maxlen=200)
+# Un seul profil à la fois : cProfile et tracemalloc sont globaux au processus
+_profile_lock = threading.Lock()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def record_phase(name, seconds):
+    """Ajoute une durée à la phase name de la requête en cours (sans effet hors requête, par ex. dans les workers)."""
+    if not has_request_context():
+        return
+    phases = g.get("timing_phases")
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+# --- Profilage ---
+def _requested_profile():
+    mode = (request.headers.get("X-Profile") or request.args.get("_profile") or "").lower()
+    return mode if mode in ("cpu", "memory") else None
+
+def _start_profile(mode):
+    if not _profile_lock.acquire(blocking=False):
+        print(f"[{_now_str()}] Profilage ignoré pour {request.path} : un autre profil est déjà en cours.")
+        return
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        g.profile = {"mode": mode, "profiler": profiler}
+    else:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        g.profile = {"mode": mode, "snapshot": tracemalloc.take_snapshot(), "started_tracing": started_tracing}
+
+def _stop_profile():
+    """Arrête le profil de la requête en cours et l'écrit dans PROFILE_DIR. Renvoie le nom du fichier texte."""
+    profile = g.pop("profile", None)
+    if not profile:
+        return None
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        endpoint = (request.endpoint or "unknown").replace('.', '_')
+        base = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{endpoint}_{profile['mode']}")
+        if profile["mode"] == "cpu":
+            profiler = profile["profiler"]
+            profiler.disable()
+            profiler.dump_stats(f"{base}.prof")
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_ENTRIES)
+            report = output.getvalue()
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            if profile["started_tracing"]:
+                tracemalloc.stop()
+            stats = snapshot.compare_to(profile["snapshot"], "lineno")
+            report = "\n".join(str(stat) for stat in stats[:PROFILE_TOP_ENTRIES])
+        with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+            f.write(f"{request.method} {request.full_path}\n\n{report}")
+        print(f"[{_now_str()}] Profil {profile['mode']} de {request.path} enregistré dans {base}.txt")
+        return os.path.basename(f"{base}.txt")
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du profil : {e}")
+        return None
+    finally:
+        _profile_lock.release()
+
+# --- Hooks Flask ---
+def _before_request():
+    g.timing_started = time.perf_counter()
+    g.timing_phases = {}
+    if PROFILING_ENABLED:
+        mode = _requested_profile()
+        if mode:
+            _start_profile(mode)
+
+def _on_before_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def _on_template_rendered(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        record_phase("render", time.perf_counter() - started)
+
+def _log_slow_request(response, total_ms, phases_ms):
+    entry = {
+        "time": datetime.now().isoformat(timespec='seconds'),
+        "method": request.method,
+        "path": request.full_path.rstrip('?'),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "total_ms": total_ms,
+        "phases_ms": phases_ms,
+    }
+    slow_requests.append(entry)
+    print(f"[{_now_str()}] Requête lente ({total_ms:.0f} ms) : {entry['method']} {entry['path']} {phases_ms}")
+    try:
+        with open(SLOW_REQUEST_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {SLOW_REQUEST_LOG}: {e}")
+
+def _after_request(response):
+    started = g.get("timing_started")
+    if started is None:
+        return response
+    profile_file = _stop_profile()
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    phases_ms = {name: round(seconds * 1000, 1) for name, seconds in g.get("timing_phases", {}).items()}
+    # Le reste : code de la vue hors appels externes, filtrage et rendu
+    phases_ms["other"] = round(max(0.0, total_ms - sum(phases_ms.values())), 1)
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{name};dur={ms}" for name, ms in phases_ms.items()] + [f"total;dur={total_ms}"]
+    )
+    if profile_file:
+        response.headers["X-Profile-File"] = profile_file
+    if total_ms >= SLOW_REQUEST_MS:
+        _log_slow_request(response, total_ms, phases_ms)
+    return response
+
+def _teardown_request(exc):
+    # Vue en erreur : after_request n'a pas été appelée, le profileur doit quand même être arrêté
+    if g.get("profile"):
+        _stop_profile()
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_template_rendered, app)
+
+def get_slow_requests():
+    return list(slow_requests)
@@ -1,6 +1,6 @@
 # seriale.py (modifié)
 
-from flask import Blueprint, request, jsonify, render_template, send_file
+from flask import Blueprint, request, jsonify, render_template, send_file, abort
 import os
 import requests
 import subprocess
@@ -12,17 +12,35 @@ import threading
 import time
 from datetime import datetime
 
-from episode_monitor import monitor_new_episodes 
-
-# Importer les composants communs du fichier nouvellement créé
-from downloader_core import (
+from episode_monitor import get_favorite_rule, save_favorite_rule
+
+# File d'attente, surveillance, analyse et travaux NFO en masse : locaux ou via le démon de téléchargement (DOWNLOAD_DAEMON_URL)
+from download_client import (
+    start_series_nfo_job,
+    start_library_nfo_job,
+    get_bulk_job,
+    list_bulk_jobs,
+    trigger_monitor_run,
+    get_monitor_status,
+    trigger_library_scan,
+    get_library_scan_status,
     add_to_download_queue,
     get_queue_status,
     get_full_queue_data,
     remove_from_queue,
     reorder_queue,
-    get_completed_items
+    get_completed_items,
+    get_held_jobs,
+    get_stall_events,
+    get_leases,
+    retry_job
 )
+import tmdb_cache
+import xtream_api
+from plex_naming import build_episode_job, clean_name, series_folder_name
+from artwork import queue_series_artwork
+from request_timing import phase
+from bulk_nfo import write_episode_nfo
 
 seriale_bp = Blueprint('seriale', __name__, url_prefix='/seriale')
 
@@ -33,10 +51,10 @@ XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
 XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
 DOWNLOAD_PATH_SERIES = os.getenv("DOWNLOAD_PATH_SERIES", "/downloads/Seriale")
 RETRY_COUNT = int(os.getenv("RETRY_COUNT", 3)) # Plus utilisé directement, mais laissé pour la cohérence
-TMDB_API_KEY = "cfdfac787bf2a6e2c521b93a0309ff2c"
 BASE_API = f"{XTREAM_HOST}:{XTREAM_PORT}/player_api.php?username={XTREAM_USERNAME}&password={XTREAM_PASSWORD}"
 FAVORITES_FILE = "favorites.json"
 MONITORED_STATE_FILE = "monitored_series_state.json"
+WEBHOOK_API_KEY = os.getenv("WEBHOOK_API_KEY")
 
 # --- Fonction d'assistance sanitize_filename ---
 def sanitize_filename(name):
@@ -47,13 +65,10 @@ def sanitize_filename(name):
 
 @seriale_bp.route("/check_new_episodes_manual", methods=["POST"])
 def check_new_episodes_manual():
-    # Exécuter la fonction monitor_new_episodes dans un thread séparé
-    # Cela empêchera la requête HTTP de se bloquer pendant l'exécution du script
-    thread = threading.Thread(target=monitor_new_episodes)
-    thread.daemon = True # Définir le thread comme daemon pour qu'il se termine avec le programme principal
-    thread.start()
-    
-    return jsonify({"message": "La recherche de nouveaux épisodes a commencé en arrière-plan. Les notifications apparaîtront sur Discord."}), 202 # 202 Accepted
+    # Exécuter la surveillance en arrière-plan ; si un passage est déjà en cours, la demande y est rattachée
+    if trigger_monitor_run("manuel"):
+        return jsonify({"message": "La recherche de nouveaux épisodes a commencé en arrière-plan. Les notifications apparaîtront sur Discord."}), 202 # 202 Accepted
+    return jsonify({"message": "Une recherche de nouveaux épisodes est déjà en cours. Les notifications apparaîtront sur Discord.", "coalesced": True}), 202
 
 @seriale_bp.route("/webhook/check_new_episodes", methods=["POST"])
 def check_new_episodes_webhook():
@@ -68,15 +83,30 @@ def check_new_episodes_webhook():
         print(f"Requête non autorisée au webhook. Tentative d'utilisation de la clé : {provided_api_key}")
         abort(401) # Accès non autorisé
     
-    # Exécuter la fonction monitor_new_episodes dans un thread séparé
-    # Cela empêchera la requête HTTP de se bloquer pendant l'exécution du script
-    thread = threading.Thread(target=monitor_new_episodes)
-    thread.daemon = True # Définir le thread comme daemon pour qu'il se termine avec le programme principal
-    thread.start()
-    
+    # Exécuter la surveillance en arrière-plan ; si un passage est déjà en cours, la demande y est rattachée
+    if not trigger_monitor_run("webhook"):
+        return jsonify({"message": "Une recherche de nouveaux épisodes est déjà en cours. Les notifications apparaîtront sur Discord.", "coalesced": True}), 202
+
     print("La recherche de nouveaux épisodes via le webhook a commencé.")
     return jsonify({"message": "La recherche de nouveaux épisodes a commencé en arrière-plan. Les notifications apparaîtront sur Discord."}), 202 # 202 Accepted
 
+@seriale_bp.route("/monitor/status")
+def monitor_status():
+    # Dernier passage, prochain passage planifié et passage éventuellement en cours
+    return jsonify(get_monitor_status())
+
+@seriale_bp.route("/library/scan", methods=["POST"])
+def library_scan():
+    # Rapprochement des fichiers présents sur le disque (films et séries) avec completed.json
+    full = request.values.get("full") == "1"
+    if trigger_library_scan("manuel", full=full):
+        return jsonify({"message": "Analyse de la bibliothèque démarrée en arrière-plan."}), 202
+    return jsonify({"message": "Une analyse de la bibliothèque est déjà en cours.", "coalesced": True}), 202
+
+@seriale_bp.route("/library/scan/status")
+def library_scan_status():
+    return jsonify(get_library_scan_status())
+
 
 def load_favorites():
     """Charge les séries préférées à partir d'un fichier JSON. Renvoie une liste vide si le fichier n'existe pas ou est vide/corrompu."""
@@ -124,73 +154,39 @@ def get_favorite_status(series_id):
     is_favorite = series_id in favorites
     return jsonify({"is_favorite": is_favorite})
 
-# --- Fonctions TMDB (sans changement) ---
-from functools import lru_cache
+# Règles de téléchargement automatique des nouveaux épisodes d'un favori
+@seriale_bp.route('/favorites/rules/<int:series_id>', methods=['GET'])
+def get_favorite_rules(series_id):
+    return jsonify(get_favorite_rule(series_id))
 
-@lru_cache(maxsize=128)
+@seriale_bp.route('/favorites/rules/<int:series_id>', methods=['POST'])
+def set_favorite_rules(series_id):
+    # Corps JSON : {"auto_download": true, "seasons": [1, 2], "ext": "mkv"}
+    rule = save_favorite_rule(series_id, request.get_json(silent=True) or {})
+    return jsonify({"status": "success", "message": "Règle de téléchargement automatique enregistrée.", "rule": rule})
+
+# --- Fonctions TMDB ---
 def search_tmdb_series_id(title):
-    cleaned_title = (
-        title
-        .replace("PL -", "")
-        .replace("PL-", "")
-        .replace("POLSKI", "")
-        .replace("LEKTOR", "")
-        .replace("DUBBING", "")
-        .strip()
-        .title()
-    )
-    url = f"https://api.themoviedb.org/3/search/tv?api_key={TMDB_API_KEY}&query={quote(cleaned_title)}&language=pl-PL"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get("results", [])
-        if results:
-            return results[0]["id"]
-    return None
+    # Nettoyage du titre et cache disque partagé (tmdb_cache.py), y compris pour les titres introuvables
+    return tmdb_cache.search_series_id(title)
 
 def get_tmdb_episode_metadata(tmdb_id, season, episode):
-    url = f"https://api.themoviedb.org/3/tv/{tmdb_id}/season/{season}/episode/{episode}?api_key={TMDB_API_KEY}&language=pl-PL"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return None
+    return tmdb_cache.get_episode_metadata(tmdb_id, season, episode)
 
 # --- ROUTE NFO (sans changement) ---
 @seriale_bp.route("/nfo/<int:series_id>/<int:season>/<int:episode>")
 def download_nfo(series_id, season, episode):
     try:
-        response = requests.get(f"{BASE_API}&action=get_series_info&series_id={series_id}")
-        response.raise_for_status()
-        info = response.json()
+        info = xtream_api.get_series_info(series_id)
     except requests.exceptions.RequestException as e:
         return f"Erreur de communication avec l'API : {e}", 500
     except ValueError:
         return "Erreur : Réponse JSON non valide de l'API.", 500
 
     series_info = info.get('info', {})
-    series_name_raw = series_info.get('name', f"serial_{series_id}")
-
-    prefix_pattern = r"^(?:[pP][lL]|[eE][nN]|[aA]\+|[dD]\+)\s*-\s*"
-    series_name_cleaned = re.sub(prefix_pattern, "", series_name_raw).strip()
-    
-    release_date_str = series_info.get('releaseDate', '')
-    year_str = ''
-    if release_date_str:
-        try:
-            year_str = f"({datetime.strptime(release_date_str, '%Y-%m-%d').year})"
-        except ValueError:
-            if release_date_str.strip()[:4].isdigit():
-                 year_str = f"({release_date_str.strip()[:4]})"
-    
-    series_folder_name = sanitize_filename(f"{series_name_cleaned} {year_str}".strip())
+    series_name_cleaned = clean_name(series_info.get('name', f"serial_{series_id}"))
 
     episodes_raw = info.get('episodes', {})
-    if isinstance(episodes_raw, str):
-        try:
-            episodes_raw = json.loads(episodes_raw)
-        except json.JSONDecodeError:
-            return "Erreur : Format JSON des épisodes non valide depuis l'API.", 500
-            
     found_ep = None
     for sezon_lista in episodes_raw.values():
         for ep in sezon_lista:
@@ -202,34 +198,41 @@ def download_nfo(series_id, season, episode):
     if not found_ep:
         return "❌ Épisode non trouvé", 404
 
-    ep_title = sanitize_filename(found_ep.get('title', f"Épisode {episode}"))
-    
     tmdb_id = search_tmdb_series_id(series_name_cleaned)
     if not tmdb_id:
         return f"ID TMDB introuvable pour : {series_name_cleaned}", 404
-    metadata = get_tmdb_episode_metadata(tmdb_id, season, episode)
-    if not metadata:
-        return "Pas de métadonnées", 404
 
-    nfo = f"""
-<episodedetails>
-  <title>{metadata['name']}</title>
-  <season>{season}</season>
-  <episode>{episode}</episode>
-  <plot>{metadata['overview']}</plot>
-  <aired>{metadata['air_date']}</aired>
-  <thumb>{'https://image.tmdb.org/t/p/original' + metadata['still_path'] if metadata.get('still_path') else ''}</thumb>
-</episodedetails>
-"""
-    path = os.path.join(DOWNLOAD_PATH_SERIES, series_folder_name, f"Season {season:02d}")
-    os.makedirs(path, exist_ok=True)
-    file_name_nfo = f"{series_folder_name} - S{season:02d}E{episode:02d} - {ep_title}.nfo"
-    file_path = os.path.join(path, file_name_nfo)
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(nfo.strip())
+    # Le NFO porte le même nom de base que le fichier vidéo de l'épisode ; les images sont téléchargées en arrière-plan
+    result, file_path = write_episode_nfo(series_info, tmdb_id, found_ep, season, force=True)
+    queue_series_artwork(os.path.join(DOWNLOAD_PATH_SERIES, series_folder_name(series_info)), tmdb_id, [season])
+    if result != "written":
+        return "Pas de métadonnées", 404
     return f"📄 Fichier enregistré : {file_path}", 200
 
+# --- Génération de NFO en masse (saison, série, bibliothèque) ---
+@seriale_bp.route("/nfo/bulk/<int:series_id>", methods=["POST"])
+def bulk_nfo_series(series_id):
+    # Paramètres facultatifs : season (une seule saison), force=1 (régénérer les NFO à jour)
+    season = request.values.get("season", type=int)
+    force = request.values.get("force") == "1"
+    return jsonify(start_series_nfo_job(series_id, season=season, force=force)), 202
+
+@seriale_bp.route("/nfo/bulk/library", methods=["POST"])
+def bulk_nfo_library():
+    force = request.values.get("force") == "1"
+    return jsonify(start_library_nfo_job("series", force=force)), 202
+
+@seriale_bp.route("/nfo/jobs")
+def bulk_nfo_jobs():
+    return jsonify(list_bulk_jobs())
+
+@seriale_bp.route("/nfo/jobs/<job_id>")
+def bulk_nfo_job_status(job_id):
+    job = get_bulk_job(job_id)
+    if not job:
+        return jsonify({"message": "Travail NFO introuvable."}), 404
+    return jsonify(job)
+
 # --- Vues de gestion de la file d'attente (utilisent des fonctions communes de downloader_core) ---
 @seriale_bp.route("/queue/status")
 def queue_status():
@@ -241,6 +244,13 @@ def queue_remove():
     remove_from_queue(item_id)
     return '', 204
     
+@seriale_bp.route("/queue/retry", methods=["POST"])
+def queue_retry():
+    # Nouvelle tentative d'une tâche en échec définitif (❌), conservée dans la file d'attente
+    if retry_job(request.form.get("id")):
+        return '', 204
+    return "Tâche introuvable ou pas en échec.", 409
+
 @seriale_bp.route("/queue/reorder", methods=["POST"])
 def queue_reorder():
     order = request.json.get("order", [])
@@ -255,35 +265,51 @@ def completed_episodes():
 def get_full_queue():
     return jsonify(get_full_queue_data())
 
+@seriale_bp.route("/queue/held")
+def queue_held():
+    # Tâches retenues faute d'espace disque et espace réservé par les tâches admises
+    return jsonify(get_held_jobs())
+
+@seriale_bp.route("/queue/stalls")
+def queue_stalls():
+    # Derniers transferts bloqués détectés par le chien de garde
+    return jsonify(get_stall_events())
+
+@seriale_bp.route("/queue/leases")
+def queue_leases():
+    # Tâches confiées aux nœuds distants (progression, registre des nœuds, derniers événements)
+    return jsonify(get_leases())
+
 # --- Vues des séries ---
 @seriale_bp.route("/")
 def seriale_list():
     query = request.args.get('query', '').lower() 
 
-    response = requests.get(f"{BASE_API}&action=get_series")
-    if response.status_code != 200:
+    # Catalogue gardé en mémoire XTREAM_CATALOG_TTL_SECONDS secondes (recherches successives sans nouvelle requête),
+    # affiché partiellement tant que toutes les catégories ne sont pas arrivées
+    try:
+        all_seriale, catalog_progress = xtream_api.get_catalog_partial("get_series")
+    except (requests.exceptions.RequestException, ValueError):
         return "Erreur lors du téléchargement de la liste des séries", 500
     
-    all_seriale = response.json()
-    
-    if query:
-        filtered_seriale = []
-        for serial in all_seriale:
-            if serial.get('name') and query in serial['name'].lower():
-                filtered_seriale.append(serial)
-        seriale_to_display = filtered_seriale
-    else:
-        seriale_to_display = all_seriale
-
-    return render_template("seriale_list.html", seriale=seriale_to_display)
+    with phase("filter"):
+        if query:
+            filtered_seriale = []
+            for serial in all_seriale:
+                if serial.get('name') and query in serial['name'].lower():
+                    filtered_seriale.append(serial)
+            seriale_to_display = filtered_seriale
+        else:
+            seriale_to_display = all_seriale
+
+    return render_template("seriale_list.html", seriale=seriale_to_display, catalog_progress=catalog_progress)
 
 @seriale_bp.route("/<int:series_id>")
 def serial_detail(series_id):
-    response = requests.get(f"{BASE_API}&action=get_series_info&series_id={series_id}")
-    if response.status_code != 200:
+    try:
+        data = xtream_api.get_series_info(series_id)
+    except (requests.exceptions.RequestException, ValueError):
         return "Erreur lors du téléchargement des détails de la série", 500
-
-    data = response.json()
     serial_info = data.get('info', {})
     episodes_raw = data.get('episodes', {})
 
@@ -317,9 +343,7 @@ def download_episode():
         return "Erreur : Données requises manquantes pour télécharger l'épisode.", 400
 
     try:
-        response = requests.get(f"{BASE_API}&action=get_series_info&series_id={series_id}")
-        response.raise_for_status()
-        data = response.json()
+        data = xtream_api.get_series_info(series_id)
     except requests.exceptions.RequestException as e:
         return f"Erreur de communication avec l'API : {e}", 500
     except ValueError:
@@ -346,46 +370,8 @@ def download_episode():
     if not current_episode_info:
         return f"Erreur : Informations introuvables sur l'épisode {episode_id}", 404
 
-    ext = current_episode_info.get("container_extension", "mp4") # Extension par défaut
-    
-    series_name_raw = series_info.get("name", "")
-    prefix_pattern = r"^(?:[pP][lL]|[eE][nN]|[aA]\+|[dD]\+)\s*-\s*"
-    series_name_cleaned = re.sub(prefix_pattern, "", series_name_raw).strip()
-
-    release_year_str = series_info.get("releaseDate", "").split('-')[0] if series_info.get("releaseDate") else ""
-
-    if release_year_str:
-        series_folder_name = sanitize_filename(f"{series_name_cleaned} ({release_year_str})")
-    else:
-        series_folder_name = sanitize_filename(series_name_cleaned)
-    
-    path = os.path.join(DOWNLOAD_PATH_SERIES, series_folder_name, f"Season {int(season):02d}")
-    os.makedirs(path, exist_ok=True)
-    
-    cleaned_episode_title = re.sub(r"^(?:[pP][lL]|[nN][fF]|[hH][bB][oO]|\[\s*[pP][lL]\s*\]|\[\s*[nN][fF]\s*\]|\s*\[\s*\d{4}[pP]\s*\])\s*-\s*", "", title).strip()
-
-    pattern_to_remove_series_info = r"^(?:" + re.escape(series_name_cleaned) + r"(?:\s*\(\d+K\))?|\s*\d+K)?\s*-\s*S\d{2}E\d{2}\s*[\s-]*"
-    cleaned_episode_title = re.sub(pattern_to_remove_series_info, "", cleaned_episode_title, flags=re.IGNORECASE).strip()
-
-    cleaned_episode_title = re.sub(r"\s*\(\d+K\)\s*|\s*\d+K\s*|\s*\d{3,4}p\s*", "", cleaned_episode_title, flags=re.IGNORECASE).strip()
-
-    if not cleaned_episode_title:
-            cleaned_episode_title = f"Épisode {int(episode_num):02d}"
-
-    episode_title_sanitized = sanitize_filename(cleaned_episode_title)
-    file_name = f"{series_folder_name} - S{int(season):02d}E{int(episode_num):02d} - {episode_title_sanitized}.{ext}"
-    file_path = os.path.join(path, file_name)
-
-    url = f"{XTREAM_HOST}:{XTREAM_PORT}/series/{XTREAM_USERNAME}/{XTREAM_PASSWORD}/{episode_id}.{ext}"
-    
-    job = {
-        "cmd": ["wget", "-O", file_path, url],
-        "file": file_name,
-        "item_id": episode_id, # Używamy ogólnego item_id
-        "item_type": "serial_episode", # Dodajemy typ elementu
-        "series": series_folder_name,
-        "title": title
-    }
+    # Le titre transmis par la page prime sur celui de l'API pour le nom du fichier
+    job = build_episode_job(series_id, series_info, dict(current_episode_info, title=title), season)
     
     if add_to_download_queue(job): # Dodaj do kolejki poprzez nową funkcję
         return "🕐 Épisode ajouté à la file d'attente", 202
@@ -400,9 +386,7 @@ def download_season():
     season = int(request.form['season'])
 
     try:
-        response = requests.get(f"{BASE_API}&action=get_series_info&series_id={series_id}")
-        response.raise_for_status()
-        data = response.json()
+        data = xtream_api.get_series_info(series_id)
     except requests.exceptions.RequestException as e:
         return f"Erreur de communication avec l'API : {e}", 500
     except ValueError:
@@ -411,20 +395,6 @@ def download_season():
     series_info = data.get('info', {})
     episodes_raw = data.get('episodes', {})
 
-    series_name_raw = series_info.get('name', f"serial_{series_id}")
-    series_name_cleaned = re.sub(r"^[pP][lL]\s*-\s*", "", series_name_raw).strip()
-
-    release_date_str = series_info.get('releaseDate', '')
-    year_str = ''
-    if release_date_str:
-        try:
-            year_str = f"({datetime.strptime(release_date_str, '%Y-%m-%d').year})"
-        except ValueError:
-            if release_date_str.strip()[:4].isdigit():
-                 year_str = f"({release_date_str.strip()[:4]})"
-    
-    series_folder_name = sanitize_filename(f"{series_name_cleaned} {year_str}".strip())
-
     if isinstance(episodes_raw, str):
         try:
             episodes_raw = json.loads(episodes_raw)
@@ -447,33 +417,7 @@ def download_season():
             print(f"Informations incomplètes pour l'épisode : {ep}. Ignoré.")
             continue
 
-        path = os.path.join(DOWNLOAD_PATH_SERIES, series_folder_name, f"Season {int(season):02d}")
-        os.makedirs(path, exist_ok=True)
-        
-        cleaned_episode_title = re.sub(r"^(?:[pP][lL]|[nN][fF]|[hH][bB][oO]|\[\s*[pP][lL]\s*\]|\[\s*[nN][fF]\s*\]|\s*\[\s*\d{4}[pP]\s*\])\s*-\s*", "", title).strip()
-
-        pattern_to_remove_series_info = r"^(?:" + re.escape(series_name_cleaned) + r"(?:\s*\(\d+K\))?|\s*\d+K)?\s*-\s*S\d{2}E\d{2}\s*[\s-]*"
-        cleaned_episode_title = re.sub(pattern_to_remove_series_info, "", cleaned_episode_title, flags=re.IGNORECASE).strip()
-
-        cleaned_episode_title = re.sub(r"\s*\(\d+K\)\s*|\s*\d+K\s*|\s*\d{3,4}p\s*", "", cleaned_episode_title, flags=re.IGNORECASE).strip()
-
-        if not cleaned_episode_title:
-             cleaned_episode_title = f"Épisode {int(episode_num):02d}"
-
-        episode_title_sanitized = sanitize_filename(cleaned_episode_title)
-        file_name = f"{series_folder_name} - S{int(season):02d}E{int(episode_num):02d} - {episode_title_sanitized}.{ext}"
-        file_path = os.path.join(path, file_name)
-        
-        url = f"{XTREAM_HOST}:{XTREAM_PORT}/series/{XTREAM_USERNAME}/{XTREAM_PASSWORD}/{episode_id}.{ext}"
-        
-        job = {
-            "cmd": ["wget", "-O", file_path, url],
-            "file": file_name,
-            "item_id": episode_id, # Używamy ogólnego item_id
-            "item_type": "serial_episode", # Dodajemy typ elementu
-            "series": series_folder_name,
-            "title": title
-        }
+        job = build_episode_job(series_id, series_info, ep, season)
         
         if add_to_download_queue(job): # Dodaj do kolejki poprzez nową funkcję
             added_count += 1
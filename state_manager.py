@@ -0,0 +1,142 @@
+# state_manager.py
+#
+# Écrivain unique de l'état des téléchargements : file d'attente (queue.json), éléments terminés
+# (completed.json) et statuts en mémoire. Toute modification est une commande exécutée par un seul
+# thread, dans l'ordre d'arrivée. Après chaque lot de commandes, les fichiers modifiés sont réécrits
+# (fichier temporaire puis renommage, jamais de JSON à moitié écrit) et un instantané immuable est
+# publié : les lecteurs (pages web, API du démon, métriques) le lisent sans verrou et ne font jamais
+# attendre le worker.
+
+import copy
+import json
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+from types import MappingProxyType
+
+# queue : tuple de copies des tâches ; completed : tuple des ID terminés (completed_ids : mêmes ID en frozenset) ;
+# status : statuts {item_id: emoji} en lecture seule ; version : incrémentée à chaque publication
+Snapshot = namedtuple("Snapshot", "version queue completed completed_ids status")
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"[{_now_str()}] Erreur d'écriture du fichier {path}: {e}")
+
+class StateManager:
+    """Propriétaire des listes queue_data / completed_data et du dict des statuts.
+
+    Les objets vivants ne doivent être lus ou modifiés que dans une commande (execute / submit) ;
+    ailleurs, on lit snapshot().
+    """
+
+    def __init__(self, queue_file, completed_file, queue_data, completed_data, status):
+        self.queue_file = queue_file
+        self.completed_file = completed_file
+        self.queue_data = queue_data
+        self.completed_data = completed_data
+        self.status = status
+        self._commands = queue.Queue()
+        self._dirty = set()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._snapshot = None
+        self._publish({"queue", "completed", "status"})
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+                self._thread.start()
+
+    def in_writer(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwargs):
+        """Met la commande en file sans attendre ; renvoie un Future résolu après l'écriture des fichiers."""
+        future = Future()
+        if self.in_writer():
+            # Commande émise par une autre commande : exécutée tout de suite, dans le même lot
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._start()
+        self._commands.put((fn, args, kwargs, future))
+        return future
+
+    def execute(self, fn, *args, **kwargs):
+        """Exécute la commande dans le thread écrivain et renvoie son résultat (ou relève son exception)."""
+        if self.in_writer():
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def mark_dirty(self, *names):
+        """Signale une modification ("queue", "completed", "status") à enregistrer et publier à la fin du lot."""
+        if self.in_writer():
+            self._dirty.update(names)
+        else:
+            self.submit(self._dirty.update, names)
+
+    def set_status(self, item_id, value):
+        """Change (ou retire, value=None) le statut d'une tâche, sans attendre."""
+        def apply():
+            if value is None:
+                self.status.pop(item_id, None)
+            else:
+                self.status[item_id] = value
+            self._dirty.add("status")
+        self.submit(apply)
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _publish(self, changed):
+        previous = self._snapshot
+        completed = tuple(self.completed_data) if previous is None or "completed" in changed else previous.completed
+        self._snapshot = Snapshot(
+            version=previous.version + 1 if previous else 0,
+            queue=tuple(copy.deepcopy(self.queue_data)) if previous is None or "queue" in changed else previous.queue,
+            completed=completed,
+            completed_ids=frozenset(completed) if previous is None or "completed" in changed else previous.completed_ids,
+            status=MappingProxyType(dict(self.status)) if previous is None or "status" in changed else previous.status,
+        )
+
+    def _run(self):
+        while True:
+            batch = [self._commands.get()]
+            while True:
+                try:
+                    batch.append(self._commands.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            for fn, args, kwargs, future in batch:
+                try:
+                    results.append((future, fn(*args, **kwargs), None))
+                except Exception as e:
+                    results.append((future, None, e))
+            if self._dirty:
+                changed, self._dirty = self._dirty, set()
+                if "queue" in changed:
+                    _write_json(self.queue_file, self.queue_data)
+                if "completed" in changed:
+                    _write_json(self.completed_file, self.completed_data)
+                self._publish(changed)
+            # Les appelants reprennent la main une fois l'état enregistré et publié
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
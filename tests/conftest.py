@@ -0,0 +1,40 @@
+# tests/conftest.py
+#
+# Les modules lisent leur configuration et leurs fichiers d'état (queue.json, completed.json...) à l'import :
+# environnement et dossier de travail temporaires définis avant que les tests n'importent l'application.
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+WORKDIR = tempfile.mkdtemp(prefix="vod-tests-")
+os.environ.update({
+    "XTREAM_HOST": "http://127.0.0.1",
+    "XTREAM_PORT": "9",
+    "XTREAM_USERNAME": "test",
+    "XTREAM_PASSWORD": "test",
+    "DOWNLOAD_PATH_MOVIES": os.path.join(WORKDIR, "movies"),
+    "DOWNLOAD_PATH_SERIES": os.path.join(WORKDIR, "series"),
+    "DISK_MIN_FREE_GB": "0",
+    "LOCAL_DOWNLOAD_WORKER": "0",
+})
+for name in ("DOWNLOAD_DAEMON_URL", "TMDB_API_KEY", "DISCORD_WEBHOOK_URL"):
+    os.environ.pop(name, None)
+os.chdir(WORKDIR)
+
+def pytest_unconfigure(config):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+@pytest.fixture
+def empty_queue():
+    """File d'attente vide avant et après le test."""
+    import downloader_core
+    downloader_core.clear_queue()
+    yield downloader_core
+    downloader_core.clear_queue()
@@ -0,0 +1,36 @@
+# tests/test_download_daemon.py
+#
+# POST /jobs : la commande wget exécutée par le worker et les nœuds est reconstruite par le démon.
+
+import os
+
+import download_daemon
+
+def _movie(**overrides):
+    path = os.path.join(download_daemon.DOWNLOAD_PATH_MOVIES, "Film", "Film.mkv")
+    job = {"item_id": "501", "item_type": "movie", "title": "Film", "file": "Film.mkv",
+           "cmd": ["wget", "-O", path, "http://127.0.0.1:9/movie/test/test/501.mkv"],
+           "enrichment": {"status": "pending", "query": "Film", "ext": "mkv"}}
+    job.update(overrides)
+    return job
+
+def test_command_is_rebuilt_from_fields():
+    job = download_daemon.build_job(_movie(cmd=["sh", "-O", _movie()["cmd"][2], "http://evil.example/x"], part_path="/etc/passwd"))
+    assert job["cmd"] == ["wget", "-O", _movie()["cmd"][2],
+                          f"{download_daemon.XTREAM_HOST}:{download_daemon.XTREAM_PORT}/movie/test/test/501.mkv"]
+    assert "part_path" not in job
+    assert job["enrichment"] == {"status": "pending", "query": "Film", "ext": "mkv"}
+
+def test_invalid_jobs_are_refused():
+    outside = _movie()
+    outside["cmd"] = ["wget", "-O", os.path.join(download_daemon.DOWNLOAD_PATH_MOVIES, "..", "x.mp4"), "u"]
+    assert download_daemon.build_job(outside) is None
+    assert download_daemon.build_job(_movie(item_type="script")) is None
+    assert download_daemon.build_job(_movie(item_id="1; rm -rf /")) is None
+    assert download_daemon.build_job(_movie(cmd=["wget", "-O", _movie()["cmd"][2][:-4] + ".m;v", "u"])) is None
+    assert download_daemon.build_job({"item_id": "501"}) is None
+
+def test_token_is_required_off_loopback():
+    assert download_daemon._is_loopback("127.0.0.1")
+    assert download_daemon._is_loopback("localhost")
+    assert not download_daemon._is_loopback("0.0.0.0")
@@ -0,0 +1,36 @@
+# tests/test_enrichment.py
+#
+# Enrichissement TMDB des films : une panne de TMDB n'est pas un film introuvable.
+
+import enrichment
+import tmdb_cache
+
+def _job(core, item_id, title):
+    path = f"{enrichment.DOWNLOAD_PATH_MOVIES}/{title}/{title}.mp4"
+    job = {"item_id": item_id, "item_type": "movie", "title": title, "file": f"{title}.mp4",
+           "cmd": ["wget", "-O", path, f"http://127.0.0.1:9/movie/{item_id}.mp4"],
+           "enrichment": {"status": "pending", "query": title, "ext": "mp4"}}
+    assert core.add_to_download_queue(job)
+    return {"item_id": item_id, "query": title, "ext": "mp4", "provisional_path": path}
+
+def _enrichment(core, item_id):
+    return next(j for j in core.get_full_queue_data() if j["item_id"] == item_id)["enrichment"]
+
+def test_tmdb_error_keeps_job_pending(empty_queue, monkeypatch):
+    core = empty_queue
+    retried = []
+    monkeypatch.setattr(tmdb_cache, "tmdb_request", lambda path, params=None: ('error', None))
+    monkeypatch.setattr(enrichment, "_retry_later", retried.append)
+    task = _job(core, "401", "Film En Panne")
+
+    enrichment._enrich_movie(task)
+    assert _enrichment(core, "401")["status"] == "pending"
+    assert retried == [task]
+
+def test_not_found_finishes_without_year(empty_queue, monkeypatch):
+    core = empty_queue
+    monkeypatch.setattr(tmdb_cache, "tmdb_request", lambda path, params=None: ('ok', {"results": []}))
+    task = _job(core, "402", "Film Introuvable")
+
+    enrichment._enrich_movie(task)
+    assert _enrichment(core, "402") == {"status": "done", "query": "Film Introuvable", "ext": "mp4", "tmdb_id": None, "year": ""}
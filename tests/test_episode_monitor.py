@@ -0,0 +1,29 @@
+# tests/test_episode_monitor.py
+#
+# Détection des séries inchangées : l'empreinte de la liste get_series est comparée à celle du passage précédent.
+
+import episode_monitor
+
+def test_unchanged_series_skips_series_info(monkeypatch):
+    # La liste annonce 5 épisodes (spéciaux compris), get_series_info n'en détaille que 3
+    listing = {"301": {"series_id": 301, "last_modified": "1760000000", "num_episodes": "5"}}
+    episodes = {"1": [{"episode_num": n, "title": f"Épisode {n}", "season": 1} for n in (1, 2, 3)]}
+    fetched = []
+
+    def details(series_id):
+        fetched.append(series_id)
+        return {"name": "Série", "cover_url": None, "episodes_by_season": episodes, "series_info": {}}
+
+    monkeypatch.setattr(episode_monitor, "get_xtream_series_listing", lambda: listing)
+    monkeypatch.setattr(episode_monitor, "get_xtream_series_details", details)
+    monkeypatch.setattr(episode_monitor, "queue_new_episodes_notification", lambda *args: None)
+    episode_monitor.save_json_file(episode_monitor.FAVORITES_FILE, [301])
+    episode_monitor.save_json_file(episode_monitor.MONITORED_STATE_FILE, {})
+
+    episode_monitor.monitor_new_episodes()
+    episode_monitor.monitor_new_episodes()
+    assert fetched == [301]
+
+    listing["301"]["num_episodes"] = "6"
+    episode_monitor.monitor_new_episodes()
+    assert fetched == [301, 301]
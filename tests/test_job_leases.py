@@ -0,0 +1,73 @@
+# tests/test_job_leases.py
+#
+# Protocole des baux dans un seul processus : attribution, renouvellement, fin, expiration et remise en file.
+
+import time
+
+import job_leases
+
+def _job(item_id):
+    return {"item_id": item_id, "item_type": "movie", "title": f"Film {item_id}", "file": f"{item_id}.mp4",
+            "cmd": ["wget", "-O", f"/tmp/vod-tests/{item_id}.mp4", f"http://127.0.0.1:9/movie/{item_id}.mp4"]}
+
+def _status(core, item_id):
+    return core.get_queue_status().get(item_id)
+
+def test_acquire_heartbeat_complete(empty_queue):
+    core = empty_queue
+    assert core.add_to_download_queue(_job("101"))
+
+    lease = job_leases.acquire("node-a")
+    assert lease["job"]["item_id"] == "101"
+    assert _status(core, "101") == "🌐"
+    assert job_leases.acquire("node-b") is None # Seule tâche déjà confiée
+
+    assert job_leases.heartbeat(lease["lease_id"], {"received": 1024})
+    assert job_leases.get_leases()["leases"][0]["progress"]["received"] == 1024
+
+    assert job_leases.complete(lease["lease_id"], sha256="0" * 64, size=1024)
+    assert _status(core, "101") == "✅"
+    assert "101" in core.get_completed_items()
+    assert not job_leases.heartbeat(lease["lease_id"])
+
+def test_expired_lease_is_requeued(empty_queue, monkeypatch):
+    core = empty_queue
+    monkeypatch.setattr(job_leases, "LEASE_TTL_SECONDS", 0.05)
+    assert core.add_to_download_queue(_job("102"))
+
+    lease = job_leases.acquire("node-a")
+    time.sleep(0.1)
+    assert job_leases.expire_leases() == 1
+    assert _status(core, "102") == "⏳"
+    assert not job_leases.heartbeat(lease["lease_id"])
+    assert not job_leases.complete(lease["lease_id"]) # Compte rendu tardif refusé (410)
+
+    # Reprise par un autre nœud
+    monkeypatch.setattr(job_leases, "LEASE_TTL_SECONDS", 60)
+    second = job_leases.acquire("node-b")
+    assert second["job"]["item_id"] == "102"
+    assert second["lease_id"] != lease["lease_id"]
+    assert job_leases.fail(second["lease_id"], "wget a échoué (code 4)")
+    assert _status(core, "102") == "🔁"
+
+def test_cancelled_job_is_not_completed(empty_queue):
+    core = empty_queue
+    assert core.add_to_download_queue(_job("103"))
+    lease = job_leases.acquire("node-a")
+
+    core.remove_from_queue("103")
+    assert job_leases.complete(lease["lease_id"], sha256="0" * 64, size=1024)
+    assert "103" not in core.get_completed_items()
+    assert _status(core, "103") is None
+
+def test_expired_lease_of_removed_job_is_dropped(empty_queue, monkeypatch):
+    core = empty_queue
+    monkeypatch.setattr(job_leases, "LEASE_TTL_SECONDS", 0.05)
+    assert core.add_to_download_queue(_job("104"))
+    job_leases.acquire("node-a")
+
+    core.remove_from_queue("104")
+    time.sleep(0.1)
+    assert job_leases.expire_leases() == 0
+    assert _status(core, "104") is None
+    assert job_leases.acquire("node-b") is None
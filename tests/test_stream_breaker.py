@@ -0,0 +1,70 @@
+# tests/test_stream_breaker.py
+#
+# Disjoncteur des flux (xtream:stream) : seules les pannes du fournisseur le font ouvrir, et un échec de
+# l'appel d'essai consomme une tentative au lieu de remettre la tâche en pause indéfiniment.
+
+import time
+
+import pytest
+
+import circuit_breaker
+from transfer_monitor import wget_failure_kind
+
+@pytest.fixture
+def core(empty_queue, monkeypatch):
+    """downloader_core avec un disjoncteur de flux neuf, ouvert pour 0,1 s seulement."""
+    breaker = circuit_breaker.CircuitBreaker("xtream", "stream")
+    monkeypatch.setitem(circuit_breaker._breakers, breaker.name, breaker)
+    monkeypatch.setattr(empty_queue, "stream_breaker", breaker)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_OPEN_SECONDS", 0.1)
+    return empty_queue
+
+def _job(core, item_id):
+    job = {"item_id": item_id, "item_type": "movie", "title": f"Film {item_id}", "file": f"{item_id}.mp4",
+           "cmd": ["wget", "-O", f"/tmp/vod-tests/{item_id}.mp4", f"http://127.0.0.1:9/movie/{item_id}.mp4"]}
+    assert core.add_to_download_queue(job)
+    return job
+
+def _open(breaker):
+    for _ in range(circuit_breaker.BREAKER_MIN_CALLS):
+        breaker.record(False, error="wget")
+    assert breaker.state == "open"
+
+def test_wget_failure_kind():
+    assert wget_failure_kind(8, "HTTP request sent, awaiting response... 404 Not Found\nERROR 404: Not Found.\n") == "http"
+    assert wget_failure_kind(8, "ERROR 403: Forbidden.\n") == "http"
+    assert wget_failure_kind(8, "ERROR 503: Service Unavailable.\n") == "wget"
+    assert wget_failure_kind(4, "Read error (Connection timed out) in headers.\n") == "wget"
+    assert wget_failure_kind(3, "Cannot write to 'film.mp4.part' (No space left on device).\n") == "io"
+
+def test_dead_stream_is_not_counted(core):
+    for item_id in ("201", "202", "203", "204", "205", "206"):
+        core._retry_or_fail(_job(core, item_id), "ERROR 404: Not Found.", keep_part=True, kind="http")
+        assert core.get_queue_status()[item_id] == "🔁"
+    assert core.stream_breaker.state == "closed"
+    assert core.stream_breaker.stats()["calls"] == 0
+
+def test_provider_failure_pauses_while_open(core):
+    _open(core.stream_breaker)
+    job = _job(core, "207")
+    core._retry_or_fail(job, "wget a échoué (code 4)", keep_part=True, kind="wget")
+    assert core.get_queue_status()["207"] == "⏸"
+    assert job.get("attempts", 0) == 0
+
+def test_failed_trial_call_consumes_an_attempt(core):
+    _open(core.stream_breaker)
+    time.sleep(0.15)
+    assert core.stream_breaker.state == "half_open"
+
+    job = _job(core, "208")
+    core._retry_or_fail(job, "wget a échoué (code 4)", keep_part=True, kind="wget")
+    assert job["attempts"] == 1
+    assert core.get_queue_status()["208"] == "🔁"
+    assert core.stream_breaker.state == "open" # L'essai a échoué : disjoncteur rouvert
+
+    # Jusqu'au bout : un lien mort servant d'essai à chaque fois finit en échec
+    for _ in range(core.RETRY_COUNT - 1):
+        time.sleep(0.15)
+        core._retry_or_fail(job, "wget a échoué (code 4)", keep_part=True, kind="wget")
+    assert job["failed"]
+    assert core.get_queue_status()["208"] == "❌"
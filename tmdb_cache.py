@@ -0,0 +1,248 @@
+# tmdb_cache.py
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+import circuit_breaker
+from metrics import UPSTREAM_LATENCY, CACHE_REQUESTS
+from request_timing import record_phase
+
+# --- Configuration TMDB ---
+TMDB_API_KEY = os.getenv("TMDB_API_KEY", "cfdfac787bf2a6e2c521b93a0309ff2c")
+TMDB_API_URL = "https://api.themoviedb.org/3"
+TMDB_LANGUAGE = os.getenv("TMDB_LANGUAGE", "pl-PL")
+TMDB_TIMEOUT_SECONDS = float(os.getenv("TMDB_TIMEOUT_SECONDS", 10))
+# Débit maximal vers TMDB, partagé par tous les threads du processus (travaux NFO en masse notamment)
+TMDB_MAX_REQUESTS_PER_SECOND = float(os.getenv("TMDB_MAX_REQUESTS_PER_SECOND", 20))
+TMDB_MAX_RETRIES = 3
+
+# --- Configuration du cache disque ---
+# Un fichier JSON par entrée, écrit de manière atomique : le cache est partagé entre processus
+# et survit aux redémarrages.
+TMDB_CACHE_DIR = os.getenv("TMDB_CACHE_DIR", "tmdb_cache")
+TMDB_CACHE_TTL_SEARCH = float(os.getenv("TMDB_CACHE_TTL_SEARCH_HOURS", 24 * 7)) * 3600
+TMDB_CACHE_TTL_METADATA = float(os.getenv("TMDB_CACHE_TTL_METADATA_HOURS", 24 * 30)) * 3600
+# Durée de conservation des réponses "introuvable" (recherche sans résultat, 404)
+TMDB_CACHE_TTL_NEGATIVE = float(os.getenv("TMDB_CACHE_TTL_NEGATIVE_HOURS", 24)) * 3600
+# Données supplémentaires demandées avec chaque saison (ex. "credits,images"), vide par défaut
+TMDB_SEASON_APPEND_TO_RESPONSE = os.getenv("TMDB_SEASON_APPEND_TO_RESPONSE", "")
+# Saisons récemment lues gardées en mémoire pour éviter de relire le fichier à chaque épisode
+SEASON_MEMO_SIZE = 64
+SEASON_MEMO_TTL_SECONDS = 300
+
+_rate_lock = threading.Lock()
+_next_request_slot = 0.0
+_season_memo = OrderedDict()
+_season_memo_lock = threading.Lock()
+_season_fetch_locks = {}
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _cache_path(kind, key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(TMDB_CACHE_DIR, kind, digest[:2], f"{digest}.json")
+
+def cache_get(kind, key, allow_expired=False):
+    """Renvoie (trouvé, valeur). Une valeur None trouvée correspond à un résultat négatif mis en cache.
+
+    allow_expired : entrée renvoyée même expirée (TMDB indisponible).
+    """
+    path = _cache_path(kind, key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False, None
+    if not allow_expired and entry.get('expires_at', 0) < time.time():
+        return False, None
+    return True, entry.get('value')
+
+def cache_set(kind, key, value, ttl):
+    path = _cache_path(kind, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'stored_at': time.time(), 'expires_at': time.time() + ttl, 'value': value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[{_now_str()}] Erreur d'écriture du cache TMDB ({path}): {e}")
+
+def _wait_for_rate_limit():
+    """Espace les requêtes TMDB pour rester sous TMDB_MAX_REQUESTS_PER_SECOND."""
+    global _next_request_slot
+    if TMDB_MAX_REQUESTS_PER_SECOND <= 0:
+        return
+    with _rate_lock:
+        now = time.time()
+        slot = max(now, _next_request_slot)
+        _next_request_slot = slot + 1 / TMDB_MAX_REQUESTS_PER_SECOND
+    if slot > now:
+        time.sleep(slot - now)
+
+def tmdb_request(path, params=None):
+    """Appelle l'API TMDB. Renvoie (statut, données) avec statut 'ok', 'not_found' ou 'error'."""
+    query = {'api_key': TMDB_API_KEY, 'language': TMDB_LANGUAGE}
+    query.update(params or {})
+    # Premier segment du chemin (search, movie, tv) : pas d'identifiant dans les labels
+    endpoint = path.strip('/').split('/')[0]
+    breaker = circuit_breaker.get_breaker("tmdb", endpoint)
+    for attempt in range(TMDB_MAX_RETRIES + 1):
+        if not breaker.allow():
+            # Disjoncteur ouvert : échec immédiat, l'appelant se contente du cache
+            return 'error', None
+        _wait_for_rate_limit()
+        started = time.perf_counter()
+        try:
+            response = requests.get(f"{TMDB_API_URL}{path}", params=query, timeout=TMDB_TIMEOUT_SECONDS)
+        except requests.exceptions.RequestException as e:
+            breaker.record(False, time.perf_counter() - started, error=type(e).__name__)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="tmdb", endpoint=endpoint, outcome="error")
+            record_phase("upstream", time.perf_counter() - started)
+            print(f"[{_now_str()}] Erreur de connexion à TMDB ({path}): {e}")
+            return 'error', None
+        # 404 ou 429 : TMDB répond, seules les erreurs 5xx comptent contre le disjoncteur
+        breaker.record(response.status_code < 500, time.perf_counter() - started, error=f"HTTP {response.status_code}")
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="tmdb", endpoint=endpoint, outcome=str(response.status_code))
+        record_phase("upstream", time.perf_counter() - started)
+        if response.status_code != 429 or attempt == TMDB_MAX_RETRIES:
+            break
+        # Limite de débit TMDB dépassée : attendre le délai indiqué avant de réessayer
+        try:
+            retry_after = float(response.headers.get('Retry-After', 1))
+        except (TypeError, ValueError):
+            retry_after = 1.0
+        time.sleep(retry_after)
+    if response.status_code == 200:
+        try:
+            return 'ok', response.json()
+        except ValueError:
+            return 'error', None
+    if response.status_code == 404:
+        return 'not_found', None
+    print(f"[{_now_str()}] Réponse TMDB inattendue ({response.status_code}) pour {path}.")
+    return 'error', None
+
+def _cached_tmdb_lookup(kind, path, params=None, ttl=TMDB_CACHE_TTL_METADATA):
+    """Comme cached_tmdb_get, mais renvoie (statut, données) : 'ok', 'not_found' ou 'error' (TMDB injoignable)."""
+    key = f"{path}?{json.dumps(params or {}, sort_keys=True)}&language={TMDB_LANGUAGE}"
+    found, value = cache_get(kind, key)
+    CACHE_REQUESTS.inc(cache="tmdb", result="hit" if found else "miss")
+    if found:
+        return ('ok' if value is not None else 'not_found'), value
+    status, data = tmdb_request(path, params)
+    if status == 'ok':
+        cache_set(kind, key, data, ttl)
+    elif status == 'not_found':
+        cache_set(kind, key, None, TMDB_CACHE_TTL_NEGATIVE)
+    elif circuit_breaker.service_open("tmdb"):
+        # TMDB indisponible : une réponse expirée vaut mieux qu'aucune
+        found, value = cache_get(kind, key, allow_expired=True)
+        if found:
+            CACHE_REQUESTS.inc(cache="tmdb", result="stale")
+            return ('ok' if value is not None else 'not_found'), value
+    return status, data
+
+def cached_tmdb_get(kind, path, params=None, ttl=TMDB_CACHE_TTL_METADATA):
+    """Réponse TMDB mise en cache sur disque. Les 404 sont mis en cache négatif, les erreurs jamais."""
+    return _cached_tmdb_lookup(kind, path, params, ttl)[1]
+
+def clean_query(title):
+    """Retire du titre Xtream les mentions de langue/version avant la recherche TMDB."""
+    return (
+        title
+        .replace("PL -", "")
+        .replace("PL-", "")
+        .replace("POLSKI", "")
+        .replace("LEKTOR", "")
+        .replace("DUBBING", "")
+        .strip()
+        .title()
+    )
+
+def _search(media_type, title):
+    """Recherche TMDB. Renvoie (statut, identifiant) : 'ok', 'not_found' (aucun résultat) ou 'error' (TMDB injoignable)."""
+    query = clean_query(title)
+    key = f"/search/{media_type}?query={query.lower()}&language={TMDB_LANGUAGE}"
+    found, value = cache_get('search', key)
+    CACHE_REQUESTS.inc(cache="tmdb", result="hit" if found else "miss")
+    if found:
+        return ('ok' if value else 'not_found'), value
+    status, data = tmdb_request(f"/search/{media_type}", {'query': query})
+    if status == 'error':
+        return 'error', None
+    results = (data or {}).get("results", [])
+    tmdb_id = results[0]["id"] if results else None
+    # Une recherche sans résultat est conservée moins longtemps qu'un identifiant trouvé
+    cache_set('search', key, tmdb_id, TMDB_CACHE_TTL_SEARCH if tmdb_id else TMDB_CACHE_TTL_NEGATIVE)
+    return ('ok' if tmdb_id else 'not_found'), tmdb_id
+
+def _search_id(media_type, title):
+    return _search(media_type, title)[1]
+
+def search_movie(title):
+    """(statut, identifiant TMDB) du film : distingue "introuvable" de "TMDB indisponible"."""
+    return _search('movie', title)
+
+def search_movie_id(title):
+    return _search_id('movie', title)
+
+def search_series_id(title):
+    return _search_id('tv', title)
+
+def get_movie_metadata(tmdb_id):
+    return cached_tmdb_get('movie', f"/movie/{tmdb_id}")
+
+def lookup_movie_metadata(tmdb_id):
+    """(statut, métadonnées) du film, statut 'error' si TMDB est injoignable."""
+    return _cached_tmdb_lookup('movie', f"/movie/{tmdb_id}")
+
+def get_series_metadata(tmdb_id):
+    return cached_tmdb_get('tv', f"/tv/{tmdb_id}")
+
+def get_season_metadata(tmdb_id, season):
+    """Saison complète (/tv/{id}/season/{s}), avec ses épisodes. Gardée aussi en mémoire pour les NFO en série."""
+    key = (str(tmdb_id), int(season))
+    with _season_memo_lock:
+        memo = _season_memo.get(key)
+        if memo and memo[0] > time.time():
+            _season_memo.move_to_end(key)
+            return memo[1]
+        fetch_lock = _season_fetch_locks.setdefault(key, threading.Lock())
+
+    # Les épisodes d'une même saison traités en parallèle attendent une seule requête
+    with fetch_lock:
+        with _season_memo_lock:
+            memo = _season_memo.get(key)
+        if memo and memo[0] > time.time():
+            return memo[1]
+        params = {'append_to_response': TMDB_SEASON_APPEND_TO_RESPONSE} if TMDB_SEASON_APPEND_TO_RESPONSE else None
+        data = cached_tmdb_get('season', f"/tv/{tmdb_id}/season/{season}", params)
+        with _season_memo_lock:
+            if data is not None:
+                _season_memo[key] = (time.time() + SEASON_MEMO_TTL_SECONDS, data)
+                while len(_season_memo) > SEASON_MEMO_SIZE:
+                    _season_memo.popitem(last=False)
+            _season_fetch_locks.pop(key, None)
+    return data
+
+def get_episode_metadata(tmdb_id, season, episode):
+    """Métadonnées d'un épisode, extraites de la réponse de saison mise en cache.
+
+    Une seule requête TMDB par saison ; l'appel par épisode n'est utilisé que si l'épisode
+    est absent de la saison (saison en cache antérieure à la diffusion de l'épisode).
+    """
+    season_data = get_season_metadata(tmdb_id, season)
+    for episode_data in (season_data or {}).get('episodes', []):
+        if episode_data.get('episode_number') == int(episode):
+            return episode_data
+    return cached_tmdb_get('episode', f"/tv/{tmdb_id}/season/{season}/episode/{episode}")
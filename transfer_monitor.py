@@ -0,0 +1,122 @@
+# transfer_monitor.py
+
+import os
+import re
+import hashlib
+import threading
+import time
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Statut HTTP dans la sortie de wget ("ERROR 404: Not Found.")
+_WGET_HTTP_ERROR = re.compile(r"ERROR (\d{3})")
+
+class TransferStalled(Exception):
+    """Transfert arrêté par le chien de garde : aucune donnée reçue pendant trop longtemps."""
+
+def wget_failure_kind(returncode, output=""):
+    """Cause résumée d'un échec de wget à partir de son code de sortie et de la fin de sa sortie.
+
+    "wget" : fournisseur en cause (erreur réseau, délai dépassé, TLS, réponse 5xx) ;
+    "http" : réponse 4xx, propre à ce flux (lien mort, accès refusé) ;
+    "io" : écriture du fichier impossible sur ce disque.
+    """
+    if returncode == 3:
+        return "io"
+    if returncode == 8:
+        codes = _WGET_HTTP_ERROR.findall(output or "")
+        if codes and codes[-1].startswith("4"):
+            return "http"
+    return "wget"
+
+class TransferMonitor(threading.Thread):
+    """Suit un fichier .part pendant que wget l'écrit.
+
+    Les octets sont lus au fil de l'eau, juste après leur écriture (encore dans le cache disque),
+    pour calculer le SHA-256 sans relire tout le fichier à la fin. Si le fichier ne grossit plus
+    pendant stall_timeout secondes, on_stall est appelée (le worker tue alors wget et reprend).
+    """
+
+    def __init__(self, path, interval=1.0, stall_timeout=0, on_stall=None, on_progress=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+        # on_progress(octets) reçoit les nouveaux octets écrits (hors .part déjà présent au démarrage)
+        self.on_progress = on_progress
+        self.rate = 0.0
+        # Octets reçus pendant ce suivi (le .part déjà présent au démarrage n'est pas compté)
+        self.received = 0
+        try:
+            self._counted_until = os.path.getsize(path)
+        except OSError:
+            self._counted_until = 0
+        self.offset = 0
+        self.started = time.time()
+        self.last_progress = self.started
+        self.stall_count = 0
+        self._stalled = threading.Event()
+        self._sha256 = hashlib.sha256()
+        self._stop_event = threading.Event()
+
+    def _poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self.offset:
+            # Fichier réécrit depuis le début (serveur sans reprise) : recommencer l'empreinte
+            self._sha256 = hashlib.sha256()
+            self.offset = 0
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while self.offset < size:
+                chunk = f.read(min(READ_CHUNK_SIZE, size - self.offset))
+                if not chunk:
+                    break
+                self._sha256.update(chunk)
+                self.offset += len(chunk)
+        now = time.time()
+        new_bytes = max(0, self.offset - self._counted_until)
+        if new_bytes:
+            self._counted_until = self.offset
+            self.received += new_bytes
+            # Moyenne glissante du débit, lissée sur quelques intervalles
+            instant_rate = new_bytes / max(now - self.last_progress, 1e-3)
+            self.rate = instant_rate if not self.rate else 0.7 * self.rate + 0.3 * instant_rate
+            if self.on_progress:
+                self.on_progress(new_bytes)
+        self.last_progress = now
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._poll()
+            if (self.stall_timeout > 0 and not self._stalled.is_set()
+                    and time.time() - self.last_progress > self.stall_timeout):
+                self.stall_count += 1
+                self._stalled.set()
+                if self.on_stall:
+                    self.on_stall()
+            self._stop_event.wait(self.interval)
+
+    def stalled_for(self):
+        return time.time() - self.last_progress
+
+    def consume_stall(self):
+        """Renvoie True si un blocage a été détecté depuis le dernier appel, et réarme la détection."""
+        if not self._stalled.is_set():
+            return False
+        self.last_progress = time.time()
+        self._stalled.clear()
+        return True
+
+    def finish(self):
+        """Arrête le suivi, lit les derniers octets et renvoie (sha256 hexadécimal, taille)."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self._poll()
+        return self._sha256.hexdigest(), self.offset
@@ -0,0 +1,308 @@
+# xtream_api.py
+
+import os
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+
+import circuit_breaker
+from circuit_breaker import CircuitOpenError
+from metrics import UPSTREAM_LATENCY, CACHE_REQUESTS
+from request_timing import record_phase
+
+# --- Configuration ---
+XTREAM_HOST = os.getenv("XTREAM_HOST")
+XTREAM_PORT = os.getenv("XTREAM_PORT")
+XTREAM_USERNAME = os.getenv("XTREAM_USERNAME")
+XTREAM_PASSWORD = os.getenv("XTREAM_PASSWORD")
+BASE_API = f"{XTREAM_HOST}:{XTREAM_PORT}/player_api.php?username={XTREAM_USERNAME}&password={XTREAM_PASSWORD}"
+XTREAM_TIMEOUT_SECONDS = float(os.getenv("XTREAM_TIMEOUT_SECONDS", 60))
+# Durée de validité du cache mémoire des détails de série (get_series_info)
+XTREAM_SERIES_INFO_TTL_SECONDS = float(os.getenv("XTREAM_SERIES_INFO_TTL_SECONDS", 300))
+# Durée de validité du cache mémoire des catalogues complets (get_vod_streams, get_series).
+# 0 : pas de cache, chaque page de liste redemande le catalogue à Xtream (comportement d'origine)
+XTREAM_CATALOG_TTL_SECONDS = float(os.getenv("XTREAM_CATALOG_TTL_SECONDS", 300))
+# Catalogues téléchargés catégorie par catégorie (get_vod_categories puis get_vod_streams&category_id=...),
+# pour les fournisseurs dont la liste complète dépasse le délai d'attente (0 = une seule requête complète)
+XTREAM_CATALOG_SHARDED = os.getenv("XTREAM_CATALOG_SHARDED", "1") != "0"
+# Nombre de catégories demandées en parallèle
+XTREAM_CATALOG_SHARD_WORKERS = int(os.getenv("XTREAM_CATALOG_SHARD_WORKERS", 4))
+# Attente maximale d'une page de liste avant d'afficher un catalogue partiel
+XTREAM_CATALOG_PARTIAL_WAIT_SECONDS = float(os.getenv("XTREAM_CATALOG_PARTIAL_WAIT_SECONDS", 5))
+
+# Action des catégories et clé d'identité (dédoublonnage) de chaque catalogue
+CATALOG_SHARDS = {
+    "get_vod_streams": ("get_vod_categories", "stream_id"),
+    "get_series": ("get_series_categories", "series_id"),
+}
+
+# --- Caches mémoire des détails de série et des catalogues ---
+_series_info_cache = {}
+_catalog_cache = {}
+_catalog_loads = {}
+_cache_lock = threading.Lock()
+
+def _now_str():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def xtream_get(action, **params):
+    """Appelle player_api.php et renvoie le JSON. Lève requests.exceptions.RequestException ou ValueError.
+
+    Passe par le disjoncteur de l'action : CircuitOpenError (une ConnectionError) sans attendre s'il est ouvert.
+    """
+    breaker = circuit_breaker.get_breaker("xtream", action)
+    breaker.check()
+    query = "".join(f"&{key}={value}" for key, value in params.items())
+    started = time.perf_counter()
+    outcome = "error"
+    error = None
+    try:
+        response = requests.get(f"{BASE_API}&action={action}{query}", timeout=XTREAM_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        data = response.json()
+        outcome = "ok"
+        return data
+    except requests.exceptions.HTTPError as e:
+        # Réponse 4xx : le serveur répond, seule la requête est en cause
+        if e.response is not None and e.response.status_code < 500:
+            outcome = "client_error"
+        error = e
+        raise
+    except (requests.exceptions.RequestException, ValueError) as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        # Nom de l'exception seulement : son message contient l'URL, avec l'identifiant et le mot de passe
+        breaker.record(outcome != "error", elapsed, error=type(error).__name__ if error is not None else None)
+        UPSTREAM_LATENCY.observe(elapsed, service="xtream", endpoint=action, outcome=outcome)
+        record_phase("upstream", elapsed)
+
+class _CatalogLoad:
+    """Chargement en cours d'un catalogue : catégories demandées en parallèle, résultats fusionnés au fil de l'eau."""
+
+    def __init__(self, action, previous_shards):
+        self.action = action
+        self.key = CATALOG_SHARDS.get(action, (None, None))[1]
+        self.previous_shards = previous_shards or {}
+        self.done = threading.Event()
+        self.error = None
+        self.total = 0
+        self.loaded = 0
+        self.failed = []
+        self.shards = {}
+        self._lock = threading.Lock()
+        self._items = []
+        self._seen = set()
+
+    def _add(self, category_id, items):
+        with self._lock:
+            self.shards[category_id] = items
+            self.loaded += 1
+            for item in items:
+                identity = item.get(self.key) if self.key else None
+                if identity is not None:
+                    if identity in self._seen:
+                        continue # Même titre présent dans plusieurs catégories
+                    self._seen.add(identity)
+                self._items.append(item)
+
+    def partial(self):
+        with self._lock:
+            return list(self._items), {"loaded": self.loaded, "total": self.total, "failed": len(self.failed)}
+
+    def _categories(self):
+        categories_action = CATALOG_SHARDS.get(self.action, (None,))[0]
+        if not XTREAM_CATALOG_SHARDED or categories_action is None:
+            return None
+        try:
+            categories = xtream_get(categories_action)
+        except CircuitOpenError:
+            raise # Fournisseur indisponible : inutile de tenter la liste complète
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # Nom de l'exception seulement : son message contient l'URL, avec l'identifiant et le mot de passe
+            print(f"[{_now_str()}] Catégories {categories_action} indisponibles ({type(e).__name__}) : catalogue {self.action} demandé en entier.")
+            return None
+        ids = [str(c["category_id"]) for c in categories if isinstance(c, dict) and c.get("category_id") is not None] if isinstance(categories, list) else []
+        return list(dict.fromkeys(ids)) or None
+
+    def _fetch_shard(self, category_id):
+        data = xtream_get(self.action, category_id=category_id)
+        if not isinstance(data, list):
+            # Certains panneaux renvoient {} pour une catégorie vide
+            if not data:
+                return []
+            raise ValueError(f"Réponse inattendue de {self.action} (catégorie {category_id}) depuis Xtream.")
+        return data
+
+    def run(self):
+        try:
+            category_ids = self._categories()
+            if category_ids is None:
+                self.total = 1
+                data = xtream_get(self.action)
+                if not isinstance(data, list):
+                    raise ValueError(f"Réponse inattendue de {self.action} depuis Xtream.")
+                self._add(None, data)
+                data_shards = None
+            else:
+                self.total = len(category_ids)
+                with ThreadPoolExecutor(max_workers=max(1, XTREAM_CATALOG_SHARD_WORKERS)) as pool:
+                    futures = {pool.submit(self._fetch_shard, category_id): category_id for category_id in category_ids}
+                    for future in as_completed(futures):
+                        category_id = futures[future]
+                        try:
+                            self._add(category_id, future.result())
+                        except CircuitOpenError:
+                            self.failed.append(category_id) # Résumé ci-dessous, pas une ligne par catégorie
+                        except (requests.exceptions.RequestException, ValueError) as e:
+                            self.failed.append(category_id)
+                            print(f"[{_now_str()}] Catégorie {category_id} de {self.action} indisponible ({type(e).__name__}).")
+                if self.failed:
+                    print(f"[{_now_str()}] {len(self.failed)}/{len(category_ids)} catégorie(s) de {self.action} non reçue(s).")
+                if len(self.failed) == len(category_ids):
+                    raise requests.exceptions.ConnectionError(f"Aucune catégorie de {self.action} n'a pu être téléchargée.")
+                for category_id in self.failed:
+                    # Catégorie en échec : on garde sa version du chargement précédent plutôt que de perdre ses titres
+                    if category_id in self.previous_shards:
+                        self._add(category_id, self.previous_shards[category_id])
+                data_shards = dict(self.shards)
+            # Catalogue final dans l'ordre des catégories du fournisseur, sans doublons
+            data, seen = [], set()
+            for category_id in (category_ids or [None]):
+                for item in self.shards.get(category_id, []):
+                    identity = item.get(self.key) if self.key else None
+                    if identity is not None:
+                        if identity in seen:
+                            continue
+                        seen.add(identity)
+                    data.append(item)
+            with _cache_lock:
+                _catalog_cache[self.action] = (time.time(), data, data_shards)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.error = e
+        finally:
+            with _cache_lock:
+                if _catalog_loads.get(self.action) is self:
+                    del _catalog_loads[self.action]
+            self.done.set()
+
+def _start_load(action):
+    """Démarre (ou rejoint) le chargement en arrière-plan du catalogue action."""
+    with _cache_lock:
+        load = _catalog_loads.get(action)
+        if load is None:
+            cached = _catalog_cache.get(action)
+            load = _CatalogLoad(action, cached[2] if cached else None)
+            _catalog_loads[action] = load
+            threading.Thread(target=load.run, name=f"catalog-{action}", daemon=True).start()
+    return load
+
+def get_catalog(action, max_age=None):
+    """Catalogue complet (get_vod_streams ou get_series), conservé XTREAM_CATALOG_TTL_SECONDS secondes.
+
+    max_age=0 force une requête (surveillance des épisodes), dont la réponse rafraîchit le cache.
+    Le catalogue est demandé catégorie par catégorie (XTREAM_CATALOG_SHARDED) ; un seul chargement
+    par catalogue à la fois, les appels simultanés attendent le même. En cas d'échec, le dernier
+    catalogue reçu est servi, sauf avec max_age=0.
+    """
+    max_age = XTREAM_CATALOG_TTL_SECONDS if max_age is None else max_age
+    with _cache_lock:
+        cached = _catalog_cache.get(action)
+    if cached and time.time() - cached[0] < max_age:
+        CACHE_REQUESTS.inc(cache="catalog", result="hit")
+        return cached[1]
+    CACHE_REQUESTS.inc(cache="catalog", result="miss")
+    started = time.perf_counter()
+    load = _start_load(action)
+    load.done.wait()
+    record_phase("upstream", time.perf_counter() - started)
+    if load.error is not None:
+        if cached and max_age:
+            # Fournisseur en panne : le dernier catalogue reçu plutôt qu'une erreur (sauf si max_age=0 exige une réponse fraîche)
+            CACHE_REQUESTS.inc(cache="catalog", result="stale")
+            return cached[1]
+        raise load.error
+    with _cache_lock:
+        return _catalog_cache[action][1]
+
+def get_catalog_partial(action, wait=None):
+    """Catalogue pour les pages de liste : (titres, progression), progression None si le catalogue est complet.
+
+    Un catalogue expiré est servi tel quel pendant son rechargement en arrière-plan. Sans catalogue en
+    cache, on attend le chargement au plus wait secondes (XTREAM_CATALOG_PARTIAL_WAIT_SECONDS), puis
+    on renvoie les catégories déjà reçues. Lève l'erreur du chargement si aucun titre n'a été reçu.
+    Avec XTREAM_CATALOG_TTL_SECONDS=0, le catalogue est redemandé en entier à chaque appel.
+    """
+    wait = XTREAM_CATALOG_PARTIAL_WAIT_SECONDS if wait is None else wait
+    with _cache_lock:
+        cached = _catalog_cache.get(action)
+    if cached and XTREAM_CATALOG_TTL_SECONDS <= 0:
+        return get_catalog(action, max_age=0), None
+    if cached:
+        if time.time() - cached[0] < XTREAM_CATALOG_TTL_SECONDS:
+            CACHE_REQUESTS.inc(cache="catalog", result="hit")
+        else:
+            CACHE_REQUESTS.inc(cache="catalog", result="stale")
+            if not circuit_breaker.service_open("xtream"):
+                _start_load(action)
+        return cached[1], None
+    CACHE_REQUESTS.inc(cache="catalog", result="miss")
+    started = time.perf_counter()
+    load = _start_load(action)
+    load.done.wait(wait)
+    record_phase("upstream", time.perf_counter() - started)
+    if load.done.is_set():
+        if load.error is not None:
+            raise load.error
+        with _cache_lock:
+            return _catalog_cache[action][1], None
+    items, progress = load.partial()
+    return items, progress
+
+def get_series_info(series_id, max_age=None):
+    """Détails d'une série (get_series_info), avec les épisodes décodés s'ils sont fournis en chaîne JSON.
+
+    Les réponses sont conservées en mémoire XTREAM_SERIES_INFO_TTL_SECONDS secondes (ou max_age) :
+    plusieurs NFO ou téléchargements d'une même série ne refont pas la requête. Si Xtream ne répond pas
+    (ou si son disjoncteur est ouvert), la dernière réponse est servie, sauf avec max_age=0.
+    """
+    max_age = XTREAM_SERIES_INFO_TTL_SECONDS if max_age is None else max_age
+    key = str(series_id)
+    with _cache_lock:
+        cached = _series_info_cache.get(key)
+    if cached and time.time() - cached[0] < max_age:
+        CACHE_REQUESTS.inc(cache="series_info", result="hit")
+        return cached[1]
+
+    CACHE_REQUESTS.inc(cache="series_info", result="miss")
+    try:
+        data = xtream_get("get_series_info", series_id=series_id)
+    except (requests.exceptions.RequestException, ValueError):
+        if cached is None or not max_age:
+            raise
+        # Fournisseur en panne : dernière version reçue, quel que soit son âge (sauf si max_age=0 exige une réponse fraîche)
+        CACHE_REQUESTS.inc(cache="series_info", result="stale")
+        return cached[1]
+    if isinstance(data.get('episodes'), str):
+        data['episodes'] = json.loads(data['episodes'])
+    with _cache_lock:
+        _series_info_cache[key] = (time.time(), data)
+    return data
+
+def invalidate_series_info(series_id=None):
+    with _cache_lock:
+        if series_id is None:
+            _series_info_cache.clear()
+        else:
+            _series_info_cache.pop(str(series_id), None)
+
+def clear_caches():
+    """Vide les caches mémoire (catalogues et détails de série) : le prochain appel interroge Xtream."""
+    with _cache_lock:
+        _catalog_cache.clear()
+        _series_info_cache.clear()